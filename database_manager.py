@@ -11,6 +11,13 @@ load_dotenv()
 
 USE_TURSO = os.getenv('USE_TURSO', 'false').lower() == 'true'
 
+def _connect_local():
+    """Local SQLite connection in WAL mode, so each commit is a log append rather than a full fsync"""
+    conn = sqlite3.connect('database/risk_register.db')
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable under WAL; skips the per-commit fsync
+    return conn
+
 def get_database_connection():
     """
     Get database connection - automatically uses Turso if USE_TURSO=true, otherwise local SQLite
@@ -23,7 +30,7 @@ def get_database_connection():
             
             if not url or not auth_token:
                 print("⚠️ Turso credentials not found, falling back to local SQLite")
-                return sqlite3.connect('database/risk_register.db')
+                return _connect_local()
             
             # Convert libsql:// to https:// for HTTP protocol (more stable than WebSocket)
             if url.startswith('libsql://'):
@@ -36,12 +43,12 @@ def get_database_connection():
             return TursoConnection(client)
         except ImportError:
             print("⚠️ libsql_client not installed, falling back to local SQLite")
-            return sqlite3.connect('database/risk_register.db')
+            return _connect_local()
         except Exception as e:
             print(f"⚠️ Turso connection failed: {e}, falling back to local SQLite")
-            return sqlite3.connect('database/risk_register.db')
+            return _connect_local()
     else:
-        return sqlite3.connect('database/risk_register.db')
+        return _connect_local()
 
 
 class TursoConnection:
@@ -765,7 +765,8 @@ def render_followup_page(api_key: str):
                 import html
                 def clean_html_recursive(obj):
                     if isinstance(obj, str):
-                        return html.unescape(obj)
+                        # ⚡ Most strings carry no entity - skip the call entirely
+                        return html.unescape(obj) if '&' in obj else obj
                     elif isinstance(obj, dict):
                         return {k: clean_html_recursive(v) for k, v in obj.items()}
                     elif isinstance(obj, list):
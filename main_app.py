@@ -10,14 +10,21 @@ import google.generativeai as genai
 from pathlib import Path
 import tempfile
 import os
-import time
 from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import json
+import orjson
 import pickle
+import sqlite3
+import html
+import ast
+import traceback
+import re
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px 
-from datetime import datetime
+from datetime import datetime, date
 
 # Document processing libraries
 from docx import Document
@@ -35,12 +42,14 @@ import sys
 sys.path.insert(0, str(Path(__file__).parent))
 
 from phase2_risk_resolver.config.settings import KNOWLEDGE_BASE_DIR, OUTPUTS_DIR
-from phase2_risk_resolver.tools.rag_tool import initialize_rag
+from phase2_risk_resolver.tools.rag_tool import initialize_rag, update_rag_api_key
+from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register, RISK_COUNTER_DDL, LAST_RISK_NUM_SQL
 
 # API Key Management with Auto-Rotation
 from api_key_manager import get_api_key_manager, get_active_api_key
 from agent_executor import execute_agent_with_retry, execute_all_agents_with_retry
 from database_manager import get_database_connection
+from email_sender import send_questionnaire_email, get_all_pending_questionnaires
 
 # Session Management - Auto-save and restore
 from session_manager import get_session_manager, auto_save_session, show_session_restore_ui
@@ -54,6 +63,7 @@ from phase2_risk_resolver.agents.agent_3_control import run_control_discovery
 from phase2_risk_resolver.agents.agent_4_decision import run_risk_decision
 from phase2_risk_resolver.agents.agent_4_acceptance_questionnaire import generate_acceptance_questionnaire
 from phase2_risk_resolver.agents.agent_4_acceptance_form import generate_acceptance_form
+from phase2_risk_resolver.agents.agent_4_treatment_plan import generate_treatment_plan
 from phase2_risk_resolver.agents.agent_4_transfer_questionnaire import generate_transfer_questionnaire
 from phase2_risk_resolver.agents.agent_4_transfer_form import generate_transfer_form
 from phase2_risk_resolver.agents.agent_4_terminate_questionnaire import generate_terminate_questionnaire
@@ -80,8 +90,7 @@ params = st.query_params
 is_questionnaire_form = params.get('page') == 'form' and params.get('token')
 
 if not is_questionnaire_form:
-    if 'authenticated' not in st.session_state:
-        st.session_state.authenticated = False
+    st.session_state.setdefault('authenticated', False)
     
     if not st.session_state.authenticated:
         st.title("🔒 Risk Assessment System")
@@ -142,7 +151,6 @@ try:
 except Exception as e:
     # 🔧 DEBUG: Always show error to diagnose cloud issue
     st.error(f"⚠️ Follow-up check failed: {str(e)}")
-    import traceback
     with st.expander("🔍 Debug Info"):
         st.code(traceback.format_exc())
 
@@ -158,42 +166,25 @@ KB_VECTORS_FILE = KNOWLEDGE_BASE_DIR / "document_vectors.pkl"
 KB_METADATA_FILE = KNOWLEDGE_BASE_DIR / "metadata.json"
 
 # Initialize session state - UPDATED VARIABLE NAMES
-if 'documents' not in st.session_state:
-    st.session_state.documents = []
-if 'processed' not in st.session_state:
-    st.session_state.processed = False
-if 'vectorizer' not in st.session_state:
-    st.session_state.vectorizer = None
-if 'document_vectors' not in st.session_state:
-    st.session_state.document_vectors = None
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'kb_loaded' not in st.session_state:
-    st.session_state.kb_loaded = False
-if 'rag_initialized' not in st.session_state:
-    st.session_state.rag_initialized = False
-if 'current_page' not in st.session_state:
-    st.session_state.current_page = "Home"
-if 'sample_assets' not in st.session_state:
-    st.session_state.sample_assets = []
-if 'selected_asset' not in st.session_state:
-    st.session_state.selected_asset = None
+st.session_state.setdefault('documents', [])
+st.session_state.setdefault('processed', False)
+st.session_state.setdefault('vectorizer', None)
+st.session_state.setdefault('document_vectors', None)
+st.session_state.setdefault('chat_history', [])
+st.session_state.setdefault('kb_loaded', False)
+st.session_state.setdefault('rag_initialized', False)
+st.session_state.setdefault('current_page', "Home")
+st.session_state.setdefault('sample_assets', [])
+st.session_state.setdefault('selected_asset', None)
 
 # UPDATED SESSION STATE - Changed variable names for truly agentic agents
-if 'questionnaire_result' not in st.session_state:
-    st.session_state.questionnaire_result = None
-if 'questionnaire_answers' not in st.session_state:
-    st.session_state.questionnaire_answers = {}
-if 'impact_result' not in st.session_state:  # Changed from cia_result
-    st.session_state.impact_result = None
-if 'risk_result' not in st.session_state:
-    st.session_state.risk_result = None
-if 'control_result' not in st.session_state:
-    st.session_state.control_result = None
-if 'decision_result' not in st.session_state:
-    st.session_state.decision_result = None
-if 'output_result' not in st.session_state:  # Changed from excel_result
-    st.session_state.output_result = None
+st.session_state.setdefault('questionnaire_result', None)
+st.session_state.setdefault('questionnaire_answers', {})
+st.session_state.setdefault('impact_result', None)  # Changed from cia_result
+st.session_state.setdefault('risk_result', None)
+st.session_state.setdefault('control_result', None)
+st.session_state.setdefault('decision_result', None)
+st.session_state.setdefault('output_result', None)  # Changed from excel_result
 
 
 # ===================================================================
@@ -204,7 +195,12 @@ def format_risk_rating(rating):
     """Format risk rating to ensure it's always X/5 format (not X/5/5)"""
     if not rating:
         return "N/A"
-    rating_str = str(rating)
+    # Memoized on the string form, so unhashable ratings (e.g. dicts from agent JSON) still work
+    return _format_rating_str(str(rating))
+
+@lru_cache(maxsize=256)
+def _format_rating_str(rating_str):
+    """X/5 form of a non-empty rating string"""
     # If already has /5, return as-is
     if '/5' in rating_str:
         # Remove duplicate /5 if present (e.g., "4/5/5" -> "4/5")
@@ -213,6 +209,679 @@ def format_risk_rating(rating):
     # Otherwise add /5
     return f"{rating_str}/5"
 
+_RATING_NUMBER = re.compile(r'[-+]?\d*\.?\d+')
+
+def _parse_rating(value, default=0.0):
+    """Numeric part of a risk rating such as 4, '4/5' or '4/5 (High)', or default when there is none"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _RATING_NUMBER.search(str(value or ''))
+    return float(match.group(0)) if match else default
+
+@st.cache_resource
+def _risk_db():
+    """Shared risk register connection, opened once per server process instead of per rerun"""
+    conn = sqlite3.connect('database/risk_register.db', check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")  # Reads of the small risks table come from the page map, not read()
+    # ⚡ Expression index so the next-id lookup reads one index entry instead of scanning risks
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_risks_num ON risks(CAST(SUBSTR(risk_id, 5) AS INTEGER)) "
+        "WHERE risk_id LIKE 'RSK-%'"
+    )
+    conn.execute(RISK_COUNTER_DDL)
+    conn.execute("PRAGMA optimize")  # Refresh planner statistics so the new index is picked up
+    return conn
+
+# ⚡ Read once per process: every save in this app calls _next_risk_id.clear(), and the id
+# actually written is allocated atomically by allocate_risk_id, so this is only a preview
+@st.cache_data(show_spinner=False)
+def _next_risk_id():
+    """Next free RSK-### id from the risk register (cached until the next save clears it)"""
+    # Same floor as allocate_risk_id: the counter or the highest existing id, whichever is larger
+    result = _risk_db().execute(
+        f"SELECT MAX(COALESCE((SELECT last FROM risk_counter WHERE id = 1), 0), COALESCE({LAST_RISK_NUM_SQL}, 0))"
+    ).fetchone()
+    next_num = result[0] + 1
+    return f"RSK-{next_num:03d}"
+
+def _pending_questionnaire_row(token):
+    """(answers, questions, agent_results) JSON columns of one emailed questionnaire, or None (shared cached connection)"""
+    return _risk_db().execute(
+        "SELECT answers, questions, agent_results FROM pending_questionnaires WHERE token = ?", (token,)
+    ).fetchone()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_treatment_plan(risk_data_json, agent_3_json):
+    """Treatment plan LLM call memoized on canonical JSON of its inputs"""
+    return execute_agent_with_retry(
+        generate_treatment_plan, "Treatment Plan",
+        agent_3_results=json.loads(agent_3_json), risk_data=json.loads(risk_data_json)
+    )
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_acceptance_questionnaire(risk_context_json):
+    """Acceptance questionnaire LLM call memoized on canonical JSON of the risk context"""
+    return execute_agent_with_retry(
+        generate_acceptance_questionnaire, "Acceptance Q",
+        risk_context=json.loads(risk_context_json)
+    )
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_terminate_questionnaire(risk_context_json):
+    """Termination questionnaire LLM call memoized on canonical JSON of the risk context"""
+    return execute_agent_with_retry(
+        generate_terminate_questionnaire, "Termination Questionnaire Generator",
+        risk_context=json.loads(risk_context_json)
+    )
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_terminate_form(risk_context_json, answers_json, structure_json):
+    """Termination form LLM call memoized on canonical JSON of its inputs"""
+    return execute_agent_with_retry(
+        generate_terminate_form, "Termination Form Generator",
+        risk_context=json.loads(risk_context_json), questionnaire_responses=json.loads(answers_json),
+        questionnaire_structure=json.loads(structure_json)
+    )
+
+@st.cache_data(show_spinner=False)
+def _render_action_fields(action_json):
+    """Pre-format the display strings for one treatment action (only fields that are set)"""
+    a = json.loads(action_json)
+    out = {}
+    if a.get('description_of_activities'):
+        out['activities'] = f"**Activities:** {a['description_of_activities']}"
+    if a.get('necessary_resources'):
+        out['resources'] = f"**Resources:** {a['necessary_resources']}"
+    if a.get('method_for_evaluation'):
+        out['evaluation'] = f"**Success Criteria:** {a['method_for_evaluation']}"
+
+    # Scheduling/ownership metadata goes out as one markdown block instead of a caption per field
+    details = []
+    if a.get('implementation_priority'):
+        details.append(f"🔥 **Priority:** {a['implementation_priority']}")
+    if a.get('implementation_responsibility'):
+        details.append(f"👤 **Responsible:** {a['implementation_responsibility']}")
+    if a.get('estimated_cost'):
+        details.append(f"💰 **Cost:** {a['estimated_cost']}")
+    if a.get('proposed_start_date'):
+        details.append(f"📅 **Start:** {a['proposed_start_date']}")
+    if a.get('proposed_completion_date'):
+        details.append(f"⏱️ **Complete:** {a['proposed_completion_date']}")
+    if a.get('estimated_duration_days'):
+        details.append(f"⏳ **Duration:** {a['estimated_duration_days']} days")
+    if a.get('expected_risk_reduction'):
+        details.append(f"📉 **Expected Risk Reduction:** {a['expected_risk_reduction']}")
+    if details:
+        out['details'] = "  \n".join(details)
+    return out
+
+def _threat_index():
+    """Agent 2 threats keyed by threat name, rebuilt only when risk_result is replaced"""
+    risk_result = st.session_state.get('risk_result')
+    # Hold the result itself and compare with `is` - a bare id() can be reused by a replacement dict
+    cached = st.session_state.get('_threat_index')
+    if cached and cached[0] is risk_result:
+        return cached[1]
+    # reversed() so the first threat wins on duplicate names, like the old linear scan
+    index = {
+        t.get('threat'): t for t in reversed((risk_result or {}).get('threat_risk_quantification', []))
+    }
+    st.session_state._threat_index = (risk_result, index)
+    return index
+
+def _agent3_first_threat():
+    """First Agent 3 threat evaluation, re-read only when control_result is replaced"""
+    control_result = st.session_state.get('control_result')
+    cached = st.session_state.get('_agent3_first_threat')
+    if cached and cached[0] is control_result:
+        return cached[1]
+    first_threat = ((control_result or {}).get('threat_control_evaluation') or [{}])[0]
+    st.session_state._agent3_first_threat = (control_result, first_threat)
+    return first_threat
+
+def _rtp_key_questions(questions_sections):
+    """RTP treatment-decision and control-selection questions, looked up by section id"""
+    sections_by_id = {s.get('section_id'): s for s in questions_sections}
+    decision_question = control_selection_question = None
+    # Last match wins, like the old section-by-section scan
+    for q in sections_by_id.get('s1_treatment_decision', {}).get('questions', []):
+        qid = q.get('question_id', '').lower()
+        if 'treatment_option' in qid or 'select_treatment' in qid:
+            decision_question = q
+    for q in sections_by_id.get('s2_treatment_details_treat', {}).get('questions', []):
+        if 'proposed_controls' in q.get('question_id', '').lower() or 'controls' in q.get('question_text', '').lower():
+            control_selection_question = q
+    return decision_question, control_selection_question
+
+def _email_agent_results(threat_name, threat_data):
+    """Agent 1-3 results stored with an emailed decision questionnaire, with the ORIGINAL Agent 2 threat data"""
+    state = st.session_state
+    return {
+        'agent_1': state.get('impact_result', {}),
+        'agent_2': state.get('risk_result', {}),
+        'agent_3': state.get('control_result', {}),
+        'selected_asset': state.get('selected_asset', {}),
+        'threat_data': _threat_index().get(threat_name, threat_data)
+    }
+
+_QUESTION_MARKUP = re.compile(r'\*\*|_')
+
+def _clean_question_text(text):
+    """Strip markdown bold/underscores from a question label and collapse whitespace"""
+    return ' '.join(_QUESTION_MARKUP.sub('', str(text)).split())
+
+def _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data, include_gaps=False):
+    """Risk context dict passed to the decision questionnaire and form generators"""
+    ctx = {
+        'risk_id': actual_risk_id,
+        'asset_name': selected_asset.get('asset_name', 'Unknown'),
+        'threat_name': threat_name,
+        'inherent_risk_rating': threat_data.get('risk_rating', 0),
+        'residual_risk_rating': threat_data.get('residual_risk', 0)
+    }
+    if include_gaps:
+        ctx['control_gaps'] = threat_data.get('control_gaps', [])
+    return ctx
+
+def _first(d, keys, default=None):
+    """Value of the first key present (not None) in d - stops at the primary key instead of evaluating every fallback"""
+    for k in keys:
+        v = d.get(k)
+        if v is not None:
+            return v
+    return default
+
+def _select_labels(options):
+    """Selectbox labels for a select/dropdown question's options"""
+    return [opt.get('label', opt.get('value', str(opt))) if isinstance(opt, dict) else str(opt) for opt in options]
+
+@st.cache_data(show_spinner=False)
+def _normalize_questionnaire(q_json):
+    """Resolve the questionnaire schema variants ('questions'/'fields', 'question_text'/'question'/'text',
+    'question_id'/'id', ...) once into a flat per-section structure with cleaned labels"""
+    q = json.loads(q_json)
+    sections = []
+    for section_idx, section in enumerate(q.get('sections', [])):
+        fields = []
+        for q_idx, qu in enumerate(_first(section, ('questions', 'fields'), [])):
+            fields.append({
+                'q_idx': q_idx,
+                'id': _first(qu, ('question_id', 'id')) or f'Q{section_idx}_{q_idx}',
+                'text': _clean_question_text(_first(qu, ('question_text', 'question', 'text'), 'Question')),
+                'type': _first(qu, ('question_type', 'type'), 'text'),
+                'help': qu.get('help_text', ''),
+                'placeholder': qu.get('placeholder', ''),
+                'required': qu.get('required', False),
+                'options': qu.get('options', []),
+                'value': qu.get('value', '')
+            })
+        sections.append({
+            'title': _first(section, ('section_title', 'title'), ''),
+            'help': _first(section, ('help_text', 'description'), ''),
+            'fields': fields
+        })
+    return sections
+
+# Placeholder token in a display field's value / question id fragment -> risk attribute it shows
+# Value the questionnaire generators emit where the real Risk ID belongs
+_RISK_ID_PLACEHOLDER = 'AI_GENERATED_RISK_ID'
+
+_DISPLAY_PLACEHOLDERS = (('RISK_ID', 'risk_id'), ('RISK_CATEGORY', 'risk_category'), ('RISK_DESCRIPTION', 'risk_description'))
+
+def _acceptance_structure(q, threat_key):
+    """Per-threat questionnaire structure with widget keys and labels stamped on each field.
+    
+    Built once per threat and kept in session state, so the render and the
+    answer-collection passes reuse the same precomputed keys.
+    """
+    structure_key = f"accept_q_{threat_key}_structure"
+    structure = st.session_state.get(structure_key)
+    if structure is None:
+        structure = _normalize_questionnaire(_canonical_json(q))
+        for section_idx, section in enumerate(structure):
+            for field in section['fields']:
+                # Section and question index keep the key unique
+                field['key'] = f"acc_{threat_key}_s{section_idx}_q{field['q_idx']}_{field['id']}"
+                field['label'] = f"{field['text']} {'*' if field['required'] else ''}"
+                if field['type'] == 'display':
+                    # Which risk attribute a display-only field shows, first match wins
+                    value_upper = str(field['value']).upper()
+                    q_id_lower = field['id'].lower()
+                    field['fills'] = next(
+                        (attr for token, attr in _DISPLAY_PLACEHOLDERS if token in value_upper or attr in q_id_lower), None
+                    )
+                if field['type'] in ['select', 'dropdown']:
+                    field['option_labels'] = _select_labels(field['options'])
+                if field['type'] in ['checkbox', 'multiselect']:
+                    # Display name (markdown stripped) and submitted answer value for each option
+                    field['option_names'] = [
+                        str(_first(opt, ('label', 'control_name', 'gap_description')) or f'Control {idx+1}').replace('**', '')
+                        if isinstance(opt, dict) else str(opt)
+                        for idx, opt in enumerate(field['options'])
+                    ]
+                    # Numbered so duplicate names stay distinct multiselect choices
+                    field['option_choices'] = [f"{idx+1}. {name}" for idx, name in enumerate(field['option_names'])]
+                    field['option_values'] = [
+                        _first(opt, ('label', 'control_name')) or str(opt) if isinstance(opt, dict) else str(opt)
+                        for opt in field['options']
+                    ]
+                    # Details markdown of every control option, rendered as one element
+                    details = [
+                        f"#### 🛡️ {name}\n\n{_control_option_markdown(opt)}"
+                        for name, opt in zip(field['option_names'], field['options']) if isinstance(opt, dict)
+                    ]
+                    field['details_count'] = len(details)
+                    field['details_md'] = "\n\n---\n\n".join(details)
+        st.session_state[structure_key] = structure
+    return structure
+
+def _collect_acceptance_answers(structure):
+    """Submitted ACCEPT questionnaire answers keyed by question id, in one pass over the precomputed fields"""
+    state = st.session_state
+
+    def answer(field):
+        if 'option_values' in field:
+            option_values = field['option_values']
+            return [option_values[idx] for idx in state.get(field['key'], [])]
+        val = state.get(field['key'], '')
+        # Convert date objects to strings
+        return val.isoformat() if isinstance(val, date) else val
+
+    return {field['id']: answer(field) for section in structure for field in section['fields']}
+
+def _unescape_form(obj):
+    """Unescape HTML entities in every string of an agent form (done once when the form is stored)"""
+    if isinstance(obj, str):
+        # ⚡ Most strings carry no entity - skip the call entirely
+        return html.unescape(obj) if '&' in obj else obj
+    elif isinstance(obj, dict):
+        return {k: _unescape_form(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_unescape_form(item) for item in obj]
+    return obj
+
+# First non-space char is { or [ - checked without allocating a stripped copy
+_LOOKS_STRUCTURED = re.compile(r'\s*[\[{]')
+
+def _normalize_form(obj):
+    """Single pass over an agent form: unescape HTML entities and parse stringified JSON/dicts"""
+    if isinstance(obj, str):
+        text = html.unescape(obj) if '&' in obj else obj
+        if _LOOKS_STRUCTURED.match(text):
+            try:
+                return _normalize_form(json.loads(text))
+            except Exception:
+                try:
+                    return _normalize_form(ast.literal_eval(text))
+                except Exception:
+                    pass
+        return text
+    elif isinstance(obj, dict):
+        return {k: _normalize_form(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_normalize_form(item) for item in obj]
+    return obj
+
+_SEVERITY_ICONS = {"CRITICAL": "🔴", "HIGH": "🔴", "MEDIUM": "🟡", "LOW": "🟢"}
+
+# ⚡ Section heading emojis for the generated decision forms (built once, not per rerun)
+_FORM_SECTION_EMOJI = {'metadata': '📋', 'risk_context': '⚠️', 'engagement_project': '🏢',
+                       'compensating_controls': '🛡️', 'justification': '📝',
+                       'approvals': '✅', 'signoff': '✍️', 'transfer_details': '🔄',
+                       'third_party_information': '🏢', 'termination_details': '🚫'}
+_TRANSFER_SECTION_EMOJI = {'risk identification': '⚠️', 'risk rating': '📊', 'risk transfer': '🔄',
+                           'transfer management': '👥', 'ownership': '👥', 'review': '👥'}
+_TRANSFER_SECTION_EMOJI_RE = re.compile('|'.join(map(re.escape, _TRANSFER_SECTION_EMOJI)))
+# Ordered: the first keyword found in a TERMINATE section title picks its emoji
+_TERMINATE_SECTION_EMOJI = (('information', '📊'), ('identification', '📊'), ('termination', '🚫'), ('details', '🚫'),
+                            ('approval', '✅'), ('action', '✅'), ('status', '🔒'), ('closure', '🔒'))
+
+def _normalize_form_sections(sections):
+    """Resolve a TRANSFER/TERMINATE questionnaire's question schema variants once into fixed keys per field"""
+    normalized = []
+    for section_idx, section in enumerate(sections):
+        fields = []
+        for q_idx, question in enumerate(_first(section, ('questions', 'fields'), [])):
+            options = question.get('options', [])
+            text = question.get('field_name') or question.get('text') or question.get('question_text') or question.get('question') or question.get('label') or question.get('description', 'Question')
+            text_lower = text.lower()
+            value = _first(question, ('value', 'default_value'), '')
+            fields.append({
+                'id': _first(question, ('id', 'question_id', 'field_id', 'field_name'), f'Q{section_idx}_{q_idx}'),
+                # CRITICAL: field_name IS the question text for TRANSFER and TERMINATE questionnaires
+                'text': text,
+                'type': _first(question, ('type', 'question_type', 'field_type'), 'text'),
+                'help': _first(question, ('help_text', 'help'), ''),
+                'required': question.get('required', False),
+                'options': options,
+                # Selectbox labels, used by select/dropdown questions
+                'option_labels': _select_labels(options),
+                'value': value,
+                # Risk ID placeholder / risk-id question flags, so the render loop skips the string scans
+                'risk_id_placeholder': _RISK_ID_PLACEHOLDER in str(value),
+                'asks_risk_id': 'risk' in text_lower and 'id' in text_lower,
+                'min': _first(question, ('min', 'min_value'), 0)
+            })
+        normalized.append({
+            'title': section.get('title') or section.get('section_title', 'Section'),
+            'description': section.get('description', ''),
+            'fields': fields
+        })
+    return normalized
+
+def _control_option_markdown(opt):
+    """Description, gap evidence and control details of one questionnaire option as a single markdown block"""
+    parts = []
+    # Show description or gap details
+    if opt.get('description'):
+        parts.append("> " + str(opt['description']).replace('**', ''))
+    elif opt.get('gap_description'):
+        parts.append("> **Gap:** " + str(opt['gap_description']).replace('**', ''))
+    # Evidence, impact, severity for control gaps
+    if opt.get('evidence'):
+        parts.append(f"📋 **Evidence:** {opt['evidence']}")
+    if opt.get('impact'):
+        parts.append(f"⚠️ **Impact:** {opt['impact']}")
+    if opt.get('severity'):
+        parts.append(f"{_SEVERITY_ICONS.get(opt['severity'], '⚪')} **Severity:** {opt['severity']}")
+    # Control details (for treatment controls)
+    details = [
+        f"{icon} {label}: {opt[field]}"
+        for icon, label, field in (
+            ("🔥", "Priority", 'priority'), ("💰", "Cost", 'cost'), ("🏷️", "Type", 'control_type'),
+            ("⏱️", "Timeline", 'timeline'), ("📉", "Risk Reduction", 'risk_reduction'), ("⚙️", "Complexity", 'complexity')
+        )
+        if opt.get(field)
+    ]
+    if details:
+        parts.append(" · ".join(details))
+    if opt.get('addresses_gap'):
+        parts.append(f"⚠️ **Addresses Gap:** {opt['addresses_gap']}")
+    return "\n\n".join(parts)
+
+def _coerce_selected_controls(form):
+    """🔧 FIX: Turn a numeric-keyed selected_controls dict {0: {...}, 1: {...}} into a list (in place)"""
+    comp = form.get('compensating_controls')
+    if isinstance(comp, dict):
+        sc = comp.get('selected_controls')
+        if isinstance(sc, dict) and sc:
+            keys = sc.keys()
+            # int keys (common LLM output) skip the str()/isdigit() walk
+            if all(isinstance(k, int) for k in keys) or all(isinstance(k, str) and k.isdigit() for k in keys):
+                comp['selected_controls'] = [sc[k] for k in sorted(keys, key=int)]
+    return form
+
+def _fields_markdown(d, bullet=""):
+    """One markdown string of **Title Case Key:** value lines (one element instead of a write per key)"""
+    return "\n\n".join(f"{bullet}**{k.replace('_', ' ').title()}:** {v}" for k, v in d.items())
+
+def _form_section_markdown(emoji, title, fields):
+    """One markdown string for a generated form section: heading plus a **field_name:** value line per field"""
+    body = "\n\n".join(
+        f"**{f.get('field_name', 'Field')}:** {f.get('value', 'N/A')}" for f in fields if isinstance(f, dict)
+    )
+    return f"### {emoji} {title}\n\n{body}"
+
+def _display_form_value(k, v):
+    """Display one field of a generated decision form, whatever its value type"""
+    field_name = k.replace('_', ' ').title()
+
+    if isinstance(v, dict):
+        # Nested dict - show as grouped section
+        st.markdown(f"**{field_name}:**\n\n" + _fields_markdown(v, bullet="  • "))
+    elif isinstance(v, list) and v and isinstance(v[0], dict):
+        st.markdown(f"**{field_name}:**")
+        if all(isinstance(item, dict) and not any(isinstance(iv, (dict, list)) for iv in item.values()) for item in v):
+            # ⚡ Flat list of dicts - one table instead of an expander + write per field per item
+            df = pd.DataFrame(v)
+            df.columns = [str(c).replace('_', ' ').title() for c in df.columns]
+            st.dataframe(df, use_container_width=True, hide_index=True)
+            return
+        # Nested values don't fit in a cell - show each item in an expander
+        for idx, item in enumerate(v, 1):
+            if not isinstance(item, dict):
+                st.write(f"- {item}")
+                continue
+            label = item.get('name') or item.get('label') or item.get('gap_description') or item.get('control_name') or item.get('description') or f"Item {idx}"
+            if len(str(label)) > 50:
+                label = str(label)[:50] + "..."
+            with st.expander(f"📋 {label}", expanded=False):
+                st.markdown(_fields_markdown(item))
+    elif isinstance(v, list):
+        st.write(f"**{field_name}:** {', '.join(str(x) for x in v)}")
+    else:
+        st.write(f"**{field_name}:** {v}")
+
+def _canonical_json(data):
+    """Stable JSON string used as the cache key for agent inputs"""
+    return json.dumps(data, sort_keys=True, default=str)
+
+def _json_download(data, slot=None):
+    """Indented JSON bytes for st.download_button - orjson, since the payload is re-encoded on every rerun.
+    
+    With a slot, the bytes are kept in session state until a different object
+    is passed for that slot, so reruns with an unchanged result skip encoding.
+    """
+    slot_key = f"_json_download_{slot}"
+    if slot is not None:
+        cached = st.session_state.get(slot_key)
+        # Identity, not id(): the cached tuple holds the object, so its id can't be reused
+        if cached is not None and cached[0] is data:
+            return cached[1]
+    try:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    except TypeError:
+        # orjson rejects a few values the stdlib accepts (e.g. ints wider than 64 bits)
+        payload = json.dumps(data, indent=2).encode()
+    if slot is not None:
+        st.session_state[slot_key] = (data, payload)
+    return payload
+
+def _rtp_summary(result):
+    """Decision-summary values of an RTP questionnaire, re-derived only when result or control_result is replaced"""
+    control_result = st.session_state.get('control_result')
+    cached = st.session_state.get('_rtp_summary')
+    if cached and cached[0] is result and cached[1] is control_result:
+        return cached[2]
+
+    # Extract threat info from first section (handle both 'questions' and 'sections' structure)
+    questions_sections = result.get('questions', result.get('sections', []))
+
+    # NEW: Extract threat info from risk_context if sections structure
+    if 'sections' in result and 'risk_context' in result:
+        # New structure: threat info is in risk_context
+        risk_ctx = result['risk_context']
+
+        # Extract risk_rating - try multiple field names
+        risk_rating_str = risk_ctx.get('risk_rating', risk_ctx.get('current_risk_rating', '0/5'))
+        risk_rating = _parse_rating(risk_rating_str)
+        if isinstance(risk_rating_str, str) and '/' in risk_rating_str:
+            risk_level_display = risk_rating_str
+        else:
+            risk_level_display = f"{risk_rating}/5"
+
+        # Extract residual_risk - try multiple field names
+        residual_risk_str = risk_ctx.get('residual_risk_after_existing_controls', 
+                                        risk_ctx.get('residual_risk_rating', 
+                                        risk_ctx.get('residual_risk', '0/5')))
+        residual_risk = _parse_rating(residual_risk_str)
+
+        # Control gaps - check in risk_context first, then Agent 3
+        control_gaps = risk_ctx.get('control_gaps_identified', [])
+        if not control_gaps:
+            control_gaps = _agent3_first_threat().get('control_gaps', [])
+
+        threat_info = {
+            'threat_name': risk_ctx.get('risk_description', 'Unknown'),
+            'risk_rating': risk_rating,
+            'risk_level': risk_level_display,
+            'residual_risk': residual_risk,
+            'control_gaps': control_gaps
+        }
+
+        # Find decision question in sections
+        decision_question, control_selection_question = _rtp_key_questions(questions_sections)
+
+    elif questions_sections:
+        # Old structure: threat info in first section
+        first_section = questions_sections[0]
+        threat_info = first_section.get('threat_info', {})
+        questions = first_section.get('questions', [])
+
+        # Find Q1.1 (treatment decision question) and Q1.2 (controls)
+        questions_by_id = {q.get('question_id'): q for q in questions}
+        decision_question = questions_by_id.get('Q1.1')
+        control_selection_question = questions_by_id.get('Q1.2')
+    else:
+        threat_info = {}
+        decision_question = None
+        control_selection_question = None
+
+    # Numeric metric values - risk_level may be a string like "4/5 (High)", residual like "1.58/5"
+    risk_rating = threat_info.get('risk_rating', 0)
+    risk_level_display = threat_info.get('risk_level', 'N/A')
+    if isinstance(risk_level_display, str) and '/' in risk_level_display:
+        risk_rating = _parse_rating(risk_level_display, risk_rating)
+
+    summary = {
+        'threat_info': threat_info,
+        'decision_question': decision_question,
+        'control_selection_question': control_selection_question,
+        'risk_rating': risk_rating,
+        'residual_risk': _parse_rating(threat_info.get('residual_risk', 0)),
+        'control_gaps': threat_info.get('control_gaps', [])
+    }
+    st.session_state._rtp_summary = (result, control_result, summary)
+    return summary
+
+# Background tints of st.info / st.success / st.warning, for cards rendered as one HTML block
+_CARD_TINT = {'info': 'rgba(28,131,225,0.1)', 'success': 'rgba(33,195,84,0.1)', 'warning': 'rgba(255,189,69,0.2)'}
+
+def _card_box(text, tint):
+    """Escaped text in an st.info/success/warning-style box"""
+    body = html.escape(str(text)).replace('\n', '<br>')
+    return f'<div style="background:{_CARD_TINT[tint]};padding:0.75rem 1rem;border-radius:0.5rem;margin-bottom:0.75rem">{body}</div>'
+
+def _decision_card_html(opt):
+    """Static body of an RTP decision-option card as one HTML string"""
+    parts = ["<b>Description:</b>", _card_box(opt.get('description', ''), 'info')]
+
+    recommendation = opt.get('recommendation', '')
+    if recommendation:
+        tint = 'success' if "RECOMMENDED" in recommendation or "STRONGLY" in recommendation else 'warning'
+        parts += ["<b>Recommendation:</b>", _card_box(recommendation, tint)]
+
+    consequences = opt.get('consequences', '')
+    if consequences:
+        parts.append(f"<b>Consequences:</b><p>{html.escape(str(consequences))}</p>")
+
+    cost = opt.get('estimated_cost', '')
+    timeline = opt.get('typical_timeline', '')
+    cost_html = f"<b>💰 Estimated Cost:</b><br><code>{html.escape(str(cost))}</code>" if cost else ""
+    timeline_html = f"<b>⏱️ Timeline:</b><br><code>{html.escape(str(timeline))}</code>" if timeline else ""
+    if cost or timeline:
+        parts.append(f'<div style="display:flex;gap:1rem"><div style="flex:1">{cost_html}</div><div style="flex:1">{timeline_html}</div></div>')
+
+    captions = [f"{emoji} {html.escape(str(opt[k]))}" for k, emoji in (('approval_required', '✅'), ('monitoring_required', '📊')) if opt.get(k)]
+    if captions:
+        parts.append(f'<p style="font-size:0.875rem;opacity:0.6">{"<br>".join(captions)}</p>')
+    return "\n".join(parts)
+
+# ⚡ st.fragment scopes reruns to the decorated block (falls back for older Streamlit)
+_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment')
+
+
+@_fragment
+def _render_decision_option(opt, threat_key, threat_name, threat_index):
+    """Render one Agent 4 decision option; interactions rerun only this fragment"""
+    value = opt.get('value', '')
+    label = opt.get('label', '')
+    
+    # Emoji based on decision type
+    if value == 'TREAT':
+        emoji = "🔧"
+    elif value == 'ACCEPT':
+        emoji = "⚠️"
+    elif value == 'TRANSFER':
+        emoji = "✅"
+    elif value == 'TERMINATE':
+        emoji = "🚫"
+    else:
+        emoji = "✅"
+    
+    with st.expander(f"{emoji} {value} - {label}", expanded=(value == 'TREAT')):
+        st.markdown(f"**Description:**")
+        st.info(opt.get('description', 'N/A'))
+        
+        st.markdown(f"**Recommendation:**")
+        rec = opt.get('recommendation', 'N/A')
+        if 'recommended' in rec.lower():
+            st.success(rec)
+        else:
+            st.warning(rec)
+        
+        st.markdown(f"**Consequences:**")
+        st.write(opt.get('consequences', 'N/A'))
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"**💰 Cost:** {opt.get('estimated_cost', 'N/A')}")
+            st.markdown(f"**⏱️ Timeline:** {opt.get('typical_timeline', 'N/A')}")
+        with col2:
+            st.markdown(f"**✅ Approval:** {opt.get('approval_required', 'N/A')}")
+            st.markdown(f"**📊 Monitoring:** {opt.get('monitoring_required', 'N/A')}")
+        
+        # ? SELECTION BUTTON (NEW)
+        st.markdown("---")
+        if st.button(f"🎯 Select {value} for Threat {threat_index}", 
+                   key=f"select_{threat_key}_{value}",
+                   type="primary" if value == "TREAT" else "secondary",
+                   use_container_width=True):
+            # Store selection in session state
+            st.session_state.setdefault('threat_decisions', {})
+            st.session_state.threat_decisions[threat_key] = {
+                'decision': value,
+                'threat_name': threat_name,
+                'threat_index': threat_index
+            }
+            # Full-app rerun so the Decision Summary picks up the new selection
+            st.rerun()
+
+
+@st.cache_resource
+def _email_pool():
+    """Worker threads for questionnaire emails, shared across sessions"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="email")
+
+
+@_fragment(run_every=1)
+def _render_email_job(job_key):
+    """Poll a background questionnaire email and advance the workflow once it has been sent"""
+    future, recipient = st.session_state[job_key]
+    if not future.done():
+        st.info(f"📧 Sending email to {recipient}...")
+        return
+
+    del st.session_state[job_key]
+    try:
+        result = future.result()
+    except Exception as e:
+        st.session_state[f"{job_key}_error"] = (f"❌ Error: {str(e)}", e)
+        st.rerun()
+
+    if result and result.get('success'):
+        st.toast(f"✅ Email sent to {recipient} (token: {result['token']}). Completed questionnaires appear under 'Pending Questionnaires'.")
+        # ✅ Sequential workflow: Move to next threat after email send
+        st.session_state.current_decision_index += 1
+    else:
+        error_msg = result.get('error', 'Unknown error') if result else 'No response'
+        st.session_state[f"{job_key}_error"] = (f"❌ Failed to send email: {error_msg}", None)
+    st.rerun()
+
+
 # ===================================================================
 # HEATMAP VISUALIZATION FUNCTION
 # ===================================================================
@@ -596,150 +1265,1190 @@ def render_knowledge_base_page(api_key):
         st.info("ℹ️ Go to sidebar to upload and process documents")
 
 # ===================================================================
-# PAGE: RISK ASSESSMENT
+# THREAT DECISION WORKFLOW (TREAT / ACCEPT / TRANSFER / TERMINATE)
 # ===================================================================
 
-def render_risk_assessment_page(api_key):
-    """Render Risk Assessment page with complete 6-agent pipeline"""
-    st.title("🎯 Risk Assessment - Truly Agentic 6-Agent Pipeline")
-    
-    # 💾 SESSION RESTORE UI - Show at top of page
-    show_session_restore_ui()
-    
-    # Check prerequisites
-    if not st.session_state.processed:
-        st.error("❌ Knowledge Base not loaded! Please upload documents first.")
-        st.info("ℹ️ Go to 'Knowledge Base' page to upload documents")
-        return
-    
-    if not api_key:
-        st.error("❌ API Key required! Please enter your Gemini API key in the sidebar.")
-        return
+@_fragment
+def _render_acceptance_questionnaire(q, threat_key, threat_name, threat_data, actual_risk_id, risk_category, risk_description, selected_asset, api_key):
+    """Render the ACCEPT questionnaire form and its submit handler.
     
-    # Initialize RAG for agents if needed (with current API key)
-    if not st.session_state.rag_initialized:
-        with st.spinner("⏳ Initializing Truly Agentic Agent System..."):
-            try:
-                from phase2_risk_resolver.tools.rag_tool import initialize_rag
-                initialize_rag(api_key, KNOWLEDGE_BASE_DIR)
-                st.session_state.rag_initialized = True
-                st.success("✅ Agent system initialized with discovery capabilities!")
-            except Exception as e:
-                st.error(f"Failed to initialize: {str(e)}")
-                return
-    else:
-        # Re-initialize RAG with current API key if it changed
-        try:
-            from phase2_risk_resolver.tools.rag_tool import update_rag_api_key
-            update_rag_api_key(api_key)
-        except:
-            pass
+    Nested fragment: submitting the form reruns only this block until the
+    generated acceptance form is stored and the app reruns to display it.
+    """
+    # Schema variants, label cleanup and widget keys are resolved once when the questionnaire is generated
+    structure = _acceptance_structure(q, threat_key)
+
+    today = date.today()  # ⚡ One default for every date question
+
+    # Batch all questionnaire widgets in one form: edits don't rerun until submit
+    with st.form(f"acc_form_{threat_key}"):
+        # Render questionnaire sections
+        for section in structure:
+            section_title = section['title']
+            if section_title and section_title.strip().lower() != 'section':
+                st.markdown(f"### {section_title}")
+                # Show section help text
+                if section['help']:
+                    st.caption(f"ℹ️ {section['help']}")
+
+            for field in section['fields']:
+                q_text = field['text']
+                q_type = field['type']
+                q_help = field['help']
+                q_placeholder = field['placeholder']
+                options = field['options']
+                widget_key = field['key']
+                display_text = field['label']
+
+                # Handle display-only fields (AI provided) - populate with actual data
+                if q_type == 'display':
+                    # Replace placeholders with actual data (placeholder resolved once in _acceptance_structure)
+                    fills = field.get('fills')
+                    if fills == 'risk_id':
+                        display_value = actual_risk_id
+                    elif fills == 'risk_category':
+                        display_value = risk_category
+                    elif fills == 'risk_description':
+                        display_value = risk_description
+                    else:
+                        display_value = field['value']
+
+                    st.info(f"ℹ️ {q_text} {display_value}")
+                    continue
+
+                if q_type in ['text_area', 'textarea']:
+                    st.text_area(display_text, key=widget_key, help=q_help, placeholder=q_placeholder, height=100)
+                elif q_type == 'date':
+                    st.date_input(display_text, value=today, key=widget_key, help=q_help)
+                elif q_type == 'text':
+                    st.text_input(display_text, key=widget_key, help=q_help, placeholder=q_placeholder)
+                elif q_type in ['select', 'dropdown']:
+                    if options:
+                        st.selectbox(display_text, options=field['option_labels'], key=widget_key, help=q_help)
+                    else:
+                        st.text_input(display_text, key=widget_key, help=q_help, placeholder=q_placeholder)
+                elif q_type in ['checkbox', 'multiselect']:
+                    # Display question text as plain text (already cleaned)
+                    st.write(f"**{q_text}**")
+                    if q_help:
+                        st.caption(f"ℹ️ {q_help}")
+                    # ⚡ Display-only details for every control in one expander/markdown pair
+                    # (buttons can't live in a form, so details can't be lazily opened per control)
+                    if field['details_count']:
+                        with st.expander(f"🛡️ Control details ({field['details_count']})", expanded=False):
+                            st.markdown(field['details_md'])
+                    # ⚡ One widget for all options instead of a checkbox per option
+                    st.multiselect(
+                        display_text, options=range(len(options)), format_func=field['option_choices'].__getitem__,
+                        key=widget_key, label_visibility="collapsed"
+                    )
+                else:
+                    st.text_input(display_text, key=widget_key, help=q_help, placeholder=q_placeholder)
+
+        submitted = st.form_submit_button("✅ Submit & Generate Acceptance Form", type="primary")
+
+    if submitted:
+        # Collect answers using the same precomputed widget keys as rendering
+        answers = _collect_acceptance_answers(structure)
+
+        # Generate acceptance form
+        with st.spinner("🤖 Generating acceptance form..."):
+            ctx = _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data)
+            form = generate_acceptance_form(risk_context=ctx, questionnaire_answers=answers, questionnaire_structure=q, api_key=api_key)
+
+            # Store in session state (entities unescaped and stringified values parsed once, not per rerun)
+            st.session_state[f"acceptance_form_{threat_key}"] = _coerce_selected_controls(_normalize_form(form))
+            st.session_state[f"acceptance_answers_{threat_key}"] = answers
+            st.rerun()
+
+
+@_fragment
+def _render_transfer_questionnaire(transfer_sections, transfer_questionnaire, threat_key, threat_name, threat_data, actual_risk_id, selected_asset, api_key):
+    """Render the TRANSFER questionnaire and its submit handler.
     
-    st.markdown("---")
-    st.header(" Generate Intelligent Questionnaire")
+    Nested fragment: typing in one answer reruns only the questionnaire,
+    not the risk context, email option and generated form around it.
+    """
+    # Render questionnaire (NO FORM - same pattern as ACCEPT)
+    transfer_answers = {}
 
-    st.info("💡 **Don't have asset data?** Tell us what asset type you want to assess, and our AI will intelligently figure out what questions to ask!")
+    for section_idx, section in enumerate(transfer_sections):
+        st.markdown(f"##### {section['title']}")
 
-    # Pure text input - NO dropdown!
-    col1, col2 = st.columns([3, 1])
+        # Get section description if available
+        if section['description']:
+            st.caption(section['description'])
 
-    with col1:
-        st.markdown("### What Asset Do You Want to Assess?")
-        st.caption("💡 **Enter a description** (e.g., 'Database Server', 'Employee Laptop') - AI will ask for specific name and type in the questionnaire!")
-        
-        asset_type_input = st.text_input(
-            "Asset Description",
-            placeholder="e.g., Database Server, Web Application, Employee Laptop, Manufacturing Equipment, Cloud Service, Office Building, Research Lab, AI Model, Smart Contract, IoT Sensor...",
-            key="asset_type_input",
-            help="Enter a description of the asset. The AI will generate a questionnaire that asks for the specific asset name and asset type (Physical/Software/Information/Service/People)."
-        )
-        
-        # Examples to help users
-        with st.expander("💡 Need ideas? See examples"):
-            st.markdown("""
-            **Technology Assets:**
-            - Database Server, Web Application, Mobile App, API Service
-            - Cloud Infrastructure, Network Device, Firewall
-            - IoT Device, Smart Sensor, Edge Computing Node
-            
-            **Physical Assets:**
-            - Office Building, Data Center, Manufacturing Equipment
-            - Vehicle Fleet, Warehouse, Laboratory Equipment
-            
-            **Information Assets:**
-            - Customer Database, Intellectual Property, Research Data
-            - Source Code Repository, Document Management System
-            
-            **Human Assets:**
-            - Key Personnel, Executive Team, Technical Expert
-            - Contractor, Third-Party Consultant
-            
-            **Business Assets:**
-            - Business Process, Supply Chain, Vendor Relationship
-            - Brand, Reputation, Customer Relationships
-            
-            **And literally ANY other asset you can think of!**
-            The AI will figure it out! 🤖
-            """)
+        for q_idx, question in enumerate(section['fields']):
+            q_id = question['id']
+            q_text = question['text']
+            q_type = question['type']
+            q_help = question['help']
+            q_required = question['required']
+            options = question['options']
 
-    with col2:
-        st.markdown("### AI Status")
-        if asset_type_input and asset_type_input.strip():
-            st.success(f"✅ **Will assess:**\n\n{asset_type_input}")
-            st.caption("AI will intelligently determine relevant questions")
-        else:
-            st.info("ℹ️ **Generic mode**")
-            st.caption("Leave blank for generic questionnaire")
+            # Unique key with section/question indices
+            widget_key = f"transfer_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
+            default_value = st.session_state.get(widget_key, '')
 
-    # Generate button
-    generate_button_text = f"🤖 Generate Intelligent Questionnaire{' for ' + asset_type_input if asset_type_input and asset_type_input.strip() else ''}"
+            # ✅ FIX: Replace placeholder with actual Risk ID in default value
+            if not default_value or default_value == '':
+                default_value = actual_risk_id if question['risk_id_placeholder'] else question['value']
+            if question['asks_risk_id'] and default_value == '':
+                default_value = actual_risk_id
 
-    if st.button(generate_button_text, type="primary", use_container_width=True, disabled=False):
-        
-        final_asset_type = asset_type_input.strip() if asset_type_input else None
-        
-        with st.spinner(f"🤖 AI is thinking about '{final_asset_type}' and intelligently determining what questions to ask..."):
-            try:
-                result = execute_agent_with_retry(
-                    run_questionnaire_generator,
-                    "Agent 0: Questionnaire Generator",
-                    asset_type=final_asset_type
-                )
-                
-                if 'error' in result:
-                    st.error(f"❌ Error: {result['error']}")
-                    if 'raw_output' in result:
-                        with st.expander("View Raw Output"):
-                            st.text(result['raw_output'])
+            # Add required indicator
+            if q_required:
+                q_text = f"{q_text} *"
+
+            # Handle display-only fields (AI pre-filled)
+            if q_type == 'display':
+                # ✅ FIX: Replace placeholder in display fields too
+                display_value = actual_risk_id if question['risk_id_placeholder'] else question['value']
+                st.info(f"**{q_text}**\n\n{display_value}")
+                transfer_answers[q_id] = display_value
+                continue
+
+            # Render input based on type
+            if q_type in ['text_area', 'textarea']:
+                val = st.text_area(q_text, value=default_value or '', key=widget_key, help=q_help, height=100)
+                transfer_answers[q_id] = val
+            elif q_type == 'text':
+                val = st.text_input(q_text, value=default_value or '', key=widget_key, help=q_help)
+                transfer_answers[q_id] = val
+            elif q_type == 'number':
+                min_val = question['min']
+                val = st.number_input(q_text, value=float(default_value) if default_value else 0.0, key=widget_key, help=q_help, min_value=float(min_val))
+                transfer_answers[q_id] = val
+            elif q_type == 'date':
+                val = st.date_input(q_text, value=date.today(), key=widget_key, help=q_help)
+                transfer_answers[q_id] = val
+            elif q_type in ['select', 'dropdown']:
+                if options:
+                    val = st.selectbox(q_text, options=question['option_labels'], key=widget_key, help=q_help)
+                    transfer_answers[q_id] = val
                 else:
-                    st.session_state.questionnaire_result = result
-                    st.session_state.current_asset_type = final_asset_type
-                    st.success(f"✅ AI has intelligently generated a questionnaire for: {final_asset_type or 'Generic Asset'}!")
-                    st.rerun()
-                    
-            except Exception as e:
-                st.error(f"❌ Error generating questionnaire: {str(e)}")
-                import traceback
-                with st.expander("View Error Details"):
-                    st.code(traceback.format_exc())
+                    val = st.text_input(q_text, key=widget_key, help=q_help)
+                    transfer_answers[q_id] = val
+            else:
+                # Default to text input
+                val = st.text_input(q_text, key=widget_key, help=q_help)
+                transfer_answers[q_id] = val
 
-    # Display questionnaire if generated
-    if st.session_state.questionnaire_result:
-        st.markdown("---")
-        st.subheader("📝 AI-Generated Questionnaire")
-        
-        questionnaire = st.session_state.questionnaire_result
-        current_asset = st.session_state.get('current_asset_type', 'Asset')
-        
-        # 📧 EMAIL OPTION - Send questionnaire to stakeholder
-        st.info("💡 **Choose how to fill the questionnaire:**")
-        
-        col_option1, col_option2 = st.columns(2)
-        
-        with col_option1:
-            st.markdown("### 📧 Option 1: Send via Email")
-            st.caption("Send questionnaire to asset owner/stakeholder")
-            
+    # Submit button
+    if st.button(f"✅ Submit & Generate Transfer Form", key=f"submit_transfer_{threat_key}", type="primary", use_container_width=True):
+        # ⚡ The render loop above already collected every widget value and display field this run
+        # Convert dates to strings
+        transfer_answers_final = {
+            key: value.isoformat() if isinstance(value, date) else value
+            for key, value in transfer_answers.items()
+        }
+
+        # Generate transfer form with retry
+        with st.spinner("🤖 Generating transfer form..."):
+            # ✅ FIX: Use actual_risk_id from session state
+            risk_context = _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data)
+
+            transfer_form = execute_agent_with_retry(
+                generate_transfer_form,
+                "Transfer Form Generator",
+                api_key=api_key,
+                risk_context=risk_context,
+                questionnaire_responses=transfer_answers_final,
+                questionnaire_structure=transfer_questionnaire
+            )
+
+            if 'error' not in transfer_form:
+                # ✅ STORE FORM IN SESSION STATE
+                st.session_state[f"transfer_form_{threat_key}"] = _unescape_form(transfer_form)
+                st.success("✅ Transfer Form Generated!")
+                st.rerun()
+            else:
+                st.error(f"❌ Error: {transfer_form.get('error')}")
+
+
+@_fragment
+def _render_threat_decision(threat_key, threat_data, selected_asset, api_key):
+    """Render the workflow for one selected threat decision.
+    
+    Runs as a fragment so widget edits only rerun this threat's workflow;
+    saving and advancing to the next decision still reruns the whole app.
+    """
+    decision_data = st.session_state.threat_decisions[threat_key]
+    decision = decision_data['decision']
+    threat_name = decision_data['threat_name']
+    threat_index = decision_data['threat_index']
+
+    st.markdown(f"### 🎯 Threat {threat_index}: {threat_name}")
+    st.info(f"**Decision:** {decision}")
+
+    # TREAT WORKFLOW
+    if decision == "TREAT":
+        st.markdown(f"#### 🔧 Treatment Plan for: {threat_name}")
+
+        control_gaps = threat_data.get('control_gaps', [])
+        recommended_controls = threat_data.get('recommended_controls', [])
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Control Gaps", len(control_gaps))
+        with col2:
+            st.metric("Recommended Controls", len(recommended_controls))
+        with col3:
+            st.metric("Risk Rating", threat_data.get('risk_rating', 'N/A'))
+
+        if recommended_controls:
+            st.info(f"✅ Select controls to implement for **{threat_name}**:")
+
+            threat_key = f"selected_controls_{threat_index}"
+            st.session_state.setdefault(threat_key, list(range(len(recommended_controls))))
+
+            for idx, control in enumerate(recommended_controls):
+                col_check, col_content = st.columns([0.1, 0.9])
+                with col_check:
+                    selected = st.checkbox("Select", value=idx in st.session_state[threat_key], key=f"treat_ctrl_{threat_index}_{idx}", label_visibility="collapsed")
+                    if selected and idx not in st.session_state[threat_key]:
+                        st.session_state[threat_key].append(idx)
+                    elif not selected and idx in st.session_state[threat_key]:
+                        st.session_state[threat_key].remove(idx)
+                with col_content:
+                    control_name = control.get('control_name', control.get('control_id', f'Control {idx+1}'))
+                    with st.expander(f"🛡️ {control_name}", expanded=False):
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if control.get('control_type'):
+                                st.caption(f"🏷️ Type: {control['control_type']}")
+                            if control.get('priority'):
+                                st.caption(f"🔥 Priority: {control['priority']}")
+                        with col2:
+                            if control.get('rationale'):
+                                st.caption(f"💭 Rationale: {control['rationale']}")
+                        if control.get('description'):
+                            st.info(control['description'])
+                        if control.get('implementation_guidance'):
+                            st.success(f"**Implementation:** {control['implementation_guidance']}")
+                        if control.get('addresses_gap'):
+                            st.warning(f"**Addresses Gap:** {control['addresses_gap']}")
+                        if not any([control.get('description'), control.get('implementation_guidance'), control.get('addresses_gap'), control.get('rationale')]):
+                            st.caption("No additional details available")
+
+            st.caption(f"✅ {len(st.session_state[threat_key])} of {len(recommended_controls)} controls selected")
+
+            if st.button(f"🤖 Generate Treatment Plan", key=f"gen_treat_{threat_index}", type="primary"):
+                if not st.session_state[threat_key]:
+                    st.error("❌ Select at least one control!")
+                else:
+                    # ⚡ Agent returns one JSON blob after its tool loop, so show staged progress instead of a bare spinner
+                    with st.status("🤖 Generating treatment plan...", expanded=True) as gen_status:
+                        selected_controls = [recommended_controls[i] for i in st.session_state[threat_key] if i < len(recommended_controls)]
+                        st.write(f"📋 Planning for {len(selected_controls)} selected control(s)...")
+                        risk_data = {'asset_name': selected_asset.get('asset_name'), 'asset_type': selected_asset.get('asset_type'), 'threat_name': threat_name, 'risk_rating': threat_data.get('risk_rating', 0), 'selected_controls': selected_controls, 'control_gaps': control_gaps}
+                        st.write("🤖 Treatment plan agent is working...")
+                        plan = _cached_treatment_plan(_canonical_json(risk_data), _canonical_json(st.session_state.control_result))
+                        if 'error' not in plan:
+                            st.write(f"✅ {len(plan.get('treatment_actions', []))} treatment action(s) generated")
+                            gen_status.update(label="✅ Generated!", state="complete", expanded=False)
+                            st.session_state[f"treatment_plan_{threat_index}"] = plan
+                            st.rerun()
+                        else:
+                            # Don't keep failed LLM responses in the cache
+                            _cached_treatment_plan.clear()
+                            gen_status.update(label="❌ Generation failed", state="error")
+                            st.error(f"❌ {plan.get('error')}")
+        else:
+            st.warning("⚠️ No recommended controls found")
+
+        treat_key = f"treatment_plan_{threat_index}"
+        if treat_key in st.session_state:
+            st.markdown("---")
+            st.markdown("### 📋 Generated Treatment Plan")
+
+            if st.button("🔄 Regenerate", key=f"regen_treat_{threat_index}", help="Discard the cached plan and ask the AI again"):
+                _cached_treatment_plan.clear()
+                del st.session_state[treat_key]
+                st.rerun()
+
+            plan = st.session_state[treat_key]
+
+            # Display treatment plan in user-friendly format
+            if isinstance(plan, dict):
+                # Treatment Actions
+                if plan.get('treatment_actions'):
+                    st.markdown("#### 🔧 Treatment Actions")
+                    actions = plan['treatment_actions']
+                    if isinstance(actions, list):
+                        for idx, action in enumerate(actions, 1):
+                            if isinstance(action, dict):
+                                # Get control info
+                                control_id = action.get('control_id', f'ACTION-{idx}')
+                                threat = action.get('threat', 'Action')
+
+                                fields = _render_action_fields(_canonical_json(action))
+
+                                with st.expander(f"Action {idx}: {control_id} - {threat}", expanded=True):
+                                    # Description of activities
+                                    if 'activities' in fields:
+                                        st.info(fields['activities'])
+
+                                    # Key details (priority, owner, cost, dates, risk reduction)
+                                    if 'details' in fields:
+                                        st.markdown(fields['details'])
+
+                                    # Resources
+                                    if 'resources' in fields:
+                                        st.success(fields['resources'])
+
+                                    # Evaluation method
+                                    if 'evaluation' in fields:
+                                        st.warning(fields['evaluation'])
+                            else:
+                                st.write(f"{idx}. {action}")
+
+                # Summary
+                if plan.get('summary'):
+                    st.markdown("#### 📊 Summary")
+                    summary = plan['summary']
+                    # One table render instead of four separate st.metric widgets
+                    summary_df = pd.DataFrame([{
+                        "Total Actions": summary.get('total_actions', 0),
+                        "Total Cost": summary.get('total_estimated_cost', 'N/A'),
+                        "Duration": f"{summary.get('total_duration_days', 0)} days",
+                        "Expected Risk After": summary.get('expected_residual_risk_after', 'N/A')
+                    }]).astype(str)
+                    st.dataframe(summary_df, hide_index=True, use_container_width=True)
+
+                # Show full JSON in expander for reference
+                # ⚡ Only serialize and send the JSON when asked for
+                if st.checkbox("📄 View Full Plan (JSON)", key=f"rawjson_plan_{threat_index}"):
+                    st.json(plan)
+            else:
+                # Fallback: show as JSON if not dict
+                st.json(plan)
+
+            if st.button(f"💾 Save to Risk Register", key=f"save_treat_{threat_index}", type="primary"):
+                with st.spinner("💾 Saving..."):
+                    try:
+                        # ✅ FIX: Filter agent_2_results to include ONLY current threat
+                        current_threat_data = _threat_index().get(threat_name)
+
+                        if not current_threat_data:
+                            st.error(f"❌ Could not find threat data for: {threat_name}")
+                        else:
+                            # Create filtered agent_2_results with only current threat (shallow copy + override)
+                            filtered_agent_2 = st.session_state.risk_result.copy()
+                            filtered_agent_2['threat_risk_quantification'] = [current_threat_data]
+
+                            risk_ids = save_assessment_to_risk_register(
+                                asset_data=st.session_state.selected_asset, 
+                                agent_1_results=st.session_state.impact_result, 
+                                agent_2_results=filtered_agent_2,
+                                agent_3_results=st.session_state.control_result, 
+                                agent_4_results={'management_decision': 'TREAT', 'treatment_plan': st.session_state[treat_key]}
+                            )
+                            _next_risk_id.clear()  # New row invalidates the cached next Risk ID
+
+                            if risk_ids and len(risk_ids) > 0:
+                                st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
+                                st.session_state.current_decision_index += 1
+                                st.rerun()
+                            else:
+                                st.error("❌ Save returned no Risk IDs")
+                    except Exception as e:
+                        st.error(f"❌ Save failed: {str(e)}")
+                        with st.expander("Debug"):
+                            st.exception(e)
+
+    # ACCEPT WORKFLOW
+    elif decision == "ACCEPT":
+        st.markdown(f"#### ⚠️ Risk Acceptance for: {threat_name}")
+
+        accept_key = f"accept_q_{threat_key}"
+        if accept_key not in st.session_state:
+            with st.spinner("🤖 Generating acceptance questionnaire..."):
+                # Get actual Risk ID from database if it exists, otherwise use temp ID
+                try:
+                    actual_risk_id = _next_risk_id()
+                except sqlite3.Error as e:
+                    print(f"[WARNING] Risk ID lookup failed, using temp ID: {e}")
+                    actual_risk_id = f"RSK-{threat_index:03d}"
+
+                ctx = _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data, include_gaps=True)
+                q = _cached_acceptance_questionnaire(_canonical_json(ctx))
+                if 'error' in q:
+                    _cached_acceptance_questionnaire.clear()
+                st.session_state[accept_key] = q
+                st.session_state[f"{accept_key}_risk_id"] = actual_risk_id
+                if 'error' not in q:
+                    _acceptance_structure(q, threat_key)
+                st.rerun()
+
+        q = st.session_state[accept_key]
+        actual_risk_id = st.session_state.get(f"{accept_key}_risk_id", f"RSK-{threat_index:03d}")
+        if 'error' not in q:
+            # Get actual risk data
+            risk_category = threat_data.get('risk_category', 'Security Risk')
+            if not risk_category or risk_category == 'N/A':
+                risk_category = selected_asset.get('asset_type', 'Security Risk')
+            current_risk = threat_data.get('risk_rating', 'N/A')
+            residual_risk = threat_data.get('residual_risk', 'N/A')
+            risk_description = f"Asset: {selected_asset.get('asset_name')}, Threat: {threat_name}. Risk Rating: {current_risk}, Residual Risk: {residual_risk}"
+
+            # Display risk context (AI pre-filled)
+            threat_display = f"{threat_name[:80]}..." if len(threat_name) > 80 else threat_name
+            st.info("📊 **Risk Context** (Auto-filled by AI from Agents 1-3)")
+            st.markdown(
+                f"""<div style="display:flex;gap:1rem;font-size:0.875rem;opacity:0.75">
+<div style="flex:1"><b>Risk ID:</b> {html.escape(str(actual_risk_id))}<br><b>Category:</b> {html.escape(str(risk_category))}</div>
+<div style="flex:1"><b>Current Risk:</b> {html.escape(str(current_risk))}<br><b>Residual Risk:</b> {html.escape(str(residual_risk))}</div>
+<div style="flex:1"><b>Threat:</b> {html.escape(threat_display)}</div>
+</div>""",
+                unsafe_allow_html=True
+            )
+            st.markdown("---")
+
+            # 📧 EMAIL OPTION - Choose between manual fill or email send
+            st.info("💡 **Choose how to complete the acceptance questionnaire:**")
+
+            col_option1, col_option2 = st.columns(2)
+
+            with col_option1:
+                st.markdown("### 📧 Option 1: Send via Email")
+                st.caption("Send questionnaire to risk owner/approver")
+
+                recipient_email_accept = st.text_input(
+                    "Recipient Email Address",
+                    placeholder="risk.owner@company.com",
+                    key=f"recipient_email_accept_{threat_key}",
+                    help="Email address of the person who will complete the acceptance questionnaire"
+                )
+
+                email_job_key = f"email_job_accept_{threat_key}"
+                if st.button("📧 Send Acceptance Questionnaire Email", key=f"send_accept_email_{threat_key}", type="primary", disabled=not recipient_email_accept or email_job_key in st.session_state):
+                    agent_results = _email_agent_results(threat_name, threat_data)
+
+                    # SMTP can take seconds - send on a worker thread and poll for the result
+                    future = _email_pool().submit(
+                        send_questionnaire_email,
+                        recipient_email=recipient_email_accept,
+                        asset_name=selected_asset.get('asset_name'),
+                        questionnaire=q,
+                        questionnaire_type='ACCEPT',
+                        agent_results=agent_results
+                    )
+                    st.session_state[email_job_key] = (future, recipient_email_accept)
+
+                if email_job_key in st.session_state:
+                    _render_email_job(email_job_key)
+
+                email_error = st.session_state.pop(f"{email_job_key}_error", None)
+                if email_error:
+                    error_msg, error_exc = email_error
+                    st.error(error_msg)
+                    if error_exc:
+                        with st.expander("🔍 Error Details"):
+                            st.exception(error_exc)
+
+            with col_option2:
+                st.markdown("### ✍️ Option 2: Fill Manually")
+                st.caption("Fill the questionnaire yourself right now")
+                st.info("👇 Scroll down to see the questionnaire form below")
+
+            st.markdown("---")
+
+            _render_acceptance_questionnaire(
+                q, threat_key, threat_name, threat_data, actual_risk_id,
+                risk_category, risk_description, selected_asset, api_key
+            )
+
+            # Display form if it exists in session state
+            if f"acceptance_form_{threat_key}" in st.session_state:
+                form = st.session_state[f"acceptance_form_{threat_key}"]
+
+                if 'error' not in form:
+                    st.success("✅ Acceptance Form Generated!")
+
+                    # 🆕 100% DYNAMIC FORM DISPLAY - No hardcoded sections
+
+                    # 📋 RISK ACCEPTANCE FORM HEADING
+                    st.markdown("### 📋 Risk Acceptance Form")
+                    st.markdown("---")
+
+                    for key, value in form.items():
+                        emoji = _FORM_SECTION_EMOJI.get(key, '📌')
+                        section_title = key.replace('_', ' ').title()
+
+                        # Display metadata fields without section heading
+                        if key == 'metadata':
+                            if isinstance(value, dict):
+                                st.markdown(_fields_markdown(value))
+                            continue
+
+                        st.markdown(f"### {emoji} {section_title}")
+
+                        if isinstance(value, dict):
+                            for k, v in value.items():
+                                _display_form_value(k, v)
+                        elif isinstance(value, list):
+                            for item in value:
+                                if isinstance(item, dict):
+                                    for ik, iv in item.items():
+                                        _display_form_value(ik, iv)
+                                    st.write("---")
+                                else:
+                                    st.write(f"- {item}")
+                        else:
+                            st.write(value)
+
+                    # ⚡ Only serialize and send the JSON when asked for
+                    if st.checkbox("📄 Show Raw JSON", key=f"rawjson_{threat_key}"):
+                        st.json(form)
+
+                    if st.button(f"💾 Save to Risk Register", key=f"save_acc_{threat_key}", type="primary"):
+                        with st.spinner("💾 Saving..."):
+                            try:
+                                # Filter agent_2_results to include ONLY current threat
+                                current_threat_data = _threat_index().get(threat_name)
+
+                                if not current_threat_data:
+                                    st.error(f"❌ Could not find threat data for: {threat_name}")
+                                else:
+                                    # Create filtered agent_2_results with only current threat (shallow copy + override)
+                                    filtered_agent_2 = st.session_state.risk_result.copy()
+                                    filtered_agent_2['threat_risk_quantification'] = [current_threat_data]
+
+                                    risk_ids = save_assessment_to_risk_register(
+                                        asset_data=st.session_state.selected_asset, 
+                                        agent_1_results=st.session_state.impact_result, 
+                                        agent_2_results=filtered_agent_2,
+                                        agent_3_results=st.session_state.control_result, 
+                                        agent_4_results={'management_decision': 'ACCEPT', 'acceptance_form': form}
+                                    )
+                                    _next_risk_id.clear()  # New row invalidates the cached next Risk ID
+
+                                    if risk_ids and len(risk_ids) > 0:
+                                        st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
+                                        st.session_state.current_decision_index += 1
+                                        st.rerun()
+                                    else:
+                                        st.error("❌ Save returned no Risk IDs")
+                            except Exception as e:
+                                st.error(f"❌ Save failed: {str(e)}")
+                                with st.expander("Debug"):
+                                    st.exception(e)
+                else:
+                    st.error(f"❌ Error: {form.get('error')}")
+        else:
+            st.error(f"❌ {q.get('error')}")
+
+    # TRANSFER WORKFLOW
+    elif decision == "TRANSFER":
+        # Check if questionnaire already generated
+        transfer_q_key = f"transfer_questionnaire_{threat_key}"
+
+        if transfer_q_key not in st.session_state:
+            st.markdown("#### 📋 Step 1: Generate Transfer Questionnaire")
+
+            with st.spinner("🤖 Generating transfer questionnaire..."):
+                # 🔧 FIX: Get actual Risk ID from database
+                try:
+                    actual_risk_id = _next_risk_id()
+                except sqlite3.Error as e:
+                    print(f"[WARNING] Risk ID lookup failed, using temp ID: {e}")
+                    actual_risk_id = f"RSK-{threat_index:03d}"
+
+                # Prepare risk context
+                risk_context = _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data, include_gaps=True)
+
+                transfer_questionnaire = execute_agent_with_retry(
+                    generate_transfer_questionnaire,
+                    "Transfer Questionnaire Generator",
+                    risk_context=risk_context
+                )
+
+                st.session_state[transfer_q_key] = transfer_questionnaire
+                st.session_state[f"{transfer_q_key}_risk_id"] = actual_risk_id
+                if 'error' not in transfer_questionnaire:
+                    # 🔧 FIX: Handle both 'sections' and 'questionnaire' keys
+                    # Schema variants are resolved once here, not on every rerun
+                    st.session_state[f"{transfer_q_key}_structure"] = _normalize_form_sections(
+                        transfer_questionnaire.get('sections', transfer_questionnaire.get('questionnaire', []))
+                    )
+                st.rerun()
+
+        # Display questionnaire
+        transfer_questionnaire = st.session_state[transfer_q_key]
+        actual_risk_id = st.session_state.get(f"{transfer_q_key}_risk_id", f"RSK-{threat_index:03d}")
+
+        if 'error' in transfer_questionnaire:
+            st.error(f"❌ Error: {transfer_questionnaire.get('error')}")
+        else:
+            # Normalized sections, built when the questionnaire was generated
+            transfer_sections = st.session_state[f"{transfer_q_key}_structure"]
+            if not transfer_sections:
+                st.error("❌ No sections found in questionnaire")
+            else:
+                st.markdown("#### 📋 Risk Transfer Questionnaire")
+
+            # Display AI-known risk context (read-only)
+            st.markdown("##### 📊 Risk Context (Auto-filled by AI)")
+            risk_ctx = transfer_questionnaire.get('risk_context', {})
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown(f"**Risk ID:** {actual_risk_id}")
+                asset_name = html.unescape(risk_ctx.get('Asset', risk_ctx.get('asset', selected_asset.get('asset_name', 'N/A'))))
+                st.markdown(f"**Asset:** {asset_name}")
+                # Get risk rating from multiple possible keys
+                current_risk = risk_ctx.get('Risk Rating', risk_ctx.get('current_risk_rating', threat_data.get('risk_rating', 'N/A')))
+                st.markdown(f"**Current Risk Rating:** {format_risk_rating(current_risk)}")
+            with col2:
+                threat_desc = html.unescape(risk_ctx.get('Threat', risk_ctx.get('risk_description', threat_name)))
+                st.markdown(f"**Risk Description:** {threat_desc}")
+                residual = risk_ctx.get('Residual Risk', risk_ctx.get('residual_risk', threat_data.get('residual_risk', 'N/A')))
+                st.markdown(f"**Residual Risk:** {format_risk_rating(residual)}")
+
+            st.markdown("---")
+
+            # EMAIL OPTION
+            st.info("💡 **Choose how to complete the transfer questionnaire:**")
+            col_opt1, col_opt2 = st.columns(2)
+            with col_opt1:
+                st.markdown("### 📧 Send via Email")
+                st.caption("Send to third party")
+                email_transfer = st.text_input("Email", placeholder="vendor@company.com", key=f"email_tr_{threat_key}")
+                email_job_key = f"email_job_tr_{threat_key}"
+                if st.button("📧 Send", key=f"send_tr_{threat_key}", type="primary", disabled=not email_transfer or email_job_key in st.session_state):
+                    agent_results = _email_agent_results(threat_name, threat_data)
+
+                    # SMTP can take seconds - send on a worker thread and poll for the result
+                    future = _email_pool().submit(
+                        send_questionnaire_email,
+                        recipient_email=email_transfer,
+                        asset_name=selected_asset.get('asset_name'),
+                        questionnaire=transfer_questionnaire,
+                        questionnaire_type='TRANSFER',
+                        agent_results=agent_results
+                    )
+                    st.session_state[email_job_key] = (future, email_transfer)
+
+                if email_job_key in st.session_state:
+                    _render_email_job(email_job_key)
+
+                email_error = st.session_state.pop(f"{email_job_key}_error", None)
+                if email_error:
+                    error_msg, error_exc = email_error
+                    st.error(error_msg)
+                    if error_exc:
+                        with st.expander("🔍 Error Details"):
+                            st.exception(error_exc)
+            with col_opt2:
+                st.markdown("### ✍️ Fill Manually")
+                st.info("👇 Scroll down")
+            st.markdown("---")
+
+            st.markdown("##### 📝 Transfer Details (Please Fill)")
+            st.caption("Provide the following transfer-specific information:")
+
+            _render_transfer_questionnaire(
+                transfer_sections, transfer_questionnaire, threat_key, threat_name,
+                threat_data, actual_risk_id, selected_asset, api_key
+            )
+
+            # ✅ FIX: Display form OUTSIDE submit button block (like ACCEPT workflow)
+            if f"transfer_form_{threat_key}" in st.session_state:
+                transfer_form = st.session_state[f"transfer_form_{threat_key}"]
+
+                # Extract form from wrapper
+                form = transfer_form.get('risk_transfer_form', transfer_form)
+
+                # HTML entities were unescaped once when the form was stored
+
+                st.markdown("---")
+                st.success("✅ Transfer Form Generated!")
+
+                # Display form heading
+                st.markdown("### 📋 Risk Transfer Form")
+
+                # Display risk context summary (asset & threat)
+                if 'risk_context' in form and isinstance(form['risk_context'], dict):
+                    risk_ctx = form['risk_context']
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if 'asset' in risk_ctx:
+                            st.info(f"**Asset:** {risk_ctx['asset']}")
+                    with col2:
+                        if 'threat' in risk_ctx:
+                            st.info(f"**Threat:** {risk_ctx['threat']}")
+
+                st.markdown("")  # Spacing
+
+                # Display all sections
+                if 'sections' in form and isinstance(form['sections'], list):
+                    for section in form['sections']:
+                        if isinstance(section, dict):
+                            section_title = section.get('title', 'Section')
+
+                            # Get emoji based on keywords in title (one precompiled regex search)
+                            match = _TRANSFER_SECTION_EMOJI_RE.search(section_title.lower())
+                            emoji = _TRANSFER_SECTION_EMOJI[match.group(0)] if match else '📌'
+
+                            # ⚡ One markdown element per section instead of one per field
+                            st.markdown(_form_section_markdown(emoji, section_title, section.get('fields', [])))
+
+                # Generation Date at bottom
+                st.markdown("---")
+                if transfer_form.get('generation_date'):
+                    st.caption(f"📅 Generated: {transfer_form['generation_date']}")
+
+                # ⚡ Only serialize and send the JSON when asked for
+                if st.checkbox("📄 View Raw JSON", key=f"rawjson_transfer_{threat_key}"):
+                    st.json(transfer_form)
+
+                # Save to risk register
+                if st.button(f"💾 Save Transfer Form to Risk Register", key=f"save_transfer_{threat_key}", type="primary", use_container_width=True):
+                    with st.spinner("💾 Saving..."):
+                        try:
+                            # Filter agent_2_results to include ONLY current threat
+                            current_threat_data = _threat_index().get(threat_name)
+
+                            if not current_threat_data:
+                                st.error(f"❌ Could not find threat data for: {threat_name}")
+                            else:
+                                # Create filtered agent_2_results with only current threat (shallow copy + override)
+                                filtered_agent_2 = st.session_state.risk_result.copy()
+                                filtered_agent_2['threat_risk_quantification'] = [current_threat_data]
+
+                                # ✅ DEBUG: Show what we're saving (⚡ only in debug mode - st.json serializes the whole form)
+                                if st.session_state.get('debug_mode', False):
+                                    with st.expander("🔍 Debug: Data being saved", expanded=False):
+                                        st.write("Threat name:", threat_name)
+                                        st.write("Transfer form keys:", list(transfer_form.keys()) if isinstance(transfer_form, dict) else "Not a dict")
+                                        st.json({'management_decision': 'TRANSFER', 'transfer_form': transfer_form})
+
+                                risk_ids = save_assessment_to_risk_register(
+                                    asset_data=st.session_state.selected_asset, 
+                                    agent_1_results=st.session_state.impact_result, 
+                                    agent_2_results=filtered_agent_2,
+                                    agent_3_results=st.session_state.control_result, 
+                                    agent_4_results={'management_decision': 'TRANSFER', 'transfer_form': transfer_form}
+                                )
+                                _next_risk_id.clear()  # New row invalidates the cached next Risk ID
+
+                                if risk_ids and len(risk_ids) > 0:
+                                    st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
+                                    st.session_state.current_decision_index += 1
+                                    st.rerun()
+                                else:
+                                    st.error("❌ Save returned no Risk IDs")
+                                    st.warning("⚠️ Check the console/terminal for detailed error messages")
+                        except Exception as e:
+                            st.error(f"❌ Save failed: {str(e)}")
+                            with st.expander("Debug"):
+                                st.exception(e)
+
+    # ============================================================
+    # TERMINATE WORKFLOW
+    # ============================================================
+    elif decision == "TERMINATE":
+        # Check if questionnaire already generated
+        terminate_q_key = f"terminate_questionnaire_{threat_key}"
+
+        if terminate_q_key not in st.session_state:
+            st.markdown("#### 📋 Step 1: Generate Termination Questionnaire")
+
+            with st.spinner("🤖 Generating termination questionnaire..."):
+                # Get actual Risk ID from database
+                try:
+                    actual_risk_id = _next_risk_id()
+                except sqlite3.Error as e:
+                    print(f"[WARNING] Risk ID lookup failed, using temp ID: {e}")
+                    actual_risk_id = f"RSK-{threat_index:03d}"
+
+                # Prepare risk context
+                risk_context = _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data, include_gaps=True)
+
+                terminate_questionnaire = _cached_terminate_questionnaire(_canonical_json(risk_context))
+                if 'error' in terminate_questionnaire:
+                    _cached_terminate_questionnaire.clear()  # Don't keep a failed generation
+
+                st.session_state[terminate_q_key] = terminate_questionnaire
+                st.session_state[f"{terminate_q_key}_risk_id"] = actual_risk_id
+                if 'error' not in terminate_questionnaire:
+                    # Schema variants are resolved once here, not on every rerun
+                    st.session_state[f"{terminate_q_key}_structure"] = _normalize_form_sections(
+                        terminate_questionnaire.get('sections', [])
+                    )
+                st.rerun()
+
+        # Display questionnaire
+        terminate_questionnaire = st.session_state[terminate_q_key]
+        actual_risk_id = st.session_state.get(f"{terminate_q_key}_risk_id", f"RSK-{threat_index:03d}")
+
+        if 'error' in terminate_questionnaire:
+            st.error(f"❌ Error: {terminate_questionnaire.get('error')}")
+        else:
+            st.markdown("### 📋 Risk Termination Questionnaire")
+
+            # Display AI-known risk context (read-only)
+            st.markdown("##### 📊 Risk Context (Auto-filled by AI)")
+            risk_ctx = terminate_questionnaire.get('risk_context', {})
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown(f"**Risk ID:** {actual_risk_id}")
+                st.markdown(f"**Asset:** {risk_ctx.get('asset', selected_asset.get('asset_name', 'N/A'))}")
+                # Get current risk from threat_data (actual value)
+                current_risk = threat_data.get('risk_rating', 'N/A')
+                st.markdown(f"**Current Risk Rating:** {format_risk_rating(current_risk)}")
+            with col2:
+                st.markdown(f"**Risk Description:** {risk_ctx.get('risk_description', threat_name)}")
+                # Get residual risk from threat_data (actual value)
+                residual = threat_data.get('residual_risk', 'N/A')
+                st.markdown(f"**Residual Risk:** {format_risk_rating(residual)}")
+
+            st.markdown("---")
+            # EMAIL OPTION
+            st.info("💡 **Choose how to complete the termination questionnaire:**")
+            col_opt1, col_opt2 = st.columns(2)
+            with col_opt1:
+                st.markdown("### 📧 Send via Email")
+                st.caption("Send to stakeholder")
+                email_terminate = st.text_input("Email", placeholder="owner@company.com", key=f"email_tm_{threat_key}")
+                email_job_key = f"email_job_tm_{threat_key}"
+                if st.button("📧 Send", key=f"send_tm_{threat_key}", type="primary", disabled=not email_terminate or email_job_key in st.session_state):
+                    agent_results = _email_agent_results(threat_name, threat_data)
+
+                    # SMTP can take seconds - send on a worker thread and poll for the result
+                    future = _email_pool().submit(
+                        send_questionnaire_email,
+                        recipient_email=email_terminate,
+                        asset_name=selected_asset.get('asset_name'),
+                        questionnaire=terminate_questionnaire,
+                        questionnaire_type='TERMINATE',
+                        agent_results=agent_results
+                    )
+                    st.session_state[email_job_key] = (future, email_terminate)
+
+                if email_job_key in st.session_state:
+                    _render_email_job(email_job_key)
+
+                email_error = st.session_state.pop(f"{email_job_key}_error", None)
+                if email_error:
+                    error_msg, error_exc = email_error
+                    st.error(error_msg)
+                    if error_exc:
+                        with st.expander("🔍 Error Details"):
+                            st.exception(error_exc)
+            with col_opt2:
+                st.markdown("### ✍️ Fill Manually")
+                st.info("👇 Scroll down")
+            st.markdown("---")
+
+            st.markdown("##### 📝 Termination Details (Please Fill)")
+            st.caption("Provide the following termination-specific information:")
+
+            # Render questionnaire
+            terminate_answers = {}
+
+            # Normalized sections, built when the questionnaire was generated
+            terminate_sections = st.session_state[f"{terminate_q_key}_structure"]
+
+            # Batch all questionnaire widgets in one form: edits don't rerun until submit
+            with st.form(f"terminate_form_input_{threat_key}"):
+                for section_idx, section in enumerate(terminate_sections):
+                    st.markdown(f"##### {section['title']}")
+
+                    if section['description']:
+                        st.caption(section['description'])
+
+                    for q_idx, question in enumerate(section['fields']):
+                        q_id = question['id']
+                        q_text = question['text']
+                        q_type = question['type']
+                        q_help = question['help']
+                        options = question['options']
+
+                        # Streamlit keeps each widget's value under its key, so no default is read back here
+                        widget_key = f"terminate_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
+
+                        if question['required']:
+                            q_text = f"{q_text} *"
+
+                        # 🆕 Display-only fields (AI pre-filled)
+                        if q_type == 'display':
+                            pre_filled_value = question['value'] or 'N/A'
+                            st.info(f"**{q_text}:** {pre_filled_value}")
+                            terminate_answers[q_id] = pre_filled_value
+
+                        elif q_type in ['text_area', 'textarea']:
+                            val = st.text_area(q_text, key=widget_key, help=q_help, height=100)
+                            terminate_answers[q_id] = val
+                        elif q_type == 'text':
+                            val = st.text_input(q_text, key=widget_key, help=q_help)
+                            terminate_answers[q_id] = val
+                        elif q_type == 'number':
+                            val = st.number_input(q_text, value=0.0, key=widget_key, help=q_help, min_value=float(question['min']))
+                            terminate_answers[q_id] = val
+                        elif q_type == 'date':
+                            val = st.date_input(q_text, value=date.today(), key=widget_key, help=q_help)
+                            terminate_answers[q_id] = val
+                        elif q_type in ['select', 'dropdown']:
+                            if options:
+                                val = st.selectbox(q_text, options=question['option_labels'], key=widget_key, help=q_help)
+                                terminate_answers[q_id] = val
+                            else:
+                                val = st.text_input(q_text, key=widget_key, help=q_help)
+                                terminate_answers[q_id] = val
+                        else:
+                            val = st.text_input(q_text, key=widget_key, help=q_help)
+                            terminate_answers[q_id] = val
+
+                submitted = st.form_submit_button("✅ Submit & Generate Termination Form", type="primary", use_container_width=True)
+
+            if submitted:
+                # ⚡ The render loop above already collected every widget value and display field this run
+                # Convert dates to strings
+                terminate_answers_final = {
+                    key: value.isoformat() if isinstance(value, date) else value
+                    for key, value in terminate_answers.items()
+                }
+
+                # Generate termination form with retry
+                with st.spinner("🤖 Generating termination form..."):
+                    risk_context = _build_risk_context(actual_risk_id, selected_asset, threat_name, threat_data)
+
+                    # ⚡ Resubmitting unchanged answers returns the cached form without another LLM call
+                    terminate_form = _cached_terminate_form(
+                        _canonical_json(risk_context), _canonical_json(terminate_answers_final),
+                        _canonical_json(terminate_questionnaire)
+                    )
+
+                    if 'error' not in terminate_form:
+                        # ✅ STORE FORM IN SESSION STATE
+                        st.session_state[f"terminate_form_{threat_key}"] = _unescape_form(terminate_form)
+                        st.success("✅ Termination Form Generated!")
+                        st.rerun()
+
+                    else:
+                        _cached_terminate_form.clear()  # Don't keep a failed generation
+                        st.error(f"❌ Error: {terminate_form.get('error')}")
+
+            # ✅ FIX: Display form OUTSIDE submit button block (like ACCEPT and TRANSFER workflows)
+            if f"terminate_form_{threat_key}" in st.session_state:
+                terminate_form = st.session_state[f"terminate_form_{threat_key}"]
+
+                # Extract form from wrapper
+                form = terminate_form.get('risk_termination_form', terminate_form)
+
+                # HTML entities were unescaped once when the form was stored
+
+                st.markdown("---")
+                st.success("✅ Termination Form Generated!")
+
+                # Display form heading
+                st.markdown("### 📋 Risk Termination Form")
+                st.markdown("")  # Spacing
+
+                # 🆕 100% DYNAMIC - Display sections with smart emoji selection
+                if 'sections' in form and isinstance(form['sections'], list):
+                    for section in form['sections']:
+                        if isinstance(section, dict):
+                            section_title = section.get('title', 'Section')
+                            # Smart emoji based on keywords
+                            title_lower = section_title.lower()
+                            emoji = next((em for kw, em in _TERMINATE_SECTION_EMOJI if kw in title_lower), '📌')
+
+                            # ⚡ One markdown element per section instead of one per field
+                            st.markdown(_form_section_markdown(emoji, section_title, section.get('fields', [])))
+
+                # Generation Date at bottom
+                st.markdown("---")
+                if terminate_form.get('generation_date'):
+                    st.caption(f"📅 Generated: {terminate_form['generation_date']}")
+
+                # ⚡ Only serialize and send the JSON when asked for
+                if st.checkbox("📄 View Raw JSON", key=f"rawjson_terminate_{threat_key}"):
+                    st.json(terminate_form)
+
+                # Save to risk register
+                if st.button(f"💾 Save Termination Form to Risk Register", key=f"save_terminate_{threat_key}", type="primary", use_container_width=True):
+                    with st.spinner("💾 Saving..."):
+                        try:
+                            # Filter agent_2_results to include ONLY current threat
+                            current_threat_data = _threat_index().get(threat_name)
+
+                            if not current_threat_data:
+                                st.error(f"❌ Could not find threat data for: {threat_name}")
+                            else:
+                                # Create filtered agent_2_results with only current threat (shallow copy + override)
+                                filtered_agent_2 = st.session_state.risk_result.copy()
+                                filtered_agent_2['threat_risk_quantification'] = [current_threat_data]
+
+                                risk_ids = save_assessment_to_risk_register(
+                                    asset_data=st.session_state.selected_asset, 
+                                    agent_1_results=st.session_state.impact_result, 
+                                    agent_2_results=filtered_agent_2,
+                                    agent_3_results=st.session_state.control_result, 
+                                    agent_4_results={'management_decision': 'TERMINATE', 'terminate_form': terminate_form}
+                                )
+                                _next_risk_id.clear()  # New row invalidates the cached next Risk ID
+
+                                if risk_ids and len(risk_ids) > 0:
+                                    st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
+                                    st.session_state.current_decision_index += 1
+                                    st.rerun()
+                                else:
+                                    st.error("❌ Save returned no Risk IDs")
+                        except Exception as e:
+                            st.error(f"❌ Save failed: {str(e)}")
+                            with st.expander("Debug"):
+                                st.exception(e)
+
+    st.markdown("---")
+
+
+# ===================================================================
+# PAGE: RISK ASSESSMENT
+# ===================================================================
+
+def render_risk_assessment_page(api_key):
+    """Render Risk Assessment page with complete 6-agent pipeline"""
+    st.title("🎯 Risk Assessment - Truly Agentic 6-Agent Pipeline")
+    
+    # 💾 SESSION RESTORE UI - Show at top of page
+    show_session_restore_ui()
+    
+    # Check prerequisites
+    if not st.session_state.processed:
+        st.error("❌ Knowledge Base not loaded! Please upload documents first.")
+        st.info("ℹ️ Go to 'Knowledge Base' page to upload documents")
+        return
+    
+    if not api_key:
+        st.error("❌ API Key required! Please enter your Gemini API key in the sidebar.")
+        return
+    
+    # Initialize RAG for agents if needed (with current API key)
+    if not st.session_state.rag_initialized:
+        with st.spinner("⏳ Initializing Truly Agentic Agent System..."):
+            try:
+                initialize_rag(api_key, KNOWLEDGE_BASE_DIR)
+                st.session_state.rag_initialized = True
+                st.success("✅ Agent system initialized with discovery capabilities!")
+            except Exception as e:
+                st.error(f"Failed to initialize: {str(e)}")
+                return
+    else:
+        # Re-initialize RAG with current API key if it changed
+        try:
+            update_rag_api_key(api_key)
+        except:
+            pass
+    
+    st.markdown("---")
+    st.header(" Generate Intelligent Questionnaire")
+
+    st.info("💡 **Don't have asset data?** Tell us what asset type you want to assess, and our AI will intelligently figure out what questions to ask!")
+
+    # Pure text input - NO dropdown!
+    col1, col2 = st.columns([3, 1])
+
+    with col1:
+        st.markdown("### What Asset Do You Want to Assess?")
+        st.caption("💡 **Enter a description** (e.g., 'Database Server', 'Employee Laptop') - AI will ask for specific name and type in the questionnaire!")
+        
+        asset_type_input = st.text_input(
+            "Asset Description",
+            placeholder="e.g., Database Server, Web Application, Employee Laptop, Manufacturing Equipment, Cloud Service, Office Building, Research Lab, AI Model, Smart Contract, IoT Sensor...",
+            key="asset_type_input",
+            help="Enter a description of the asset. The AI will generate a questionnaire that asks for the specific asset name and asset type (Physical/Software/Information/Service/People)."
+        )
+        
+        # Examples to help users
+        with st.expander("💡 Need ideas? See examples"):
+            st.markdown("""
+            **Technology Assets:**
+            - Database Server, Web Application, Mobile App, API Service
+            - Cloud Infrastructure, Network Device, Firewall
+            - IoT Device, Smart Sensor, Edge Computing Node
+            
+            **Physical Assets:**
+            - Office Building, Data Center, Manufacturing Equipment
+            - Vehicle Fleet, Warehouse, Laboratory Equipment
+            
+            **Information Assets:**
+            - Customer Database, Intellectual Property, Research Data
+            - Source Code Repository, Document Management System
+            
+            **Human Assets:**
+            - Key Personnel, Executive Team, Technical Expert
+            - Contractor, Third-Party Consultant
+            
+            **Business Assets:**
+            - Business Process, Supply Chain, Vendor Relationship
+            - Brand, Reputation, Customer Relationships
+            
+            **And literally ANY other asset you can think of!**
+            The AI will figure it out! 🤖
+            """)
+
+    with col2:
+        st.markdown("### AI Status")
+        if asset_type_input and asset_type_input.strip():
+            st.success(f"✅ **Will assess:**\n\n{asset_type_input}")
+            st.caption("AI will intelligently determine relevant questions")
+        else:
+            st.info("ℹ️ **Generic mode**")
+            st.caption("Leave blank for generic questionnaire")
+
+    # Generate button
+    generate_button_text = f"🤖 Generate Intelligent Questionnaire{' for ' + asset_type_input if asset_type_input and asset_type_input.strip() else ''}"
+
+    if st.button(generate_button_text, type="primary", use_container_width=True, disabled=False):
+        
+        final_asset_type = asset_type_input.strip() if asset_type_input else None
+        
+        with st.spinner(f"🤖 AI is thinking about '{final_asset_type}' and intelligently determining what questions to ask..."):
+            try:
+                result = execute_agent_with_retry(
+                    run_questionnaire_generator,
+                    "Agent 0: Questionnaire Generator",
+                    asset_type=final_asset_type
+                )
+                
+                if 'error' in result:
+                    st.error(f"❌ Error: {result['error']}")
+                    if 'raw_output' in result:
+                        with st.expander("View Raw Output"):
+                            st.text(result['raw_output'])
+                else:
+                    st.session_state.questionnaire_result = result
+                    st.session_state.current_asset_type = final_asset_type
+                    st.success(f"✅ AI has intelligently generated a questionnaire for: {final_asset_type or 'Generic Asset'}!")
+                    st.rerun()
+                    
+            except Exception as e:
+                st.error(f"❌ Error generating questionnaire: {str(e)}")
+                with st.expander("View Error Details"):
+                    st.code(traceback.format_exc())
+
+    # Display questionnaire if generated
+    if st.session_state.questionnaire_result:
+        st.markdown("---")
+        st.subheader("📝 AI-Generated Questionnaire")
+        
+        questionnaire = st.session_state.questionnaire_result
+        current_asset = st.session_state.get('current_asset_type', 'Asset')
+        
+        # 📧 EMAIL OPTION - Send questionnaire to stakeholder
+        st.info("💡 **Choose how to fill the questionnaire:**")
+        
+        col_option1, col_option2 = st.columns(2)
+        
+        with col_option1:
+            st.markdown("### 📧 Option 1: Send via Email")
+            st.caption("Send questionnaire to asset owner/stakeholder")
+            
             recipient_email = st.text_input(
                 "Recipient Email Address",
                 placeholder="stakeholder@company.com",
@@ -750,8 +2459,6 @@ def render_risk_assessment_page(api_key):
             if st.button("📧 Send Questionnaire Email", type="primary", disabled=not recipient_email):
                 with st.spinner(f"📧 Sending email to {recipient_email}..."):
                     try:
-                        from email_sender import send_questionnaire_email
-                        
                         result = send_questionnaire_email(
                             recipient_email=recipient_email,
                             asset_name=current_asset or 'Asset',
@@ -782,7 +2489,6 @@ def render_risk_assessment_page(api_key):
                                 """)
                     except Exception as e:
                         st.error(f"❌ Error: {str(e)}")
-                        import traceback
                         with st.expander("🔍 Error Details"):
                             st.code(traceback.format_exc())
         
@@ -1180,7 +2886,6 @@ def render_risk_assessment_page(api_key):
                     
                 except Exception as e:
                     st.error(f"❌ Error converting questionnaire: {str(e)}")
-                    import traceback
                     with st.expander("View Error Details"):
                         st.code(traceback.format_exc())
 
@@ -1200,9 +2905,6 @@ def render_risk_assessment_page(api_key):
                 st.rerun()
         
         try:
-            from email_sender import get_all_pending_questionnaires
-            import sqlite3
-            
             pending_list = get_all_pending_questionnaires()
             
             if not pending_list:
@@ -1242,20 +2944,11 @@ def render_risk_assessment_page(api_key):
                         with col_action:
                             if st.button(f"📥 Load", key=f"load_{q['token']}", type="primary"):
                                 with st.spinner("📥 Loading and analyzing questionnaire..."): 
-                                    # Fetch answers from database
-                                    conn = sqlite3.connect('database/risk_register.db')
-                                    cursor = conn.cursor()
-                                    cursor.execute("""
-                                        SELECT answers, questions
-                                        FROM pending_questionnaires
-                                        WHERE token = ?
-                                    """, (q['token'],))
-                                    result = cursor.fetchone()
-                                    conn.close()
+                                    # Fetch answers from database (shared cached connection)
+                                    result = _pending_questionnaire_row(q['token'])
                                     
                                     if result and result[0]:
                                         answers = json.loads(result[0])
-                                        questions = json.loads(result[1])
                                         
                                         # 🔧 FIX: Ensure answers is a dict
                                         if isinstance(answers, str):
@@ -1429,11 +3122,7 @@ def render_risk_assessment_page(api_key):
                                     if st.button(f"📋 Generate {q['questionnaire_type']} Form", key=f"gen_{q['token']}", type="primary"):
                                         with st.spinner(f"🤖 Generating {q['questionnaire_type']} form..."):
                                             try:
-                                                conn = sqlite3.connect('database/risk_register.db')
-                                                cursor = conn.cursor()
-                                                cursor.execute("SELECT answers, questions, agent_results FROM pending_questionnaires WHERE token = ?", (q['token'],))
-                                                result = cursor.fetchone()
-                                                conn.close()
+                                                result = _pending_questionnaire_row(q['token'])
                                                 
                                                 if result and result[0]:
                                                     answers = json.loads(result[0])
@@ -1463,7 +3152,6 @@ def render_risk_assessment_page(api_key):
                                                         
                                                         # Generate form based on type
                                                         if q['questionnaire_type'] == 'ACCEPT':
-                                                            from phase2_risk_resolver.agents.agent_4_acceptance_form import generate_acceptance_form
                                                             
                                                             # ✅ FIX: Get actual risk_id from questionnaire or generate next available
                                                             actual_risk_id = 'RSK-001'  # Default
@@ -1477,13 +3165,7 @@ def render_risk_assessment_page(api_key):
                                                                 
                                                                 # If not found, generate next available from database
                                                                 if actual_risk_id == 'RSK-001':
-                                                                    conn_temp = sqlite3.connect('database/risk_register.db')
-                                                                    cursor_temp = conn_temp.cursor()
-                                                                    cursor_temp.execute("SELECT MAX(CAST(SUBSTR(risk_id, 5) AS INTEGER)) FROM risks WHERE risk_id LIKE 'RSK-%'")
-                                                                    result_temp = cursor_temp.fetchone()
-                                                                    next_num = (result_temp[0] or 0) + 1
-                                                                    actual_risk_id = f"RSK-{next_num:03d}"
-                                                                    conn_temp.close()
+                                                                    actual_risk_id = _next_risk_id()
                                                             except:
                                                                 actual_risk_id = 'RSK-001'
                                                             
@@ -1511,7 +3193,6 @@ def render_risk_assessment_page(api_key):
                                                             }
                                                             form = generate_acceptance_form(risk_context, answers, questionnaire_structure, api_key)
                                                         elif q['questionnaire_type'] == 'TRANSFER':
-                                                            from phase2_risk_resolver.agents.agent_4_transfer_form import generate_transfer_form
                                                             risk_context = {
                                                                 'risk_id': 'RSK-001',
                                                                 'asset_name': q['asset_name'],
@@ -1519,7 +3200,6 @@ def render_risk_assessment_page(api_key):
                                                             }
                                                             form = generate_transfer_form(risk_context, answers, questionnaire_structure, api_key)
                                                         elif q['questionnaire_type'] == 'TERMINATE':
-                                                            from phase2_risk_resolver.agents.agent_4_terminate_form import generate_terminate_form
                                                             risk_context = {
                                                                 'risk_id': 'RSK-001',
                                                                 'asset_name': q['asset_name'],
@@ -1529,7 +3209,7 @@ def render_risk_assessment_page(api_key):
                                                         
                                                         # Store form and data in session state
                                                         st.session_state[form_key] = {
-                                                            'form': form,
+                                                            'form': _unescape_form(form),
                                                             'agent_results': agent_results,
                                                             'questionnaire_type': q['questionnaire_type']
                                                         }
@@ -1539,9 +3219,9 @@ def render_risk_assessment_page(api_key):
                                                     st.error("❌ No answers found")
                                             except Exception as e:
                                                 st.error(f"❌ Form generation failed: {str(e)}")
-                                                import traceback
-                                                with st.expander("Debug"):
-                                                    st.code(traceback.format_exc())
+                                                if st.session_state.get('debug_mode', False):  # ⚡ only walk the stack when someone will read it
+                                                    with st.expander("Debug"):
+                                                        st.code(traceback.format_exc())
                                 
                                 # STEP 2: Display Form (SAME AS MANUAL WORKFLOW)
                                 if form_key in st.session_state:
@@ -1562,77 +3242,41 @@ def render_risk_assessment_page(api_key):
                                 st.markdown("---")
                                 st.success(f"✅ {q_type} Form Generated - Review Below")
                                 
-                                # Clean HTML entities
-                                import html
-                                def clean_html_recursive(obj):
-                                    if isinstance(obj, str):
-                                        return html.unescape(obj)
-                                    elif isinstance(obj, dict):
-                                        return {k: clean_html_recursive(v) for k, v in obj.items()}
-                                    elif isinstance(obj, list):
-                                        return [clean_html_recursive(item) for item in obj]
-                                    return obj
-                                
-                                form = clean_html_recursive(form)
-                                
+                                # HTML entities were unescaped once when the form was stored
+
                                 # Display form full-width
                                 st.markdown(f"## 📋 {q_type} Form")
                                 with st.expander(f"📄 View Details", expanded=True):
-                                        emoji_map = {'metadata': '📋', 'risk_context': '⚠️', 'engagement_project': '🏢', 
-                                                     'compensating_controls': '🛡️', 'justification': '📝', 
-                                                     'approvals': '✅', 'signoff': '✍️', 'transfer_details': '🔄',
-                                                     'third_party_information': '🏢', 'termination_details': '🚫'}
-                                        
                                         st.markdown(f"### 📋 {q_type} Form")
                                         st.markdown("---")
                                         
                                         for key, value in form.items():
-                                            emoji = emoji_map.get(key, '📌')
+                                            emoji = _FORM_SECTION_EMOJI.get(key, '📌')
                                             section_title = key.replace('_', ' ').title()
                                             
                                             if key == 'metadata':
                                                 if isinstance(value, dict):
-                                                    for k, v in value.items():
-                                                        st.write(f"**{k.replace('_', ' ').title()}:** {v}")
+                                                    st.markdown(_fields_markdown(value))
                                                 continue
                                             
                                             st.markdown(f"### {emoji} {section_title}")
                                             
-                                            def display_value(k, v):
-                                                field_name = k.replace('_', ' ').title()
-                                                if isinstance(v, dict):
-                                                    st.markdown(f"**{field_name}:**")
-                                                    for dk, dv in v.items():
-                                                        st.write(f"  • **{dk.replace('_', ' ').title()}:** {dv}")
-                                                elif isinstance(v, list) and v and isinstance(v[0], dict):
-                                                    st.markdown(f"**{field_name}:**")
-                                                    for idx, item in enumerate(v, 1):
-                                                        label = item.get('name') or item.get('label') or item.get('gap_description') or item.get('control_name') or item.get('description') or f"Item {idx}"
-                                                        if len(str(label)) > 50:
-                                                            label = str(label)[:50] + "..."
-                                                        with st.expander(f"🔹 {label}", expanded=False):
-                                                            for ik, iv in item.items():
-                                                                st.write(f"**{ik.replace('_', ' ').title()}:** {iv}")
-                                                elif isinstance(v, list):
-                                                    st.write(f"**{field_name}:** {', '.join(str(x) for x in v)}")
-                                                else:
-                                                    st.write(f"**{field_name}:** {v}")
-                                            
                                             if isinstance(value, dict):
                                                 for k, v in value.items():
-                                                    display_value(k, v)
+                                                    _display_form_value(k, v)
                                             elif isinstance(value, list):
                                                 for item in value:
                                                     if isinstance(item, dict):
                                                         for ik, iv in item.items():
-                                                            display_value(ik, iv)
+                                                            _display_form_value(ik, iv)
                                                         st.write("---")
                                                     else:
                                                         st.write(f"- {item}")
                                             else:
                                                 st.write(value)
                                         
-                                        with st.expander("📄 Raw JSON", expanded=False):
+                                        # ⚡ Only serialize and send the JSON when asked for
+                                        if st.checkbox("📄 Show Raw JSON", key=f"rawjson_{q['token']}"):
                                             st.json(form)
                                 
                                 # STEP 2.5: Regenerate Form Button
@@ -1653,11 +3297,7 @@ def render_risk_assessment_page(api_key):
                                     with st.spinner("💾 Saving to Risk Register..."):
                                             try:
                                                 # Retrieve answers from database
-                                                conn = sqlite3.connect('database/risk_register.db')
-                                                cursor = conn.cursor()
-                                                cursor.execute("SELECT answers FROM pending_questionnaires WHERE token = ?", (q['token'],))
-                                                answers_row = cursor.fetchone()
-                                                conn.close()
+                                                answers_row = _pending_questionnaire_row(q['token'])
                                                 answers = json.loads(answers_row[0]) if answers_row and answers_row[0] else {}
                                                 
                                                 agent_1_results = agent_results.get('agent_1', {})
@@ -1704,8 +3344,8 @@ def render_risk_assessment_page(api_key):
                                                         'completed': True
                                                     }
                                                 
-                                                from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                filtered_agent_2 = {**agent_2_results, 'threat_risk_quantification': [original_threat]}
+                                                filtered_agent_2 = agent_2_results.copy()
+                                                filtered_agent_2['threat_risk_quantification'] = [original_threat]
                                                 risk_ids = save_assessment_to_risk_register(
                                                     asset_data=selected_asset,
                                                     agent_1_results=agent_1_results,
@@ -1713,25 +3353,21 @@ def render_risk_assessment_page(api_key):
                                                     agent_3_results=filtered_agent_3,
                                                     agent_4_results=decision_data
                                                 )
+                                                _next_risk_id.clear()  # New row invalidates the cached next Risk ID
                                                 
                                                 if risk_ids and len(risk_ids) > 0:
-                                                    st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
                                                     # Update questionnaire status to 'saved' so it disappears from pending list
-                                                    conn = sqlite3.connect('database/risk_register.db')
-                                                    cursor = conn.cursor()
-                                                    cursor.execute("UPDATE pending_questionnaires SET status = 'saved' WHERE token = ?", (q['token'],))
-                                                    conn.commit()
-                                                    conn.close()
-                                                    st.balloons()
-                                                    time.sleep(1)
+                                                    _risk_db().execute("UPDATE pending_questionnaires SET status = 'saved' WHERE token = ?", (q['token'],))
+                                                    # ⚡ Toasts survive the rerun - no need to stall the server thread so the message is seen
+                                                    st.toast(f"✅ Saved! Risk ID: {risk_ids[0]}")
                                                     st.rerun()
                                                 else:
                                                     st.error("❌ Save returned no Risk IDs")
                                             except Exception as e:
                                                 st.error(f"❌ Save failed: {str(e)}")
-                                                import traceback
-                                                with st.expander("Debug"):
-                                                    st.code(traceback.format_exc())
+                                                if st.session_state.get('debug_mode', False):  # ⚡ only walk the stack when someone will read it
+                                                    with st.expander("Debug"):
+                                                        st.code(traceback.format_exc())
                             elif q['questionnaire_type'] != 'Agent0':
                                 # Skip unknown types silently
                                 continue
@@ -2277,1929 +3913,540 @@ def render_risk_assessment_page(api_key):
                                 st.metric("Criticality", crit_class, delta=color)
                                 st.caption(f"📊 **Derived from Business Value:** {crit_bv_input}")
                                 
-                                with st.expander("📊 Classification Details"):
-                                    st.markdown(f"**Method:** {crit_method}")
-                                    st.markdown(f"**Source:** {crit_source}")
-                                    st.markdown(f"**Reasoning:** {crit_reasoning}")
-                            else:
-                                st.info("ℹ️ Criticality not classified")
-                        
-                        st.markdown("---")
-                        
-                        if 'discovery_summary' in result:
-                            with st.expander("📚 Discovered Methodologies (RAG Sources)"):
-                                discovery = result['discovery_summary']
-                                st.markdown("#### 🔍 What Agent 1 Discovered from Documents:")
-                                st.markdown("**1. CIA Rating Scale:**")
-                                st.write(f"   - {discovery.get('cia_rating_scale', 'N/A')}")
-                                st.write(f"   - Source: {discovery.get('cia_definitions_source', 'Unknown')}")
-                                
-                                if 'business_value_calculation_method' in discovery:
-                                    st.markdown("**2. Business Value Calculation:**")
-                                    st.write(f"   - Method: {discovery.get('business_value_calculation_method', 'N/A')}")
-                                    st.write(f"   - Levels: {', '.join(discovery.get('business_value_levels', []))}")
-                                    st.write(f"   - Source: {discovery.get('business_value_source', 'Unknown')}")
-                                
-                                if 'criticality_classification_method' in discovery:
-                                    st.markdown("**3. Criticality Classification:**")
-                                    st.write(f"   - Method: {discovery.get('criticality_classification_method', 'N/A')}")
-                                    st.write(f"   - Levels: {', '.join(discovery.get('criticality_levels', []))}")
-                                    st.write(f"   - Source: {discovery.get('criticality_source', 'Unknown')}")
-                                
-                                if 'searches_performed' in discovery:
-                                    st.markdown("**4. RAG Searches Performed:**")
-                                    for search in discovery.get('searches_performed', []):
-                                        st.write(f"   - {search}")
-                                
-                                st.success("✅ All methodologies discovered from organizational documents - NO HARDCODING!")
-                        
-                        st.download_button(
-                            label="📥 Download Agent 1 Complete Results (JSON)",
-                            data=json.dumps(result, indent=2),
-                            file_name=f"agent1_complete_{selected_asset['asset_name'].replace(' ', '_')}.json",
-                            mime="application/json",
-                            use_container_width=True
-                        )
-                    else:
-                        st.info("ℹ️ Run Agent 1 to see complete CIA assessment with Business Value and Criticality")
-                
-                # Agent 2 Results Tab
-                with tab2:
-                    if st.session_state.risk_result:
-                        result = st.session_state.risk_result
-                        
-                        # Check for error
-                        if 'error' in result:
-                            st.error(f"❌ Agent 2 Error: {result['error']}")
-                            if 'details' in result:
-                                with st.expander("❌ Error Details"):
-                                    st.text(result['details'])
-                            if 'raw_response' in result:
-                                with st.expander("📄 Raw Output"):
-                                    st.text(result['raw_response'][:2000])
-                            
-                            # Show retry suggestion
-                            st.info("ℹ️ Try clicking the Agent 2 button again. The system will automatically rotate API keys if needed.")
-                        else:
-                            st.markdown("### 📊 Risk Summary")
-                            
-                            # Handle summary with defaults
-                            summary = result.get('summary', {})
-                            
-                            col1, col2, col3, col4 = st.columns(4)
-                            
-                            with col1:
-                                st.metric("Total Threats", summary.get('total_threats_assessed', 0))
-                            
-                            with col2:
-                                st.metric("Highest Risk Value", summary.get('highest_risk_value', 0))
-                            
-                            with col3:
-                                st.metric("Non-Acceptable Risks", summary.get('non_acceptable_risks_count', 0), delta="🔴")
-                            
-                            with col4:
-                                st.metric("Acceptable Risks", summary.get('acceptable_risks_count', 0), delta="🔴")
-                        
-                            st.markdown("### ⚠️ Threat Risk Analysis")
-                            
-                            # Get threat list with fallback
-                            threats = result.get('threat_risk_quantification', result.get('risk_assessments', []))
-                            
-                            for idx, threat_risk in enumerate(threats, 1):
-                                # Get threat name - Agent 2 should provide specific threat names
-                                threat_name = threat_risk.get('threat', threat_risk.get('threat_name', 'Unknown Threat'))
-                                
-                                # If it's still the placeholder, make it more descriptive
-                                if threat_name in ['To be assessed by agents', 'Unknown Threat', 'General security threats']:
-                                    if 'risk_statement' in threat_risk:
-                                        threat_name = f"Security Threat {idx}"
-                                    else:
-                                        threat_name = f"Threat {idx}"
-                                
-                                with st.expander(f"**{threat_name}**", expanded=(idx == 1)):
-                                    col1, col2, col3, col4 = st.columns(4)
-                                    
-                                    with col1:
-                                        risk_impact = threat_risk.get('risk_impact', {})
-                                        if isinstance(risk_impact, dict):
-                                            rating = risk_impact.get('rating', 'N/A')
-                                            category = risk_impact.get('category', '')
-                                            st.metric("Risk Impact", f"{rating}/5" if isinstance(rating, (int, float)) else rating, delta=category)
-                                        else:
-                                            st.metric("Risk Impact", risk_impact)
-                                    
-                                    with col2:
-                                        risk_prob = threat_risk.get('risk_probability', {})
-                                        if isinstance(risk_prob, dict):
-                                            rating = risk_prob.get('rating', 'N/A')
-                                            category = risk_prob.get('category', '')
-                                            st.metric("Risk Probability", f"{rating}/5" if isinstance(rating, (int, float)) else rating, delta=category)
-                                        else:
-                                            st.metric("Risk Probability", risk_prob)
-                                    
-                                    with col3:
-                                        risk_val = threat_risk.get('risk_value', {})
-                                        if isinstance(risk_val, dict):
-                                            st.metric("Risk Value", risk_val.get('value', 'N/A'))
-                                        else:
-                                            st.metric("Risk Value", risk_val)
-                                    
-                                    with col4:
-                                        risk_eval = threat_risk.get('risk_evaluation_rating', {})
-                                        if isinstance(risk_eval, dict):
-                                            rating = risk_eval.get('rating', 0)
-                                            color = "🔴" if rating >= 4 else "🟡" if rating == 3 else "🟢"
-                                            st.metric("Risk Rating", f"{rating}/5", delta=f"{color}")
-                                        else:
-                                            st.metric("Risk Rating", risk_eval)
-                        
-                            # Download button
-                            st.download_button(
-                                label="📥 Download Agent 2 Results (JSON)",
-                                data=json.dumps(result, indent=2),
-                                file_name=f"agent2_risk_{selected_asset['asset_name'].replace(' ', '_')}.json",
-                                mime="application/json",
-                                use_container_width=True
-                            )
-                    else:
-                        st.info("ℹ️ Run Agent 2 to see risk quantification results")
-                
-                # Agent 3 Results Tab
-                with tab3:
-                    if st.session_state.control_result:
-                        result = st.session_state.control_result
-                        
-                        # Check for error
-                        if 'error' in result:
-                            st.error(f"❌ Agent 3 Error: {result['error']}")
-                            if 'details' in result:
-                                with st.expander("❌ Error Details"):
-                                    st.text(result['details'])
-                            if 'raw_response' in result:
-                                with st.expander("📄 Raw Output"):
-                                    st.text(result['raw_response'][:2000])
-                            st.info("ℹ️ Try clicking the Agent 3 button again. The system will automatically rotate API keys if needed.")
-                        else:
-                            st.markdown("### 📊 Control Evaluation Summary")
-                            
-                            # Get threat control evaluation with fallback
-                            threat_controls = result.get('threat_control_evaluation', [])
-                            
-                            col1, col2, col3 = st.columns(3)
-                            
-                            with col1:
-                                st.metric("Threats Evaluated", len(threat_controls))
-                            
-                            with col2:
-                                if threat_controls:
-                                    try:
-                                        ratings = []
-                                        for t in threat_controls:
-                                            ctrl_calc = t.get('control_rating_calculation', {})
-                                            ctrl_rating = ctrl_calc.get('control_rating')
-                                            if isinstance(ctrl_rating, (int, float)):
-                                                ratings.append(ctrl_rating)
-                                        
-                                        if ratings:
-                                            avg_rating = sum(ratings) / len(ratings)
-                                            st.metric("Avg Control Rating", f"{avg_rating:.2f}")
-                                        else:
-                                            st.metric("Avg Control Rating", "N/A")
-                                    except:
-                                        st.metric("Avg Control Rating", "N/A")
-                                else:
-                                    st.metric("Avg Control Rating", "N/A")
-                            
-                            with col3:
-                                if threat_controls:
-                                    try:
-                                        residual_values = [
-                                            t.get('residual_risk', {}).get('residual_risk_value', 0)
-                                            for t in threat_controls
-                                        ]
-                                        highest_residual = max(residual_values) if residual_values else 0
-                                        color = "🔴" if highest_residual >= 3 else "🟡" if highest_residual >= 2 else "🟢"
-                                        st.metric("Highest Residual Risk", f"{highest_residual:.2f}", delta=color)
-                                    except:
-                                        st.metric("Highest Residual Risk", "N/A")
-                                else:
-                                    st.metric("Highest Residual Risk", "N/A")
-                            
-                            if not threat_controls:
-                                st.warning("⚠️ No threat control evaluations found in results")
-                            else:
-                                st.markdown("### 📊 Threat Control Analysis")
-                                
-                                for idx, threat_ctrl in enumerate(threat_controls, 1):
-                                    threat_name = threat_ctrl.get('threat', f'Threat {idx}')
-                                    with st.expander(f"Threat {idx}: {threat_name}", expanded=(idx == 1)):
-                                        
-                                        col1, col2, col3, col4 = st.columns(4)
-                                        
-                                        with col1:
-                                            controls = threat_ctrl.get('controls_identified', [])
-                                            st.metric("Controls Found", len(controls))
-                                        
-                                        with col2:
-                                            ctrl_calc = threat_ctrl.get('control_rating_calculation', {})
-                                            ctrl_rating_numeric = ctrl_calc.get('control_rating')
-                                            ctrl_rating_text = ctrl_calc.get('control_rating_text', '')
-                                            
-                                            if isinstance(ctrl_rating_numeric, (int, float)):
-                                                display_value = f"{ctrl_rating_numeric:.2f}"
-                                                if ctrl_rating_text:
-                                                    display_value += f" ({ctrl_rating_text})"
-                                            else:
-                                                display_value = ctrl_rating_numeric or ctrl_rating_text or 'N/A'
-                                            
-                                            st.metric("Control Rating", display_value)
-                                        
-                                        with col3:
-                                            risk_rating = threat_ctrl.get('risk_evaluation_rating', 'N/A')
-                                            st.metric("Risk Rating", risk_rating)
-                                        
-                                        with col4:
-                                            residual_risk = threat_ctrl.get('residual_risk', {})
-                                            residual = residual_risk.get('residual_risk_value', 0)
-                                            classification = residual_risk.get('residual_risk_classification', '')
-                                            color = "🔴" if residual >= 3 else "🟢"
-                                            st.metric("Residual Risk", residual, delta=f"{color} {classification}")
-                                
-                                        if 'control_category_averages' in threat_ctrl:
-                                            st.markdown("**Control Category Averages:**")
-                                            col1, col2, col3 = st.columns(3)
-                                            
-                                            cat_avg = threat_ctrl['control_category_averages']
-                                            
-                                            with col1:
-                                                st.metric("Preventive", f"{cat_avg.get('preventive_avg', 0):.2f}")
-                                            
-                                            with col2:
-                                                st.metric("Detective", f"{cat_avg.get('detective_avg', 0):.2f}")
-                                            
-                                            with col3:
-                                                st.metric("Corrective", f"{cat_avg.get('corrective_avg', 0):.2f}")
+                                with st.expander("📊 Classification Details"):
+                                    st.markdown(f"**Method:** {crit_method}")
+                                    st.markdown(f"**Source:** {crit_source}")
+                                    st.markdown(f"**Reasoning:** {crit_reasoning}")
+                            else:
+                                st.info("ℹ️ Criticality not classified")
+                        
+                        st.markdown("---")
+                        
+                        if 'discovery_summary' in result:
+                            with st.expander("📚 Discovered Methodologies (RAG Sources)"):
+                                discovery = result['discovery_summary']
+                                st.markdown("#### 🔍 What Agent 1 Discovered from Documents:")
+                                st.markdown("**1. CIA Rating Scale:**")
+                                st.write(f"   - {discovery.get('cia_rating_scale', 'N/A')}")
+                                st.write(f"   - Source: {discovery.get('cia_definitions_source', 'Unknown')}")
                                 
-                                        controls = threat_ctrl.get('controls_identified', [])
-                                        if controls:
-                                            st.markdown("**Controls Identified:**")
-                                            
-                                            controls_data = []
-                                            for ctrl in controls:
-                                                controls_data.append({
-                                                    "Control ID": ctrl.get('control_id', 'N/A'),
-                                                    "Name": ctrl.get('control_name', 'N/A'),
-                                                    "Category": ctrl.get('category', 'N/A'),
-                                                    "Rating": ctrl.get('current_rating', 'N/A'),
-                                                    "Source": ctrl.get('source', 'N/A')
-                                                })
-                                            
-                                            df = pd.DataFrame(controls_data)
-                                            st.dataframe(df, use_container_width=True, hide_index=True)
+                                if 'business_value_calculation_method' in discovery:
+                                    st.markdown("**2. Business Value Calculation:**")
+                                    st.write(f"   - Method: {discovery.get('business_value_calculation_method', 'N/A')}")
+                                    st.write(f"   - Levels: {', '.join(discovery.get('business_value_levels', []))}")
+                                    st.write(f"   - Source: {discovery.get('business_value_source', 'Unknown')}")
                                 
-                                        if 'control_rating_calculation' in threat_ctrl:
-                                            with st.expander("📊 Control Rating Calculation"):
-                                                calc = threat_ctrl['control_rating_calculation']
-                                                
-                                                def extract_value(calc_str):
-                                                    calc_str = str(calc_str)
-                                                    if '=' in calc_str:
-                                                        return float(calc_str.split('=')[-1].strip())
-                                                    return float(calc_str)
-                                                
-                                                try:
-                                                    weighted_p = extract_value(calc.get('weighted_preventive', 0))
-                                                    weighted_d = extract_value(calc.get('weighted_detective', 0))
-                                                    weighted_c = extract_value(calc.get('weighted_corrective', 0))
-                                                    avg_weighted = extract_value(calc.get('average_weighted', 0))
-                                                    ctrl_rating = calc.get('control_rating', 'N/A')
-                                                    
-                                                    st.markdown(f"""
-                                                    **Formula:** Control Rating = FLOOR(AVERAGE(P_avg � 1.0, D_avg � 0.75, C_avg � 0.5))
-                                                    
-                                                    **Step 1: Weighted Values**
-                                                    - Preventive: {weighted_p:.4f}
-                                                    - Detective: {weighted_d:.4f}
-                                                    - Corrective: {weighted_c:.4f}
-                                                    
-                                                    **Step 2: Average**
-                                                    - Average: {avg_weighted:.4f}
-                                                    
-                                                    **Step 3: FLOOR Function**
-                                                    - Control Rating: **{ctrl_rating}**
-                                                    """)
-                                                except Exception as e:
-                                                    st.warning(f"Could not display calculation details: {str(e)}")
+                                if 'criticality_classification_method' in discovery:
+                                    st.markdown("**3. Criticality Classification:**")
+                                    st.write(f"   - Method: {discovery.get('criticality_classification_method', 'N/A')}")
+                                    st.write(f"   - Levels: {', '.join(discovery.get('criticality_levels', []))}")
+                                    st.write(f"   - Source: {discovery.get('criticality_source', 'Unknown')}")
+                                
+                                if 'searches_performed' in discovery:
+                                    st.markdown("**4. RAG Searches Performed:**")
+                                    for search in discovery.get('searches_performed', []):
+                                        st.write(f"   - {search}")
+                                
+                                st.success("✅ All methodologies discovered from organizational documents - NO HARDCODING!")
                         
                         st.download_button(
-                            label="📥 Download Agent 3 Results (JSON)",
-                            data=json.dumps(result, indent=2),
-                            file_name=f"agent3_controls_{selected_asset['asset_name'].replace(' ', '_')}.json",
+                            label="📥 Download Agent 1 Complete Results (JSON)",
+                            data=_json_download(result, slot='agent_1'),
+                            file_name=f"agent1_complete_{selected_asset['asset_name'].replace(' ', '_')}.json",
                             mime="application/json",
                             use_container_width=True
                         )
                     else:
-                        st.info("ℹ️ Run Agent 3 to see control evaluation results")
+                        st.info("ℹ️ Run Agent 1 to see complete CIA assessment with Business Value and Criticality")
                 
-                # Agent 4 Results Tab
-                with tab4:
-                    if st.session_state.decision_result:
-                        result = st.session_state.decision_result
+                # Agent 2 Results Tab
+                with tab2:
+                    if st.session_state.risk_result:
+                        result = st.session_state.risk_result
                         
                         # Check for error
                         if 'error' in result:
-                            st.error(f"❌ Agent 4 Error: {result['error']}")
+                            st.error(f"❌ Agent 2 Error: {result['error']}")
                             if 'details' in result:
                                 with st.expander("❌ Error Details"):
                                     st.text(result['details'])
-                            st.info("ℹ️ Try clicking the Agent 4 button again.")
-                        
-                        #  CHECK FOR NEW FORMAT FIRST (management_decisions)
-                        elif 'management_decisions' in result and isinstance(result.get('management_decisions'), dict):
-                            st.success("✅ Management Decisions Generated!")
-                            
-                            decisions = result['management_decisions']
-                            
-                            # Display each threat's decision options
-                            for threat_key in sorted(decisions.keys()):
-                                threat_data = decisions[threat_key]
-                                threat_name = threat_data.get('threat_name', 'Unknown Threat')
-                                threat_index = threat_data.get('threat_index', 0)
-                                
-                                st.markdown(f"### ⚠️ Threat {threat_index}: {threat_name}")
-                                
-                                # Risk metrics
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.metric("Risk Rating", threat_data.get('risk_rating', 'N/A'))
-                                with col2:
-                                    st.metric("Residual Risk", threat_data.get('residual_risk', 'N/A'))
-                                with col3:
-                                    gaps = threat_data.get('control_gaps', [])
-                                    st.metric("Control Gaps", len(gaps))
-                                
-                                # ⚠️ CONTROL GAPS DETAILS (NEW - EXPANDED)
-                                if gaps:
-                                    with st.expander("⚠️ Control Gaps Identified", expanded=True):
-                                        for idx, gap in enumerate(gaps, 1):
-                                            if isinstance(gap, dict):
-                                                st.warning(f"**Gap {idx}: {gap.get('gap_description', 'Unknown gap')}**")
-                                                col_a, col_b = st.columns(2)
-                                                with col_a:
-                                                    if gap.get('evidence'):
-                                                        st.caption(f"📄 Evidence: {gap['evidence']}")
-                                                    if gap.get('impact'):
-                                                        st.caption(f"⚠️ Impact: {gap['impact']}")
-                                                with col_b:
-                                                    if gap.get('severity'):
-                                                        severity = gap['severity']
-                                                        color = "🔴" if severity == "HIGH" else "🟡" if severity == "MEDIUM" else "🟢"
-                                                        st.caption(f"{color} Severity: {severity}")
-                                            else:
-                                                st.warning(f"**Gap {idx}:** {gap}")
-                                
-                                # Recommended controls
-                                recommended = threat_data.get('recommended_controls', [])
-                                if recommended:
-                                    with st.expander(f"✅ Recommended Controls ({len(recommended)})", expanded=False):
-                                        for idx, ctrl in enumerate(recommended, 1):
-                                            if isinstance(ctrl, dict):
-                                                st.success(f"**{idx}. {ctrl.get('control_name', ctrl.get('control_id', 'Control'))}**")
-                                                col_a, col_b = st.columns(2)
-                                                with col_a:
-                                                    if ctrl.get('control_type'):
-                                                        st.caption(f"🏷️ Type: {ctrl['control_type']}")
-                                                    if ctrl.get('priority'):
-                                                        st.caption(f"🔥 Priority: {ctrl['priority']}")
-                                                with col_b:
-                                                    if ctrl.get('rationale'):
-                                                        st.caption(f"💭 {ctrl['rationale']}")
-                                            else:
-                                                st.success(f"{idx}. {ctrl}")
-                                
-                                # Decision options
-                                st.markdown("#### 🎯 Decision Options")
-                                
-                                decision_options = threat_data.get('decision_options', [])
-                                for opt in decision_options:
-                                    value = opt.get('value', '')
-                                    label = opt.get('label', '')
-                                    
-                                    # Emoji based on decision type
-                                    if value == 'TREAT':
-                                        emoji = "🔧"
-                                    elif value == 'ACCEPT':
-                                        emoji = "⚠️"
-                                    elif value == 'TRANSFER':
-                                        emoji = "✅"
-                                    elif value == 'TERMINATE':
-                                        emoji = "🚫"
-                                    else:
-                                        emoji = "✅"
-                                    
-                                    with st.expander(f"{emoji} {value} - {label}", expanded=(value == 'TREAT')):
-                                        st.markdown(f"**Description:**")
-                                        st.info(opt.get('description', 'N/A'))
-                                        
-                                        st.markdown(f"**Recommendation:**")
-                                        rec = opt.get('recommendation', 'N/A')
-                                        if 'recommended' in rec.lower():
-                                            st.success(rec)
-                                        else:
-                                            st.warning(rec)
-                                        
-                                        st.markdown(f"**Consequences:**")
-                                        st.write(opt.get('consequences', 'N/A'))
-                                        
-                                        col1, col2 = st.columns(2)
-                                        with col1:
-                                            st.markdown(f"**💰 Cost:** {opt.get('estimated_cost', 'N/A')}")
-                                            st.markdown(f"**⏱️ Timeline:** {opt.get('typical_timeline', 'N/A')}")
-                                        with col2:
-                                            st.markdown(f"**✅ Approval:** {opt.get('approval_required', 'N/A')}")
-                                            st.markdown(f"**📊 Monitoring:** {opt.get('monitoring_required', 'N/A')}")
-                                        
-                                        # ? SELECTION BUTTON (NEW)
-                                        st.markdown("---")
-                                        if st.button(f"🎯 Select {value} for Threat {threat_index}", 
-                                                   key=f"select_{threat_key}_{value}",
-                                                   type="primary" if value == "TREAT" else "secondary",
-                                                   use_container_width=True):
-                                            # Store selection in session state
-                                            if 'threat_decisions' not in st.session_state:
-                                                st.session_state.threat_decisions = {}
-                                            st.session_state.threat_decisions[threat_key] = {
-                                                'decision': value,
-                                                'threat_name': threat_name,
-                                                'threat_index': threat_index
-                                            }
-                                            st.rerun()
-                                
-                                # Show selected decision for this threat
-                                if 'threat_decisions' in st.session_state and threat_key in st.session_state.threat_decisions:
-                                    selected = st.session_state.threat_decisions[threat_key]
-                                    st.success(f"✅ **Selected Decision:** {selected['decision']}")
-                                
-                                st.markdown("---")
+                            if 'raw_response' in result:
+                                with st.expander("📄 Raw Output"):
+                                    st.text(result['raw_response'][:2000])
                             
-                            # ? DECISION SUMMARY (NEW)
-                            if 'threat_decisions' in st.session_state and st.session_state.threat_decisions:
-                                st.markdown("---")
-                                st.markdown("## 📊 Decision Summary")
-                                
-                                # Count decisions by type
-                                decision_counts = {}
-                                for threat_key, decision_data in st.session_state.threat_decisions.items():
-                                    dec = decision_data['decision']
-                                    decision_counts[dec] = decision_counts.get(dec, 0) + 1
-                                
-                                # Display summary
-                                col1, col2, col3, col4 = st.columns(4)
-                                with col1:
-                                    st.metric("🔧 TREAT", decision_counts.get('TREAT', 0))
-                                with col2:
-                                    st.metric("✅ ACCEPT", decision_counts.get('ACCEPT', 0))
-                                with col3:
-                                    st.metric("🔄 TRANSFER", decision_counts.get('TRANSFER', 0))
-                                with col4:
-                                    st.metric("🚫 TERMINATE", decision_counts.get('TERMINATE', 0))
-                                
-                                # List all decisions
-                                st.markdown("### Selected Decisions:")
-                                for threat_key in sorted(st.session_state.threat_decisions.keys()):
-                                    decision_data = st.session_state.threat_decisions[threat_key]
-                                    st.markdown(f"- **Threat {decision_data['threat_index']}:** {decision_data['threat_name']} → **{decision_data['decision']}** ")
-                                
-                                # Proceed button
-                                total_threats = len(decisions)
-                                selected_threats = len(st.session_state.threat_decisions)
-                                
-                                if selected_threats > 0:
-                                    if selected_threats == total_threats:
-                                        st.success(f"✅ All {total_threats} threats have decisions selected!")
-                                    else:
-                                        st.info(f"ℹ️ {selected_threats} of {total_threats} threats have decisions selected. You can proceed with selected threats or select more.")
-                                    
-                                    if st.button("🚀 Proceed with Selected Decisions", type="primary", use_container_width=True):
-                                        st.session_state.processing_workflows = True
-                                        st.rerun()
-                                else:
-                                    st.warning(f"⚠️ Please select at least one decision to proceed ({selected_threats}/{total_threats} selected)")
-                                
-                                # Reset button
-                                if st.button("🔄 Reset All Decisions", use_container_width=True):
-                                    st.session_state.threat_decisions = {}
-                                    # ✅ FIX: Also clear workflow processing state
-                                    if 'processing_workflows' in st.session_state:
-                                        del st.session_state.processing_workflows
-                                    if 'current_decision_index' in st.session_state:
-                                        del st.session_state.current_decision_index
-                                    
-                                    # ✅ FIX: Clear all cached questionnaires and forms
-                                    keys_to_delete = []
-                                    for key in st.session_state.keys():
-                                        if any(x in key for x in ['_questionnaire_', '_form_', 'accept_q_', 'transfer_q_', 'terminate_q_', 'treat_key_']):
-                                            keys_to_delete.append(key)
-                                    
-                                    for key in keys_to_delete:
-                                        del st.session_state[key]
-                                    
-                                    st.rerun()
-
+                            # Show retry suggestion
+                            st.info("ℹ️ Try clicking the Agent 2 button again. The system will automatically rotate API keys if needed.")
+                        else:
+                            st.markdown("### 📊 Risk Summary")
+                            
+                            # Handle summary with defaults
+                            summary = result.get('summary', {})
+                            
+                            col1, col2, col3, col4 = st.columns(4)
+                            
+                            with col1:
+                                st.metric("Total Threats", summary.get('total_threats_assessed', 0))
+                            
+                            with col2:
+                                st.metric("Highest Risk Value", summary.get('highest_risk_value', 0))
+                            
+                            with col3:
+                                st.metric("Non-Acceptable Risks", summary.get('non_acceptable_risks_count', 0), delta="🔴")
+                            
+                            with col4:
+                                st.metric("Acceptable Risks", summary.get('acceptable_risks_count', 0), delta="🔴")
+                        
+                            st.markdown("### ⚠️ Threat Risk Analysis")
+                            
+                            # Get threat list with fallback
+                            threats = result.get('threat_risk_quantification', result.get('risk_assessments', []))
+                            
+                            for idx, threat_risk in enumerate(threats, 1):
+                                # Get threat name - Agent 2 should provide specific threat names
+                                threat_name = threat_risk.get('threat', threat_risk.get('threat_name', 'Unknown Threat'))
                                 
-                                # ============================================================
-                                # WORKFLOW PROCESSING - TRANSFER
-                                # ============================================================
+                                # If it's still the placeholder, make it more descriptive
+                                if threat_name in ['To be assessed by agents', 'Unknown Threat', 'General security threats']:
+                                    if 'risk_statement' in threat_risk:
+                                        threat_name = f"Security Threat {idx}"
+                                    else:
+                                        threat_name = f"Threat {idx}"
                                 
-                                # Check if we should process workflows
-                                if st.session_state.get('processing_workflows', False):
-                                    st.markdown("---")
-                                    st.markdown("## 🔄 Processing Selected Decisions")
-                                    
-                                    # 🆕 SEQUENTIAL WORKFLOW: Track current decision index
-                                    if 'current_decision_index' not in st.session_state:
-                                        st.session_state.current_decision_index = 0
+                                with st.expander(f"**{threat_name}**", expanded=(idx == 1)):
+                                    col1, col2, col3, col4 = st.columns(4)
                                     
-                                    # Get sorted list of threat keys
-                                    sorted_threat_keys = sorted(st.session_state.threat_decisions.keys())
-                                    total_decisions = len(sorted_threat_keys)
-                                    current_idx = st.session_state.current_decision_index
+                                    with col1:
+                                        risk_impact = threat_risk.get('risk_impact', {})
+                                        if isinstance(risk_impact, dict):
+                                            rating = risk_impact.get('rating', 'N/A')
+                                            category = risk_impact.get('category', '')
+                                            st.metric("Risk Impact", f"{rating}/5" if isinstance(rating, (int, float)) else rating, delta=category)
+                                        else:
+                                            st.metric("Risk Impact", risk_impact)
                                     
-                                    # Show progress
-                                    progress_value = min(1.0, (current_idx + 1) / total_decisions)
-                                    st.progress(progress_value)
-                                    st.caption(f"Processing Decision {min(current_idx + 1, total_decisions)} of {total_decisions}")
-                                    st.markdown("---")
+                                    with col2:
+                                        risk_prob = threat_risk.get('risk_probability', {})
+                                        if isinstance(risk_prob, dict):
+                                            rating = risk_prob.get('rating', 'N/A')
+                                            category = risk_prob.get('category', '')
+                                            st.metric("Risk Probability", f"{rating}/5" if isinstance(rating, (int, float)) else rating, delta=category)
+                                        else:
+                                            st.metric("Risk Probability", risk_prob)
                                     
-                                    # Process ONLY the current decision
-                                    if current_idx < total_decisions:
-                                        threat_key = sorted_threat_keys[current_idx]
-                                    else:
-                                        # All decisions completed
-                                        st.success("✅ All decisions processed!")
-                                        st.info("📊 View Risk Register to see all saved risks")
-                                        if st.button("🔄 Start Over", type="primary"):
-                                            st.session_state.current_decision_index = 0
-                                            st.session_state.processing_workflows = False
-                                            st.rerun()
-                                        threat_key = None
+                                    with col3:
+                                        risk_val = threat_risk.get('risk_value', {})
+                                        if isinstance(risk_val, dict):
+                                            st.metric("Risk Value", risk_val.get('value', 'N/A'))
+                                        else:
+                                            st.metric("Risk Value", risk_val)
                                     
-                                    if threat_key:
-                                        decision_data = st.session_state.threat_decisions[threat_key]
-                                        decision = decision_data['decision']
-                                        threat_name = decision_data['threat_name']
-                                        threat_index = decision_data['threat_index']
-                                        
-                                        # Get threat data from decisions
-                                        threat_data = decisions.get(threat_key, {})
-                                        
-                                        st.markdown(f"### 🎯 Threat {threat_index}: {threat_name}")
-                                        st.info(f"**Decision:** {decision}")
-                                        
-                                        # TREAT WORKFLOW
-                                        if decision == "TREAT":
-                                            st.markdown(f"#### 🔧 Treatment Plan for: {threat_name}")
-                                            
-                                            control_gaps = threat_data.get('control_gaps', [])
-                                            recommended_controls = threat_data.get('recommended_controls', [])
-                                            
-                                            col1, col2, col3 = st.columns(3)
-                                            with col1:
-                                                st.metric("Control Gaps", len(control_gaps))
-                                            with col2:
-                                                st.metric("Recommended Controls", len(recommended_controls))
-                                            with col3:
-                                                st.metric("Risk Rating", threat_data.get('risk_rating', 'N/A'))
-                                            
-                                            if recommended_controls:
-                                                st.info(f"✅ Select controls to implement for **{threat_name}**:")
-                                                
-                                                threat_key = f"selected_controls_{threat_index}"
-                                                if threat_key not in st.session_state:
-                                                    st.session_state[threat_key] = list(range(len(recommended_controls)))
-                                                
-                                                for idx, control in enumerate(recommended_controls):
-                                                    col_check, col_content = st.columns([0.1, 0.9])
-                                                    with col_check:
-                                                        selected = st.checkbox("Select", value=idx in st.session_state[threat_key], key=f"treat_ctrl_{threat_index}_{idx}", label_visibility="collapsed")
-                                                        if selected and idx not in st.session_state[threat_key]:
-                                                            st.session_state[threat_key].append(idx)
-                                                        elif not selected and idx in st.session_state[threat_key]:
-                                                            st.session_state[threat_key].remove(idx)
-                                                    with col_content:
-                                                        control_name = control.get('control_name', control.get('control_id', f'Control {idx+1}'))
-                                                        with st.expander(f"🛡️ {control_name}", expanded=False):
-                                                            col1, col2 = st.columns(2)
-                                                            with col1:
-                                                                if control.get('control_type'):
-                                                                    st.caption(f"🏷️ Type: {control['control_type']}")
-                                                                if control.get('priority'):
-                                                                    st.caption(f"🔥 Priority: {control['priority']}")
-                                                            with col2:
-                                                                if control.get('rationale'):
-                                                                    st.caption(f"💭 Rationale: {control['rationale']}")
-                                                            if control.get('description'):
-                                                                st.info(control['description'])
-                                                            if control.get('implementation_guidance'):
-                                                                st.success(f"**Implementation:** {control['implementation_guidance']}")
-                                                            if control.get('addresses_gap'):
-                                                                st.warning(f"**Addresses Gap:** {control['addresses_gap']}")
-                                                            if not any([control.get('description'), control.get('implementation_guidance'), control.get('addresses_gap'), control.get('rationale')]):
-                                                                st.caption("No additional details available")
-                                                
-                                                st.caption(f"✅ {len(st.session_state[threat_key])} of {len(recommended_controls)} controls selected")
-                                                
-                                                if st.button(f"🤖 Generate Treatment Plan", key=f"gen_treat_{threat_index}", type="primary"):
-                                                    if not st.session_state[threat_key]:
-                                                        st.error("❌ Select at least one control!")
-                                                    else:
-                                                        with st.spinner("🤖 Generating..."):
-                                                            from phase2_risk_resolver.agents.agent_4_treatment_plan import generate_treatment_plan
-                                                            selected_controls = [recommended_controls[i] for i in st.session_state[threat_key] if i < len(recommended_controls)]
-                                                            risk_data = {'asset_name': selected_asset.get('asset_name'), 'asset_type': selected_asset.get('asset_type'), 'threat_name': threat_name, 'risk_rating': threat_data.get('risk_rating', 0), 'selected_controls': selected_controls, 'control_gaps': control_gaps}
-                                                            plan = execute_agent_with_retry(generate_treatment_plan, "Treatment Plan", agent_3_results=st.session_state.control_result, risk_data=risk_data)
-                                                            if 'error' not in plan:
-                                                                st.session_state[f"treatment_plan_{threat_index}"] = plan
-                                                                st.success("✅ Generated!")
-                                                                st.rerun()
-                                                            else:
-                                                                st.error(f"❌ {plan.get('error')}")
-                                            else:
-                                                st.warning("⚠️ No recommended controls found")
-                                            
-                                            treat_key = f"treatment_plan_{threat_index}"
-                                            if treat_key in st.session_state:
-                                                st.markdown("---")
-                                                st.markdown("### 📋 Generated Treatment Plan")
-                                                
-                                                plan = st.session_state[treat_key]
-                                                
-                                                # Display treatment plan in user-friendly format
-                                                if isinstance(plan, dict):
-                                                    # Treatment Actions
-                                                    if plan.get('treatment_actions'):
-                                                        st.markdown("#### 🔧 Treatment Actions")
-                                                        actions = plan['treatment_actions']
-                                                        if isinstance(actions, list):
-                                                            for idx, action in enumerate(actions, 1):
-                                                                if isinstance(action, dict):
-                                                                    # Get control info
-                                                                    control_id = action.get('control_id', f'ACTION-{idx}')
-                                                                    threat = action.get('threat', 'Action')
-                                                                    
-                                                                    with st.expander(f"Action {idx}: {control_id} - {threat}", expanded=True):
-                                                                        # Description of activities
-                                                                        if action.get('description_of_activities'):
-                                                                            st.info(f"**Activities:** {action['description_of_activities']}")
-                                                                        
-                                                                        # Key details in columns
-                                                                        col1, col2 = st.columns(2)
-                                                                        with col1:
-                                                                            if action.get('implementation_priority'):
-                                                                                st.caption(f"🔥 Priority: {action['implementation_priority']}")
-                                                                            if action.get('implementation_responsibility'):
-                                                                                st.caption(f"👤 Responsible: {action['implementation_responsibility']}")
-                                                                            if action.get('estimated_cost'):
-                                                                                st.caption(f"💰 Cost: {action['estimated_cost']}")
-                                                                        with col2:
-                                                                            if action.get('proposed_start_date'):
-                                                                                st.caption(f"📅 Start: {action['proposed_start_date']}")
-                                                                            if action.get('proposed_completion_date'):
-                                                                                st.caption(f"⏱️ Complete: {action['proposed_completion_date']}")
-                                                                            if action.get('estimated_duration_days'):
-                                                                                st.caption(f"⏳ Duration: {action['estimated_duration_days']} days")
-                                                                        
-                                                                        # Resources
-                                                                        if action.get('necessary_resources'):
-                                                                            st.success(f"**Resources:** {action['necessary_resources']}")
-                                                                        
-                                                                        # Evaluation method
-                                                                        if action.get('method_for_evaluation'):
-                                                                            st.warning(f"**Success Criteria:** {action['method_for_evaluation']}")
-                                                                        
-                                                                        # Expected risk reduction
-                                                                        if action.get('expected_risk_reduction'):
-                                                                            st.caption(f"📉 Expected Risk Reduction: {action['expected_risk_reduction']}")
-                                                                else:
-                                                                    st.write(f"{idx}. {action}")
-                                                    
-                                                    # Summary
-                                                    if plan.get('summary'):
-                                                        st.markdown("#### 📊 Summary")
-                                                        summary = plan['summary']
-                                                        col1, col2, col3, col4 = st.columns(4)
-                                                        with col1:
-                                                            st.metric("Total Actions", summary.get('total_actions', 0))
-                                                        with col2:
-                                                            st.metric("Total Cost", summary.get('total_estimated_cost', 'N/A'))
-                                                        with col3:
-                                                            st.metric("Duration", f"{summary.get('total_duration_days', 0)} days")
-                                                        with col4:
-                                                            st.metric("Expected Risk After", summary.get('expected_residual_risk_after', 'N/A'))
-                                                    
-                                                    # Show full JSON in expander for reference
-                                                    with st.expander("📄 View Full Plan (JSON)", expanded=False):
-                                                        st.json(plan)
-                                                else:
-                                                    # Fallback: show as JSON if not dict
-                                                    st.json(plan)
-                                                
-                                                if st.button(f"💾 Save to Risk Register", key=f"save_treat_{threat_index}", type="primary"):
-                                                    with st.spinner("💾 Saving..."):
-                                                        try:
-                                                            from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                            
-                                                            # ✅ FIX: Filter agent_2_results to include ONLY current threat
-                                                            all_threats = st.session_state.risk_result.get('threat_risk_quantification', [])
-                                                            current_threat_data = None
-                                                            for t in all_threats:
-                                                                if t.get('threat') == threat_name:
-                                                                    current_threat_data = t
-                                                                    break
-                                                            
-                                                            if not current_threat_data:
-                                                                st.error(f"❌ Could not find threat data for: {threat_name}")
-                                                            else:
-                                                                # Create filtered agent_2_results with only current threat
-                                                                filtered_agent_2 = {
-                                                                    **st.session_state.risk_result,
-                                                                    'threat_risk_quantification': [current_threat_data]
-                                                                }
-                                                                
-                                                                risk_ids = save_assessment_to_risk_register(
-                                                                    asset_data=st.session_state.selected_asset, 
-                                                                    agent_1_results=st.session_state.impact_result, 
-                                                                    agent_2_results=filtered_agent_2,
-                                                                    agent_3_results=st.session_state.control_result, 
-                                                                    agent_4_results={'management_decision': 'TREAT', 'treatment_plan': st.session_state[treat_key]}
-                                                                )
-                                                                
-                                                                if risk_ids and len(risk_ids) > 0:
-                                                                    st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
-                                                                    st.session_state.current_decision_index += 1
-                                                                    st.rerun()
-                                                                else:
-                                                                    st.error("❌ Save returned no Risk IDs")
-                                                        except Exception as e:
-                                                            st.error(f"❌ Save failed: {str(e)}")
-                                                            import traceback
-                                                            with st.expander("Debug"):
-                                                                st.code(traceback.format_exc())
-                                        
-                                        # ACCEPT WORKFLOW
-                                        elif decision == "ACCEPT":
-                                            st.markdown(f"#### ⚠️ Risk Acceptance for: {threat_name}")
-                                            
-                                            accept_key = f"accept_q_{threat_key}"
-                                            if accept_key not in st.session_state:
-                                                with st.spinner("🤖 Generating acceptance questionnaire..."):
-                                                    # Get actual Risk ID from database if it exists, otherwise use temp ID
-                                                    import sqlite3
-                                                    try:
-                                                        conn = sqlite3.connect('database/risk_register.db')
-                                                        cursor = conn.cursor()
-                                                        cursor.execute("SELECT MAX(CAST(SUBSTR(risk_id, 5) AS INTEGER)) FROM risks WHERE risk_id LIKE 'RSK-%'")
-                                                        result = cursor.fetchone()
-                                                        next_num = (result[0] or 0) + 1
-                                                        actual_risk_id = f"RSK-{next_num:03d}"
-                                                        conn.close()
-                                                    except:
-                                                        actual_risk_id = f"RSK-{threat_index:03d}"
-                                                    
-                                                    ctx = {'risk_id': actual_risk_id, 'asset_name': selected_asset.get('asset_name'), 'threat_name': threat_name, 'inherent_risk_rating': threat_data.get('risk_rating', 0), 'residual_risk_rating': threat_data.get('residual_risk', 0), 'control_gaps': threat_data.get('control_gaps', [])}
-                                                    q = execute_agent_with_retry(generate_acceptance_questionnaire, "Acceptance Q", risk_context=ctx)
-                                                    st.session_state[accept_key] = q
-                                                    st.session_state[f"{accept_key}_risk_id"] = actual_risk_id
-                                                    st.rerun()
-                                            
-                                            q = st.session_state[accept_key]
-                                            actual_risk_id = st.session_state.get(f"{accept_key}_risk_id", f"RSK-{threat_index:03d}")
-                                            if 'error' not in q:
-                                                # Get actual risk data
-                                                risk_category = threat_data.get('risk_category', 'Security Risk')
-                                                if not risk_category or risk_category == 'N/A':
-                                                    risk_category = selected_asset.get('asset_type', 'Security Risk')
-                                                current_risk = threat_data.get('risk_rating', 'N/A')
-                                                residual_risk = threat_data.get('residual_risk', 'N/A')
-                                                risk_description = f"Asset: {selected_asset.get('asset_name')}, Threat: {threat_name}. Risk Rating: {current_risk}, Residual Risk: {residual_risk}"
-                                                
-                                                # Display risk context (AI pre-filled)
-                                                st.info("📊 **Risk Context** (Auto-filled by AI from Agents 1-3)")
-                                                col1, col2, col3 = st.columns(3)
-                                                with col1:
-                                                    st.caption(f"**Risk ID:** {actual_risk_id}")
-                                                    st.caption(f"**Category:** {risk_category}")
-                                                with col2:
-                                                    st.caption(f"**Current Risk:** {current_risk}")
-                                                    st.caption(f"**Residual Risk:** {residual_risk}")
-                                                with col3:
-                                                    st.caption(f"**Threat:** {threat_name[:80]}..." if len(threat_name) > 80 else f"**Threat:** {threat_name}")
-                                                st.markdown("---")
-                                                
-                                                # 📧 EMAIL OPTION - Choose between manual fill or email send
-                                                st.info("💡 **Choose how to complete the acceptance questionnaire:**")
-                                                
-                                                col_option1, col_option2 = st.columns(2)
-                                                
-                                                with col_option1:
-                                                    st.markdown("### 📧 Option 1: Send via Email")
-                                                    st.caption("Send questionnaire to risk owner/approver")
-                                                    
-                                                    recipient_email_accept = st.text_input(
-                                                        "Recipient Email Address",
-                                                        placeholder="risk.owner@company.com",
-                                                        key=f"recipient_email_accept_{threat_key}",
-                                                        help="Email address of the person who will complete the acceptance questionnaire"
-                                                    )
-                                                    
-                                                    if st.button("📧 Send Acceptance Questionnaire Email", key=f"send_accept_email_{threat_key}", type="primary", disabled=not recipient_email_accept):
-                                                        with st.spinner(f"📧 Sending email to {recipient_email_accept}..."):
-                                                            try:
-                                                                from email_sender import send_questionnaire_email
-                                                                
-                                                                # 🆕 Prepare agent results for storage
-                                                                # Get ORIGINAL Agent 2 threat data
-                                                                agent_2_threats = st.session_state.get('risk_result', {}).get('threat_risk_quantification', [])
-                                                                original_threat = next((t for t in agent_2_threats if t.get('threat') == threat_name), threat_data)
-                                                                
-                                                                agent_results = {
-                                                                    'agent_1': st.session_state.get('impact_result', {}),
-                                                                    'agent_2': st.session_state.get('risk_result', {}),
-                                                                    'agent_3': st.session_state.get('control_result', {}),
-                                                                    'selected_asset': st.session_state.get('selected_asset', {}),
-                                                                    'threat_data': original_threat
-                                                                }
-                                                                
-                                                                result = send_questionnaire_email(
-                                                                    recipient_email=recipient_email_accept,
-                                                                    asset_name=selected_asset.get('asset_name'),
-                                                                    questionnaire=q,
-                                                                    questionnaire_type='ACCEPT',
-                                                                    agent_results=agent_results
-                                                                )
-                                                                
-                                                                if result and result.get('success'):
-                                                                    st.success(f"✅ Email sent successfully to {recipient_email_accept}!")
-                                                                    st.info(f"📋 **Tracking Token:** {result['token']}")
-                                                                    st.caption("The recipient will receive a link to fill the questionnaire online. Once completed, it will appear in 'Pending Questionnaires' section.")
-                                                                    # ✅ Sequential workflow: Move to next threat after email send
-                                                                    st.session_state.current_decision_index += 1
-                                                                    time.sleep(1)
-                                                                    st.rerun()
-                                                                else:
-                                                                    error_msg = result.get('error', 'Unknown error') if result else 'No response'
-                                                                    st.error(f"❌ Failed to send email: {error_msg}")
-                                                            except Exception as e:
-                                                                st.error(f"❌ Error: {str(e)}")
-                                                                import traceback
-                                                                with st.expander("🔍 Error Details"):
-                                                                    st.code(traceback.format_exc())
-                                                
-                                                with col_option2:
-                                                    st.markdown("### ✍️ Option 2: Fill Manually")
-                                                    st.caption("Fill the questionnaire yourself right now")
-                                                    st.info("👇 Scroll down to see the questionnaire form below")
-                                                
-                                                st.markdown("---")
-                                                
-                                                # Render questionnaire sections
-                                                for section_idx, section in enumerate(q.get('sections', [])):
-                                                    section_title = section.get('section_title', section.get('title', ''))
-                                                    if section_title and section_title.strip().lower() != 'section':
-                                                        st.markdown(f"### {section_title}")
-                                                        # Show section help text
-                                                        section_help = section.get('help_text', section.get('description', ''))
-                                                        if section_help:
-                                                            st.caption(f"ℹ️ {section_help}")
-                                                    
-                                                    # Handle both 'questions' and 'fields' keys
-                                                    questions_list = section.get('questions', section.get('fields', []))
-                                                    for q_idx, qu in enumerate(questions_list):
-                                                        q_id = qu.get('question_id', qu.get('id', f'Q{section_idx}_{q_idx}'))
-                                                        q_text = qu.get('question_text', qu.get('question', qu.get('text', 'Question')))
-                                                        # AGGRESSIVE CLEANUP: Remove ALL markdown formatting
-                                                        q_text = str(q_text).replace('**', '').replace('__', '').replace('_', '').strip()
-                                                        # Remove extra spaces
-                                                        q_text = ' '.join(q_text.split())
-                                                        q_type = qu.get('question_type', qu.get('type', 'text'))
-                                                        q_help = qu.get('help_text', '')
-                                                        q_placeholder = qu.get('placeholder', '')
-                                                        q_required = qu.get('required', False)
-                                                        options = qu.get('options', [])
-                                                        # Add section and question index to ensure uniqueness
-                                                        widget_key = f"acc_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
-                                                        
-                                                        # Add required indicator
-                                                        display_text = f"{q_text} {'*' if q_required else ''}"
-                                                        
-                                                        # Handle display-only fields (AI provided) - populate with actual data
-                                                        if q_type == 'display':
-                                                            # Get the value to display
-                                                            display_value = qu.get('value', '')
-                                                            
-                                                            # Replace placeholders with actual data
-                                                            if 'RISK_ID' in str(display_value).upper() or 'risk_id' in q_id.lower():
-                                                                display_value = actual_risk_id
-                                                            elif 'RISK_CATEGORY' in str(display_value).upper() or 'risk_category' in q_id.lower():
-                                                                display_value = risk_category
-                                                            elif 'RISK_DESCRIPTION' in str(display_value).upper() or 'risk_description' in q_id.lower():
-                                                                display_value = risk_description
-                                                            
-                                                            st.info(f"ℹ️ {q_text} {display_value}")
-                                                            continue
-                                                        
-                                                        if q_type in ['text_area', 'textarea']:
-                                                            st.text_area(display_text, key=widget_key, help=q_help, placeholder=q_placeholder, height=100)
-                                                        elif q_type == 'date':
-                                                            from datetime import date
-                                                            st.date_input(display_text, value=date.today(), key=widget_key, help=q_help)
-                                                        elif q_type == 'text':
-                                                            st.text_input(display_text, key=widget_key, help=q_help, placeholder=q_placeholder)
-                                                        elif q_type in ['select', 'dropdown']:
-                                                            if options:
-                                                                opts = [opt.get('label', opt.get('value', str(opt))) if isinstance(opt, dict) else str(opt) for opt in options]
-                                                                st.selectbox(display_text, options=opts, key=widget_key, help=q_help)
-                                                            else:
-                                                                st.text_input(display_text, key=widget_key, help=q_help, placeholder=q_placeholder)
-                                                        elif q_type in ['checkbox', 'multiselect']:
-                                                            # Display question text as plain text (already cleaned)
-                                                            st.write(f"**{q_text}**")
-                                                            if q_help:
-                                                                st.caption(f"ℹ️ {q_help}")
-                                                            for idx, opt in enumerate(options):
-                                                                if isinstance(opt, dict):
-                                                                    # Handle both control_gaps structure and treatment controls structure
-                                                                    ctrl_name = opt.get('label', opt.get('control_name', opt.get('gap_description', f'Control {idx+1}')))
-                                                                    # Clean markdown from control name
-                                                                    ctrl_name = str(ctrl_name).replace('**', '')
-                                                                    
-                                                                    with st.expander(f"🛡️ {ctrl_name}", expanded=False):
-                                                                        # Show description or gap details
-                                                                        if opt.get('description'):
-                                                                            desc = str(opt['description']).replace('**', '')
-                                                                            st.info(desc)
-                                                                        elif opt.get('gap_description'):
-                                                                            gap_desc = str(opt['gap_description']).replace('**', '')
-                                                                            st.info(f"**Gap:** {gap_desc}")
-                                                                        
-                                                                        # Show evidence, impact, severity for control gaps
-                                                                        if opt.get('evidence'):
-                                                                            st.caption(f"📋 Evidence: {opt['evidence']}")
-                                                                        if opt.get('impact'):
-                                                                            st.caption(f"⚠️ Impact: {opt['impact']}")
-                                                                        if opt.get('severity'):
-                                                                            severity_color = {"CRITICAL": "🔴", "HIGH": "🔴", "MEDIUM": "🟡", "LOW": "🟢"}.get(opt['severity'], "⚪")
-                                                                            st.caption(f"{severity_color} Severity: {opt['severity']}")
-                                                                        
-                                                                        # Show control details (for treatment controls)
-                                                                        col1, col2 = st.columns(2)
-                                                                        with col1:
-                                                                            if opt.get('priority'):
-                                                                                st.caption(f"🔥 Priority: {opt['priority']}")
-                                                                            if opt.get('cost'):
-                                                                                st.caption(f"💰 Cost: {opt['cost']}")
-                                                                            if opt.get('control_type'):
-                                                                                st.caption(f"🏷️ Type: {opt['control_type']}")
-                                                                        with col2:
-                                                                            if opt.get('timeline'):
-                                                                                st.caption(f"⏱️ Timeline: {opt['timeline']}")
-                                                                            if opt.get('risk_reduction'):
-                                                                                st.caption(f"📉 Risk Reduction: {opt['risk_reduction']}")
-                                                                            if opt.get('complexity'):
-                                                                                st.caption(f"⚙️ Complexity: {opt['complexity']}")
-                                                                        if opt.get('addresses_gap'):
-                                                                            st.warning(f"**Addresses Gap:** {opt['addresses_gap']}")
-                                                                        
-                                                                        st.checkbox(f"Select {ctrl_name}", key=f"{widget_key}_opt_{idx}")
-                                                                else:
-                                                                    st.checkbox(str(opt), key=f"{widget_key}_opt_{idx}")
-                                                        else:
-                                                            st.text_input(display_text, key=widget_key, help=q_help, placeholder=q_placeholder)
-                                                
-                                                if st.button("✅ Submit & Generate Acceptance Form", key=f"sub_acc_{threat_key}", type="primary"):
-                                                    # Collect answers - MUST iterate with same indices as rendering
-                                                    answers = {}
-                                                    for section_idx, section in enumerate(q.get('sections', [])):
-                                                        questions_list = section.get('questions', section.get('fields', []))
-                                                        for q_idx, qu in enumerate(questions_list):
-                                                            q_id = qu.get('question_id', qu.get('id', f'Q{section_idx}_{q_idx}'))
-                                                            q_type = qu.get('question_type', qu.get('type', 'text'))
-                                                            # Use SAME key format as rendering
-                                                            widget_key = f"acc_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
-                                                            
-                                                            if q_type in ['checkbox', 'multiselect']:
-                                                                selected = []
-                                                                for idx, opt in enumerate(qu.get('options', [])):
-                                                                    if st.session_state.get(f"{widget_key}_opt_{idx}", False):
-                                                                        if isinstance(opt, dict):
-                                                                            selected.append(opt.get('label', opt.get('control_name', str(opt))))
-                                                                        else:
-                                                                            selected.append(str(opt))
-                                                                answers[q_id] = selected
-                                                            else:
-                                                                val = st.session_state.get(widget_key, '')
-                                                                # Convert date objects to strings
-                                                                if hasattr(val, 'strftime'):
-                                                                    val = val.strftime('%Y-%m-%d')
-                                                                answers[q_id] = val
-                                                    
-                                                    # Generate acceptance form
-                                                    with st.spinner("🤖 Generating acceptance form..."):
-                                                        from phase2_risk_resolver.agents.agent_4_acceptance_form import generate_acceptance_form
-                                                        ctx = {'risk_id': actual_risk_id, 'asset_name': selected_asset.get('asset_name'), 'threat_name': threat_name, 'inherent_risk_rating': threat_data.get('risk_rating', 0), 'residual_risk_rating': threat_data.get('residual_risk', 0)}
-                                                        form = generate_acceptance_form(risk_context=ctx, questionnaire_answers=answers, questionnaire_structure=q, api_key=api_key)
-                                                        
-                                                        # Store in session state
-                                                        st.session_state[f"acceptance_form_{threat_key}"] = form
-                                                        st.session_state[f"acceptance_answers_{threat_key}"] = answers
-                                                        st.rerun()
-                                                
-                                                # Display form if it exists in session state
-                                                if f"acceptance_form_{threat_key}" in st.session_state:
-                                                    form = st.session_state[f"acceptance_form_{threat_key}"]
-                                                    answers = st.session_state.get(f"acceptance_answers_{threat_key}", {})
-                                                    
-                                                    # 🔧 FIX: Convert malformed selected_controls FIRST (before HTML cleaning)
-                                                    if 'compensating_controls' in form and isinstance(form['compensating_controls'], dict):
-                                                        sc = form['compensating_controls'].get('selected_controls')
-                                                        # Check if it's a dict with numeric keys {0: {...}, 1: {...}}
-                                                        if isinstance(sc, dict) and all(str(k).isdigit() for k in sc.keys()):
-                                                            form['compensating_controls']['selected_controls'] = [sc[k] for k in sorted(sc.keys(), key=int)]
-                                                        # Check if it's a stringified list "[{...}]"
-                                                        elif isinstance(sc, str) and sc.strip().startswith('['):
-                                                            try:
-                                                                import ast
-                                                                form['compensating_controls']['selected_controls'] = ast.literal_eval(sc)
-                                                            except:
-                                                                pass
-                                                    
-                                                    # 🔧 FIX: Clean HTML entities from entire form recursively
-                                                    import html
-                                                    def clean_html_recursive(obj):
-                                                        if isinstance(obj, str):
-                                                            return html.unescape(obj)
-                                                        elif isinstance(obj, dict):
-                                                            return {k: clean_html_recursive(v) for k, v in obj.items()}
-                                                        elif isinstance(obj, list):
-                                                            return [clean_html_recursive(item) for item in obj]
-                                                        return obj
-                                                    
-                                                    form = clean_html_recursive(form)
-                                                    
-                                                    if 'error' not in form:
-                                                        st.success("✅ Acceptance Form Generated!")
-                                                        
-                                                        # 🆕 100% DYNAMIC FORM DISPLAY - No hardcoded sections
-                                                        emoji_map = {'metadata': '📋', 'risk_context': '⚠️', 'engagement_project': '🏢', 
-                                                                     'compensating_controls': '🛡️', 'justification': '📝', 
-                                                                     'approvals': '✅', 'signoff': '✍️'}
-                                                        
-                                                        # 📋 RISK ACCEPTANCE FORM HEADING
-                                                        st.markdown("### 📋 Risk Acceptance Form")
-                                                        st.markdown("---")
-                                                        
-                                                        for key, value in form.items():
-                                                            emoji = emoji_map.get(key, '📌')
-                                                            section_title = key.replace('_', ' ').title()
-                                                            
-                                                            # Display metadata fields without section heading
-                                                            if key == 'metadata':
-                                                                if isinstance(value, dict):
-                                                                    for k, v in value.items():
-                                                                        st.write(f"**{k.replace('_', ' ').title()}:** {v}")
-                                                                continue
-                                                            
-                                                            st.markdown(f"### {emoji} {section_title}")
-                                                            
-                                                            # 🆕 100% DYNAMIC: Parse any stringified data recursively
-                                                            def parse_value(val):
-                                                                """Recursively parse stringified JSON/dicts"""
-                                                                if isinstance(val, str) and (val.strip().startswith('{') or val.strip().startswith('[')):
-                                                                    try:
-                                                                        import ast
-                                                                        import html
-                                                                        unescaped = html.unescape(val)
-                                                                        try:
-                                                                            return json.loads(unescaped)
-                                                                        except:
-                                                                            return ast.literal_eval(unescaped)
-                                                                    except:
-                                                                        return val
-                                                                elif isinstance(val, list):
-                                                                    return [parse_value(item) for item in val]
-                                                                elif isinstance(val, dict):
-                                                                    return {k: parse_value(v) for k, v in val.items()}
-                                                                return val
-                                                            
-                                                            def display_value(k, v):
-                                                                """Display any value type dynamically"""
-                                                                field_name = k.replace('_', ' ').title()
-                                                                
-                                                                if isinstance(v, dict):
-                                                                    # Nested dict - show as grouped section
-                                                                    st.markdown(f"**{field_name}:**")
-                                                                    for dk, dv in v.items():
-                                                                        st.write(f"  • **{dk.replace('_', ' ').title()}:** {dv}")
-                                                                elif isinstance(v, list) and v and isinstance(v[0], dict):
-                                                                    # List of dicts - show in expanders
-                                                                    st.markdown(f"**{field_name}:**")
-                                                                    for idx, item in enumerate(v, 1):
-                                                                        label = item.get('name') or item.get('label') or item.get('description') or item.get('gap_description') or f"Item {idx}"
-                                                                        if len(str(label)) > 50:
-                                                                            label = str(label)[:50] + "..."
-                                                                        with st.expander(f"📋 {label}", expanded=False):
-                                                                            for ik, iv in item.items():
-                                                                                st.write(f"**{ik.replace('_', ' ').title()}:** {iv}")
-                                                                elif isinstance(v, list):
-                                                                    st.write(f"**{field_name}:** {', '.join(str(x) for x in v)}")
-                                                                else:
-                                                                    st.write(f"**{field_name}:** {v}")
-                                                            
-                                                            if isinstance(value, dict):
-                                                                parsed_value = parse_value(value)
-                                                                for k, v in parsed_value.items():
-                                                                    display_value(k, v)
-                                                            elif isinstance(value, list):
-                                                                parsed_value = parse_value(value)
-                                                                for item in parsed_value:
-                                                                    if isinstance(item, dict):
-                                                                        for ik, iv in item.items():
-                                                                            display_value(ik, iv)
-                                                                        st.write("---")
-                                                                    else:
-                                                                        st.write(f"- {item}")
-                                                            else:
-                                                                st.write(value)
-                                                        
-                                                        with st.expander("📄 Raw JSON"):
-                                                            st.json(form)
-                                                        
-                                                        if st.button(f"💾 Save to Risk Register", key=f"save_acc_{threat_key}", type="primary"):
-                                                            with st.spinner("💾 Saving..."):
-                                                                try:
-                                                                    from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                                    
-                                                                    # Filter agent_2_results to include ONLY current threat
-                                                                    all_threats = st.session_state.risk_result.get('threat_risk_quantification', [])
-                                                                    current_threat_data = None
-                                                                    for t in all_threats:
-                                                                        if t.get('threat') == threat_name:
-                                                                            current_threat_data = t
-                                                                            break
-                                                                    
-                                                                    if not current_threat_data:
-                                                                        st.error(f"❌ Could not find threat data for: {threat_name}")
-                                                                    else:
-                                                                        # Create filtered agent_2_results with only current threat
-                                                                        filtered_agent_2 = {
-                                                                            **st.session_state.risk_result,
-                                                                            'threat_risk_quantification': [current_threat_data]
-                                                                        }
-                                                                        
-                                                                        risk_ids = save_assessment_to_risk_register(
-                                                                            asset_data=st.session_state.selected_asset, 
-                                                                            agent_1_results=st.session_state.impact_result, 
-                                                                            agent_2_results=filtered_agent_2,
-                                                                            agent_3_results=st.session_state.control_result, 
-                                                                            agent_4_results={'management_decision': 'ACCEPT', 'acceptance_form': form}
-                                                                        )
-                                                                        
-                                                                        if risk_ids and len(risk_ids) > 0:
-                                                                            st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
-                                                                            st.session_state.current_decision_index += 1
-                                                                            st.rerun()
-                                                                        else:
-                                                                            st.error("❌ Save returned no Risk IDs")
-                                                                except Exception as e:
-                                                                    st.error(f"❌ Save failed: {str(e)}")
-                                                                    import traceback
-                                                                    with st.expander("Debug"):
-                                                                        st.code(traceback.format_exc())
-                                                    else:
-                                                        st.error(f"❌ Error: {form.get('error')}")
+                                    with col4:
+                                        risk_eval = threat_risk.get('risk_evaluation_rating', {})
+                                        if isinstance(risk_eval, dict):
+                                            rating = risk_eval.get('rating', 0)
+                                            color = "🔴" if rating >= 4 else "🟡" if rating == 3 else "🟢"
+                                            st.metric("Risk Rating", f"{rating}/5", delta=f"{color}")
+                                        else:
+                                            st.metric("Risk Rating", risk_eval)
+                        
+                            # Download button
+                            st.download_button(
+                                label="📥 Download Agent 2 Results (JSON)",
+                                data=_json_download(result, slot='agent_2'),
+                                file_name=f"agent2_risk_{selected_asset['asset_name'].replace(' ', '_')}.json",
+                                mime="application/json",
+                                use_container_width=True
+                            )
+                    else:
+                        st.info("ℹ️ Run Agent 2 to see risk quantification results")
+                
+                # Agent 3 Results Tab
+                with tab3:
+                    if st.session_state.control_result:
+                        result = st.session_state.control_result
+                        
+                        # Check for error
+                        if 'error' in result:
+                            st.error(f"❌ Agent 3 Error: {result['error']}")
+                            if 'details' in result:
+                                with st.expander("❌ Error Details"):
+                                    st.text(result['details'])
+                            if 'raw_response' in result:
+                                with st.expander("📄 Raw Output"):
+                                    st.text(result['raw_response'][:2000])
+                            st.info("ℹ️ Try clicking the Agent 3 button again. The system will automatically rotate API keys if needed.")
+                        else:
+                            st.markdown("### 📊 Control Evaluation Summary")
+                            
+                            # Get threat control evaluation with fallback
+                            threat_controls = result.get('threat_control_evaluation', [])
+                            
+                            col1, col2, col3 = st.columns(3)
+                            
+                            with col1:
+                                st.metric("Threats Evaluated", len(threat_controls))
+                            
+                            with col2:
+                                if threat_controls:
+                                    try:
+                                        ratings = []
+                                        for t in threat_controls:
+                                            ctrl_calc = t.get('control_rating_calculation', {})
+                                            ctrl_rating = ctrl_calc.get('control_rating')
+                                            if isinstance(ctrl_rating, (int, float)):
+                                                ratings.append(ctrl_rating)
+                                        
+                                        if ratings:
+                                            avg_rating = sum(ratings) / len(ratings)
+                                            st.metric("Avg Control Rating", f"{avg_rating:.2f}")
+                                        else:
+                                            st.metric("Avg Control Rating", "N/A")
+                                    except:
+                                        st.metric("Avg Control Rating", "N/A")
+                                else:
+                                    st.metric("Avg Control Rating", "N/A")
+                            
+                            with col3:
+                                if threat_controls:
+                                    try:
+                                        residual_values = [
+                                            t.get('residual_risk', {}).get('residual_risk_value', 0)
+                                            for t in threat_controls
+                                        ]
+                                        highest_residual = max(residual_values) if residual_values else 0
+                                        color = "🔴" if highest_residual >= 3 else "🟡" if highest_residual >= 2 else "🟢"
+                                        st.metric("Highest Residual Risk", f"{highest_residual:.2f}", delta=color)
+                                    except:
+                                        st.metric("Highest Residual Risk", "N/A")
+                                else:
+                                    st.metric("Highest Residual Risk", "N/A")
+                            
+                            if not threat_controls:
+                                st.warning("⚠️ No threat control evaluations found in results")
+                            else:
+                                st.markdown("### 📊 Threat Control Analysis")
+                                
+                                # ⚡ Build one cross-threat controls DataFrame (cached per result) instead of one per threat
+                                cached_df = st.session_state.get('_all_ctrl_df')
+                                if isinstance(cached_df, tuple) and cached_df[0] is result:
+                                    df_all = cached_df[1]
+                                else:
+                                    ctrl_rows = [
+                                        (
+                                            t_idx,
+                                            ctrl.get('control_id', 'N/A'),
+                                            ctrl.get('control_name', 'N/A'),
+                                            ctrl.get('category', 'N/A'),
+                                            ctrl.get('current_rating', 'N/A'),
+                                            ctrl.get('source', 'N/A')
+                                        )
+                                        for t_idx, tc in enumerate(threat_controls, 1)
+                                        for ctrl in tc.get('controls_identified', [])
+                                    ]
+                                    df_all = pd.DataFrame.from_records(
+                                        ctrl_rows,
+                                        columns=('Threat', 'Control ID', 'Name', 'Category', 'Rating', 'Source')
+                                    )
+                                    st.session_state._all_ctrl_df = (result, df_all)
+                                
+                                for idx, threat_ctrl in enumerate(threat_controls, 1):
+                                    threat_name = threat_ctrl.get('threat', f'Threat {idx}')
+                                    controls = threat_ctrl.get('controls_identified', [])
+                                    ctrl_calc = threat_ctrl.get('control_rating_calculation', {})
+                                    residual_risk = threat_ctrl.get('residual_risk', {})
+                                    cat_avg = threat_ctrl.get('control_category_averages')
+                                    with st.expander(f"Threat {idx}: {threat_name}", expanded=(idx == 1)):
+                                        
+                                        col1, col2, col3, col4 = st.columns(4)
+                                        
+                                        with col1:
+                                            st.metric("Controls Found", len(controls))
+                                        
+                                        with col2:
+                                            ctrl_rating_numeric = ctrl_calc.get('control_rating')
+                                            ctrl_rating_text = ctrl_calc.get('control_rating_text', '')
+                                            
+                                            if isinstance(ctrl_rating_numeric, (int, float)):
+                                                display_value = f"{ctrl_rating_numeric:.2f}"
+                                                if ctrl_rating_text:
+                                                    display_value += f" ({ctrl_rating_text})"
                                             else:
-                                                st.error(f"❌ {q.get('error')}")
+                                                display_value = ctrl_rating_numeric or ctrl_rating_text or 'N/A'
+                                            
+                                            st.metric("Control Rating", display_value)
+                                        
+                                        with col3:
+                                            risk_rating = threat_ctrl.get('risk_evaluation_rating', 'N/A')
+                                            st.metric("Risk Rating", risk_rating)
                                         
-                                        # TRANSFER WORKFLOW
-                                        elif decision == "TRANSFER":
-                                            # Check if questionnaire already generated
-                                            transfer_q_key = f"transfer_questionnaire_{threat_key}"
+                                        with col4:
+                                            residual = residual_risk.get('residual_risk_value', 0)
+                                            classification = residual_risk.get('residual_risk_classification', '')
+                                            color = "🔴" if residual >= 3 else "🟢"
+                                            st.metric("Residual Risk", residual, delta=f"{color} {classification}")
+                                
+                                        if cat_avg is not None:
+                                            st.markdown("**Control Category Averages:**")
+                                            col1, col2, col3 = st.columns(3)
                                             
-                                            if transfer_q_key not in st.session_state:
-                                                st.markdown("#### 📋 Step 1: Generate Transfer Questionnaire")
-                                                
-                                                with st.spinner("🤖 Generating transfer questionnaire..."):
-                                                    # 🔧 FIX: Get actual Risk ID from database
-                                                    import sqlite3
-                                                    try:
-                                                        conn = sqlite3.connect('database/risk_register.db')
-                                                        cursor = conn.cursor()
-                                                        cursor.execute("SELECT MAX(CAST(SUBSTR(risk_id, 5) AS INTEGER)) FROM risks WHERE risk_id LIKE 'RSK-%'")
-                                                        result = cursor.fetchone()
-                                                        next_num = (result[0] or 0) + 1
-                                                        actual_risk_id = f"RSK-{next_num:03d}"
-                                                        conn.close()
-                                                    except:
-                                                        actual_risk_id = f"RSK-{threat_index:03d}"
-                                                    
-                                                    # Prepare risk context
-                                                    risk_context = {
-                                                        'risk_id': actual_risk_id,
-                                                        'asset_name': selected_asset.get('asset_name', 'Unknown'),
-                                                        'threat_name': threat_name,
-                                                        'inherent_risk_rating': threat_data.get('risk_rating', 0),
-                                                        'residual_risk_rating': threat_data.get('residual_risk', 0),
-                                                        'control_gaps': threat_data.get('control_gaps', [])
-                                                    }
-                                                    
-                                                    transfer_questionnaire = execute_agent_with_retry(
-                                                        generate_transfer_questionnaire,
-                                                        "Transfer Questionnaire Generator",
-                                                        risk_context=risk_context
-                                                    )
-                                                    
-                                                    st.session_state[transfer_q_key] = transfer_questionnaire
-                                                    st.session_state[f"{transfer_q_key}_risk_id"] = actual_risk_id
-                                                    st.rerun()
+                                            with col1:
+                                                st.metric("Preventive", f"{cat_avg.get('preventive_avg', 0):.2f}")
                                             
-                                            # Display questionnaire
-                                            transfer_questionnaire = st.session_state[transfer_q_key]
-                                            actual_risk_id = st.session_state.get(f"{transfer_q_key}_risk_id", f"RSK-{threat_index:03d}")
+                                            with col2:
+                                                st.metric("Detective", f"{cat_avg.get('detective_avg', 0):.2f}")
                                             
-                                            if 'error' in transfer_questionnaire:
-                                                st.error(f"❌ Error: {transfer_questionnaire.get('error')}")
-                                            else:
-                                                # 🔧 FIX: Handle both 'sections' and 'questionnaire' keys
-                                                sections = transfer_questionnaire.get('sections', transfer_questionnaire.get('questionnaire', []))
-                                                if not sections:
-                                                    st.error("❌ No sections found in questionnaire")
-                                                else:
-                                                    st.markdown("#### 📋 Risk Transfer Questionnaire")
-                                                
-                                                # Display AI-known risk context (read-only)
-                                                st.markdown("##### 📊 Risk Context (Auto-filled by AI)")
-                                                risk_ctx = transfer_questionnaire.get('risk_context', {})
-                                                
-                                                import html
-                                                
-                                                col1, col2 = st.columns(2)
-                                                with col1:
-                                                    st.markdown(f"**Risk ID:** {actual_risk_id}")
-                                                    asset_name = html.unescape(risk_ctx.get('Asset', risk_ctx.get('asset', selected_asset.get('asset_name', 'N/A'))))
-                                                    st.markdown(f"**Asset:** {asset_name}")
-                                                    # Get risk rating from multiple possible keys
-                                                    current_risk = risk_ctx.get('Risk Rating', risk_ctx.get('current_risk_rating', threat_data.get('risk_rating', 'N/A')))
-                                                    st.markdown(f"**Current Risk Rating:** {format_risk_rating(current_risk)}")
-                                                with col2:
-                                                    threat_desc = html.unescape(risk_ctx.get('Threat', risk_ctx.get('risk_description', threat_name)))
-                                                    st.markdown(f"**Risk Description:** {threat_desc}")
-                                                    residual = risk_ctx.get('Residual Risk', risk_ctx.get('residual_risk', threat_data.get('residual_risk', 'N/A')))
-                                                    st.markdown(f"**Residual Risk:** {format_risk_rating(residual)}")
-                                                
-                                                st.markdown("---")
-                                                
-                                                # EMAIL OPTION
-                                                st.info("💡 **Choose how to complete the transfer questionnaire:**")
-                                                col_opt1, col_opt2 = st.columns(2)
-                                                with col_opt1:
-                                                    st.markdown("### 📧 Send via Email")
-                                                    st.caption("Send to third party")
-                                                    email_transfer = st.text_input("Email", placeholder="vendor@company.com", key=f"email_tr_{threat_key}")
-                                                    if st.button("📧 Send", key=f"send_tr_{threat_key}", type="primary", disabled=not email_transfer):
-                                                        with st.spinner("📧 Sending..."):
-                                                            try:
-                                                                from email_sender import send_questionnaire_email
-                                                                # 🆕 Prepare agent results for storage
-                                                                # Get ORIGINAL Agent 2 threat data
-                                                                agent_2_threats = st.session_state.get('risk_result', {}).get('threat_risk_quantification', [])
-                                                                original_threat = next((t for t in agent_2_threats if t.get('threat') == threat_name), threat_data)
-                                                                
-                                                                agent_results = {
-                                                                    'agent_1': st.session_state.get('impact_result', {}),
-                                                                    'agent_2': st.session_state.get('risk_result', {}),
-                                                                    'agent_3': st.session_state.get('control_result', {}),
-                                                                    'selected_asset': st.session_state.get('selected_asset', {}),
-                                                                    'threat_data': original_threat
-                                                                }
-                                                                result = send_questionnaire_email(
-                                                                    recipient_email=email_transfer,
-                                                                    asset_name=selected_asset.get('asset_name'),
-                                                                    questionnaire=transfer_questionnaire,
-                                                                    questionnaire_type='TRANSFER',
-                                                                    agent_results=agent_results
-                                                                )
-                                                                if result and result.get('success'):
-                                                                    st.success(f"✅ Email sent to {email_transfer}!")
-                                                                    st.info(f"📋 Token: {result['token']}")
-                                                                    st.caption("Moving to next threat...")
-                                                                    st.session_state.current_decision_index += 1
-                                                                    time.sleep(1)
-                                                                    st.rerun()
-                                                                else:
-                                                                    st.error(f"❌ Failed to send email")
-                                                            except Exception as e:
-                                                                st.error(f"❌ Error: {str(e)}")
-                                                with col_opt2:
-                                                    st.markdown("### ✍️ Fill Manually")
-                                                    st.info("👇 Scroll down")
-                                                st.markdown("---")
-                                                
-                                                st.markdown("##### 📝 Transfer Details (Please Fill)")
-                                                st.caption("Provide the following transfer-specific information:")
-                                                
-                                                # Render questionnaire (NO FORM - same pattern as ACCEPT)
-                                                transfer_answers = {}
-                                                
-                                                # 🔧 FIX: Use sections variable from above
-                                                for section_idx, section in enumerate(sections):
-                                                    section_title = section.get('title') or section.get('section_title', 'Section')
-                                                    st.markdown(f"##### {section_title}")
-                                                    
-                                                    # Get section description if available
-                                                    section_desc = section.get('description', '')
-                                                    if section_desc:
-                                                        st.caption(section_desc)
-                                                    
-                                                    # Get questions - handle both 'questions' and 'fields' keys
-                                                    questions = section.get('questions', section.get('fields', []))
-                                                    
-                                                    for q_idx, question in enumerate(questions):
-                                                        # Handle multiple field name formats
-                                                        q_id = question.get('id', question.get('question_id', question.get('field_id', question.get('field_name', 'Q'))))
-                                                        # CRITICAL: field_name IS the question text for TRANSFER questionnaire
-                                                        q_text = question.get('field_name') or question.get('text') or question.get('question_text') or question.get('question') or question.get('label') or question.get('description', 'Question')
-                                                        q_type = question.get('type', question.get('question_type', question.get('field_type', 'text')))
-                                                        q_help = question.get('help_text', question.get('help', ''))
-                                                        q_required = question.get('required', False)
-                                                        options = question.get('options', [])
-                                                        
-                                                        # Unique key with section/question indices
-                                                        widget_key = f"transfer_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
-                                                        default_value = st.session_state.get(widget_key, '')
-                                                        
-                                                        # ✅ FIX: Replace placeholder with actual Risk ID in default value
-                                                        if not default_value or default_value == '':
-                                                            default_value = question.get('value', '')
-                                                        if 'AI_GENERATED_RISK_ID' in str(default_value) or ('risk' in q_text.lower() and 'id' in q_text.lower() and default_value == ''):
-                                                            default_value = actual_risk_id
-                                                        
-                                                        # Add required indicator
-                                                        if q_required:
-                                                            q_text = f"{q_text} *"
-                                                        
-                                                        # Handle display-only fields (AI pre-filled)
-                                                        if q_type == 'display':
-                                                            display_value = question.get('value', '')
-                                                            # ✅ FIX: Replace placeholder in display fields too
-                                                            if 'AI_GENERATED_RISK_ID' in str(display_value):
-                                                                display_value = actual_risk_id
-                                                            st.info(f"**{q_text}**\n\n{display_value}")
-                                                            transfer_answers[q_id] = display_value
-                                                            continue
-                                                        
-                                                        # Render input based on type
-                                                        if q_type in ['text_area', 'textarea']:
-                                                            val = st.text_area(q_text, value=default_value or '', key=widget_key, help=q_help, height=100)
-                                                            transfer_answers[q_id] = val
-                                                        elif q_type == 'text':
-                                                            val = st.text_input(q_text, value=default_value or '', key=widget_key, help=q_help)
-                                                            transfer_answers[q_id] = val
-                                                        elif q_type == 'number':
-                                                            min_val = question.get('min', question.get('min_value', 0))
-                                                            val = st.number_input(q_text, value=float(default_value) if default_value else 0.0, key=widget_key, help=q_help, min_value=float(min_val))
-                                                            transfer_answers[q_id] = val
-                                                        elif q_type == 'date':
-                                                            from datetime import date
-                                                            val = st.date_input(q_text, value=date.today(), key=widget_key, help=q_help)
-                                                            transfer_answers[q_id] = val
-                                                        elif q_type in ['select', 'dropdown']:
-                                                            if options:
-                                                                display_options = [opt.get('label', opt.get('value', str(opt))) if isinstance(opt, dict) else str(opt) for opt in options]
-                                                                val = st.selectbox(q_text, options=display_options, key=widget_key, help=q_help)
-                                                                transfer_answers[q_id] = val
-                                                            else:
-                                                                val = st.text_input(q_text, key=widget_key, help=q_help)
-                                                                transfer_answers[q_id] = val
-                                                        else:
-                                                            # Default to text input
-                                                            val = st.text_input(q_text, key=widget_key, help=q_help)
-                                                            transfer_answers[q_id] = val
+                                            with col3:
+                                                st.metric("Corrective", f"{cat_avg.get('corrective_avg', 0):.2f}")
+                                
+                                        if controls:
+                                            st.markdown("**Controls Identified:**")
+                                            
+                                            df = df_all[df_all.Threat == idx].drop(columns='Threat')
+                                            st.dataframe(df, use_container_width=True, hide_index=True)
+                                
+                                        if ctrl_calc:
+                                            with st.expander("📊 Control Rating Calculation"):
+                                                calc = ctrl_calc
                                                 
-                                                # Submit button
-                                                if st.button(f"✅ Submit & Generate Transfer Form", key=f"submit_transfer_{threat_key}", type="primary", use_container_width=True):
-                                                    # Read values from session_state
-                                                    transfer_answers_final = {}
-                                                    # 🔧 FIX: Use sections variable and handle display fields
-                                                    for section_idx, section in enumerate(sections):
-                                                        for q_idx, question in enumerate(section.get('questions', section.get('fields', []))):
-                                                            q_id = question.get('id', question.get('question_id', question.get('field_id', question.get('field_name', 'Q'))))
-                                                            q_type = question.get('type', question.get('question_type', 'text'))
-                                                            
-                                                            # ✅ FIX: Handle display fields - get value from question, not session_state
-                                                            if q_type == 'display':
-                                                                transfer_answers_final[q_id] = question.get('value', '')
-                                                            else:
-                                                                widget_key = f"transfer_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
-                                                                transfer_answers_final[q_id] = st.session_state.get(widget_key, '')
-                                                    
-                                                    # Convert dates to strings
-                                                    for key, value in transfer_answers_final.items():
-                                                        if hasattr(value, 'strftime'):
-                                                            transfer_answers_final[key] = value.strftime('%Y-%m-%d')
-                                                    
-                                                    # Generate transfer form with retry
-                                                    with st.spinner("🤖 Generating transfer form..."):
-                                                        # ✅ FIX: Use actual_risk_id from session state
-                                                        risk_context = {
-                                                            'risk_id': actual_risk_id,
-                                                            'asset_name': selected_asset.get('asset_name', 'Unknown'),
-                                                            'threat_name': threat_name,
-                                                            'inherent_risk_rating': threat_data.get('risk_rating', 0),
-                                                            'residual_risk_rating': threat_data.get('residual_risk', 0)
-                                                        }
-                                                        
-                                                        transfer_form = execute_agent_with_retry(
-                                                            generate_transfer_form,
-                                                            "Transfer Form Generator",
-                                                            api_key=api_key,
-                                                            risk_context=risk_context,
-                                                            questionnaire_responses=transfer_answers_final,
-                                                            questionnaire_structure=transfer_questionnaire
-                                                        )
-                                                        
-                                                        if 'error' not in transfer_form:
-                                                            # ✅ STORE FORM IN SESSION STATE
-                                                            st.session_state[f"transfer_form_{threat_key}"] = transfer_form
-                                                            st.success("✅ Transfer Form Generated!")
-                                                            st.rerun()
-                                                        else:
-                                                            st.error(f"❌ Error: {transfer_form.get('error')}")
+                                                def extract_value(calc_str):
+                                                    calc_str = str(calc_str)
+                                                    if '=' in calc_str:
+                                                        return float(calc_str.split('=')[-1].strip())
+                                                    return float(calc_str)
                                                 
-                                                # ✅ FIX: Display form OUTSIDE submit button block (like ACCEPT workflow)
-                                                if f"transfer_form_{threat_key}" in st.session_state:
-                                                    transfer_form = st.session_state[f"transfer_form_{threat_key}"]
-                                                    
-                                                    # Extract form from wrapper
-                                                    form = transfer_form.get('risk_transfer_form', transfer_form)
-                                                    
-                                                    # Clean HTML entities
-                                                    import html
-                                                    def clean_html_recursive(obj):
-                                                        if isinstance(obj, str):
-                                                            return html.unescape(obj)
-                                                        elif isinstance(obj, dict):
-                                                            return {k: clean_html_recursive(v) for k, v in obj.items()}
-                                                        elif isinstance(obj, list):
-                                                            return [clean_html_recursive(item) for item in obj]
-                                                        return obj
-                                                    
-                                                    form = clean_html_recursive(form)
-                                                    
-                                                    st.markdown("---")
-                                                    st.success("✅ Transfer Form Generated!")
-                                                    
-                                                    # Display form heading
-                                                    st.markdown("### 📋 Risk Transfer Form")
-                                                    
-                                                    # Display risk context summary (asset & threat)
-                                                    if 'risk_context' in form and isinstance(form['risk_context'], dict):
-                                                        risk_ctx = form['risk_context']
-                                                        col1, col2 = st.columns(2)
-                                                        with col1:
-                                                            if 'asset' in risk_ctx:
-                                                                st.info(f"**Asset:** {risk_ctx['asset']}")
-                                                        with col2:
-                                                            if 'threat' in risk_ctx:
-                                                                st.info(f"**Threat:** {risk_ctx['threat']}")
-                                                    
-                                                    st.markdown("")  # Spacing
-                                                    
-                                                    # Display all sections
-                                                    section_emoji_map = {
-                                                        'risk identification': '⚠️',
-                                                        'risk rating': '📊',
-                                                        'risk transfer': '🔄',
-                                                        'transfer management': '👥',
-                                                        'ownership': '👥',
-                                                        'review': '👥'
-                                                    }
-                                                    
-                                                    if 'sections' in form and isinstance(form['sections'], list):
-                                                        for section in form['sections']:
-                                                            if isinstance(section, dict):
-                                                                section_title = section.get('title', 'Section')
-                                                                
-                                                                # Get emoji based on keywords in title
-                                                                emoji = '📌'
-                                                                section_lower = section_title.lower()
-                                                                for key, em in section_emoji_map.items():
-                                                                    if key in section_lower:
-                                                                        emoji = em
-                                                                        break
-                                                                
-                                                                st.markdown(f"### {emoji} {section_title}")
-                                                                
-                                                                fields = section.get('fields', [])
-                                                                for field in fields:
-                                                                    if isinstance(field, dict):
-                                                                        field_name = field.get('field_name', 'Field')
-                                                                        field_value = field.get('value', 'N/A')
-                                                                        st.markdown(f"**{field_name}:** {field_value}")
-                                                                
-                                                                st.markdown("")  # Spacing
-                                                    
-                                                    # Generation Date at bottom
-                                                    st.markdown("---")
-                                                    if transfer_form.get('generation_date'):
-                                                        st.caption(f"📅 Generated: {transfer_form['generation_date']}")
-                                                    
-                                                    with st.expander("📄 View Raw JSON", expanded=False):
-                                                        st.json(transfer_form)
+                                                try:
+                                                    weighted_p = extract_value(calc.get('weighted_preventive', 0))
+                                                    weighted_d = extract_value(calc.get('weighted_detective', 0))
+                                                    weighted_c = extract_value(calc.get('weighted_corrective', 0))
+                                                    avg_weighted = extract_value(calc.get('average_weighted', 0))
+                                                    ctrl_rating = calc.get('control_rating', 'N/A')
                                                     
-                                                    # Save to risk register
-                                                    if st.button(f"💾 Save Transfer Form to Risk Register", key=f"save_transfer_{threat_key}", type="primary", use_container_width=True):
-                                                        with st.spinner("💾 Saving..."):
-                                                            try:
-                                                                from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                                
-                                                                # Filter agent_2_results to include ONLY current threat
-                                                                all_threats = st.session_state.risk_result.get('threat_risk_quantification', [])
-                                                                current_threat_data = None
-                                                                for t in all_threats:
-                                                                    if t.get('threat') == threat_name:
-                                                                        current_threat_data = t
-                                                                        break
-                                                                
-                                                                if not current_threat_data:
-                                                                    st.error(f"❌ Could not find threat data for: {threat_name}")
-                                                                else:
-                                                                    # Create filtered agent_2_results with only current threat
-                                                                    filtered_agent_2 = {
-                                                                        **st.session_state.risk_result,
-                                                                        'threat_risk_quantification': [current_threat_data]
-                                                                    }
-                                                                    
-                                                                    # ✅ DEBUG: Show what we're saving
-                                                                    with st.expander("🔍 Debug: Data being saved", expanded=False):
-                                                                        st.write("Threat name:", threat_name)
-                                                                        st.write("Transfer form keys:", list(transfer_form.keys()) if isinstance(transfer_form, dict) else "Not a dict")
-                                                                        st.json({'management_decision': 'TRANSFER', 'transfer_form': transfer_form})
-                                                                    
-                                                                    risk_ids = save_assessment_to_risk_register(
-                                                                        asset_data=st.session_state.selected_asset, 
-                                                                        agent_1_results=st.session_state.impact_result, 
-                                                                        agent_2_results=filtered_agent_2,
-                                                                        agent_3_results=st.session_state.control_result, 
-                                                                        agent_4_results={'management_decision': 'TRANSFER', 'transfer_form': transfer_form}
-                                                                    )
-                                                                    
-                                                                    if risk_ids and len(risk_ids) > 0:
-                                                                        st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
-                                                                        st.session_state.current_decision_index += 1
-                                                                        st.rerun()
-                                                                    else:
-                                                                        st.error("❌ Save returned no Risk IDs")
-                                                                        st.warning("⚠️ Check the console/terminal for detailed error messages")
-                                                            except Exception as e:
-                                                                st.error(f"❌ Save failed: {str(e)}")
-                                                                import traceback
-                                                                with st.expander("Debug"):
-                                                                    st.code(traceback.format_exc())
-                                        
-                                        # ============================================================
-                                        # TERMINATE WORKFLOW
-                                        # ============================================================
-                                        elif decision == "TERMINATE":
-                                            # Check if questionnaire already generated
-                                            terminate_q_key = f"terminate_questionnaire_{threat_key}"
-                                            
-                                            if terminate_q_key not in st.session_state:
-                                                st.markdown("#### 📋 Step 1: Generate Termination Questionnaire")
-                                                
-                                                with st.spinner("🤖 Generating termination questionnaire..."):
-                                                    # Get actual Risk ID from database
-                                                    import sqlite3
-                                                    try:
-                                                        conn = sqlite3.connect('database/risk_register.db')
-                                                        cursor = conn.cursor()
-                                                        cursor.execute("SELECT MAX(CAST(SUBSTR(risk_id, 5) AS INTEGER)) FROM risks WHERE risk_id LIKE 'RSK-%'")
-                                                        result = cursor.fetchone()
-                                                        next_num = (result[0] or 0) + 1
-                                                        actual_risk_id = f"RSK-{next_num:03d}"
-                                                        conn.close()
-                                                    except:
-                                                        actual_risk_id = f"RSK-{threat_index:03d}"
+                                                    st.markdown(f"""
+                                                    **Formula:** Control Rating = FLOOR(AVERAGE(P_avg � 1.0, D_avg � 0.75, C_avg � 0.5))
                                                     
-                                                    # Prepare risk context
-                                                    risk_context = {
-                                                        'risk_id': actual_risk_id,
-                                                        'asset_name': selected_asset.get('asset_name', 'Unknown'),
-                                                        'threat_name': threat_name,
-                                                        'inherent_risk_rating': threat_data.get('risk_rating', 0),
-                                                        'residual_risk_rating': threat_data.get('residual_risk', 0),
-                                                        'control_gaps': threat_data.get('control_gaps', [])
-                                                    }
+                                                    **Step 1: Weighted Values**
+                                                    - Preventive: {weighted_p:.4f}
+                                                    - Detective: {weighted_d:.4f}
+                                                    - Corrective: {weighted_c:.4f}
                                                     
-                                                    terminate_questionnaire = execute_agent_with_retry(
-                                                        generate_terminate_questionnaire,
-                                                        "Termination Questionnaire Generator",
-                                                        risk_context=risk_context
-                                                    )
+                                                    **Step 2: Average**
+                                                    - Average: {avg_weighted:.4f}
                                                     
-                                                    st.session_state[terminate_q_key] = terminate_questionnaire
-                                                    st.session_state[f"{terminate_q_key}_risk_id"] = actual_risk_id
-                                                    st.rerun()
-                                            
-                                            # Display questionnaire
-                                            terminate_questionnaire = st.session_state[terminate_q_key]
-                                            actual_risk_id = st.session_state.get(f"{terminate_q_key}_risk_id", f"RSK-{threat_index:03d}")
-                                            
-                                            if 'error' in terminate_questionnaire:
-                                                st.error(f"❌ Error: {terminate_questionnaire.get('error')}")
+                                                    **Step 3: FLOOR Function**
+                                                    - Control Rating: **{ctrl_rating}**
+                                                    """)
+                                                except Exception as e:
+                                                    st.warning(f"Could not display calculation details: {str(e)}")
+                        
+                        st.download_button(
+                            label="📥 Download Agent 3 Results (JSON)",
+                            data=_json_download(result, slot='agent_3'),
+                            file_name=f"agent3_controls_{selected_asset['asset_name'].replace(' ', '_')}.json",
+                            mime="application/json",
+                            use_container_width=True
+                        )
+                    else:
+                        st.info("ℹ️ Run Agent 3 to see control evaluation results")
+                
+                # Agent 4 Results Tab
+                with tab4:
+                    if st.session_state.decision_result:
+                        result = st.session_state.decision_result
+                        
+                        # Check for error
+                        if 'error' in result:
+                            st.error(f"❌ Agent 4 Error: {result['error']}")
+                            if 'details' in result:
+                                with st.expander("❌ Error Details"):
+                                    st.text(result['details'])
+                            st.info("ℹ️ Try clicking the Agent 4 button again.")
+                        
+                        #  CHECK FOR NEW FORMAT FIRST (management_decisions)
+                        elif 'management_decisions' in result and isinstance(result.get('management_decisions'), dict):
+                            st.success("✅ Management Decisions Generated!")
+                            
+                            decisions = result['management_decisions']
+                            
+                            # Display each threat's decision options
+                            for threat_key in sorted(decisions.keys()):
+                                threat_data = decisions[threat_key]
+                                threat_name = threat_data.get('threat_name', 'Unknown Threat')
+                                threat_index = threat_data.get('threat_index', 0)
+                                
+                                st.markdown(f"### ⚠️ Threat {threat_index}: {threat_name}")
+                                
+                                # Risk metrics
+                                col1, col2, col3 = st.columns(3)
+                                with col1:
+                                    st.metric("Risk Rating", threat_data.get('risk_rating', 'N/A'))
+                                with col2:
+                                    st.metric("Residual Risk", threat_data.get('residual_risk', 'N/A'))
+                                with col3:
+                                    gaps = threat_data.get('control_gaps', [])
+                                    st.metric("Control Gaps", len(gaps))
+                                
+                                # ⚠️ CONTROL GAPS DETAILS (NEW - EXPANDED)
+                                if gaps:
+                                    with st.expander("⚠️ Control Gaps Identified", expanded=True):
+                                        for idx, gap in enumerate(gaps, 1):
+                                            if isinstance(gap, dict):
+                                                st.warning(f"**Gap {idx}: {gap.get('gap_description', 'Unknown gap')}**")
+                                                col_a, col_b = st.columns(2)
+                                                with col_a:
+                                                    if gap.get('evidence'):
+                                                        st.caption(f"📄 Evidence: {gap['evidence']}")
+                                                    if gap.get('impact'):
+                                                        st.caption(f"⚠️ Impact: {gap['impact']}")
+                                                with col_b:
+                                                    if gap.get('severity'):
+                                                        severity = gap['severity']
+                                                        color = "🔴" if severity == "HIGH" else "🟡" if severity == "MEDIUM" else "🟢"
+                                                        st.caption(f"{color} Severity: {severity}")
+                                            else:
+                                                st.warning(f"**Gap {idx}:** {gap}")
+                                
+                                # Recommended controls
+                                recommended = threat_data.get('recommended_controls', [])
+                                if recommended:
+                                    with st.expander(f"✅ Recommended Controls ({len(recommended)})", expanded=False):
+                                        for idx, ctrl in enumerate(recommended, 1):
+                                            if isinstance(ctrl, dict):
+                                                st.success(f"**{idx}. {ctrl.get('control_name', ctrl.get('control_id', 'Control'))}**")
+                                                col_a, col_b = st.columns(2)
+                                                with col_a:
+                                                    if ctrl.get('control_type'):
+                                                        st.caption(f"🏷️ Type: {ctrl['control_type']}")
+                                                    if ctrl.get('priority'):
+                                                        st.caption(f"🔥 Priority: {ctrl['priority']}")
+                                                with col_b:
+                                                    if ctrl.get('rationale'):
+                                                        st.caption(f"💭 {ctrl['rationale']}")
                                             else:
-                                                st.markdown("### 📋 Risk Termination Questionnaire")
-                                                
-                                                # Display AI-known risk context (read-only)
-                                                st.markdown("##### 📊 Risk Context (Auto-filled by AI)")
-                                                risk_ctx = terminate_questionnaire.get('risk_context', {})
-                                                
-                                                col1, col2 = st.columns(2)
-                                                with col1:
-                                                    st.markdown(f"**Risk ID:** {actual_risk_id}")
-                                                    st.markdown(f"**Asset:** {risk_ctx.get('asset', selected_asset.get('asset_name', 'N/A'))}")
-                                                    # Get current risk from threat_data (actual value)
-                                                    current_risk = threat_data.get('risk_rating', 'N/A')
-                                                    st.markdown(f"**Current Risk Rating:** {format_risk_rating(current_risk)}")
-                                                with col2:
-                                                    st.markdown(f"**Risk Description:** {risk_ctx.get('risk_description', threat_name)}")
-                                                    # Get residual risk from threat_data (actual value)
-                                                    residual = threat_data.get('residual_risk', 'N/A')
-                                                    st.markdown(f"**Residual Risk:** {format_risk_rating(residual)}")
-                                                
-                                                st.markdown("---")
-                                                # EMAIL OPTION
-                                                st.info("💡 **Choose how to complete the termination questionnaire:**")
-                                                col_opt1, col_opt2 = st.columns(2)
-                                                with col_opt1:
-                                                    st.markdown("### 📧 Send via Email")
-                                                    st.caption("Send to stakeholder")
-                                                    email_terminate = st.text_input("Email", placeholder="owner@company.com", key=f"email_tm_{threat_key}")
-                                                    if st.button("📧 Send", key=f"send_tm_{threat_key}", type="primary", disabled=not email_terminate):
-                                                        with st.spinner("📧 Sending..."):
-                                                            try:
-                                                                from email_sender import send_questionnaire_email
-                                                                # Get ORIGINAL Agent 2 threat data
-                                                                agent_2_threats = st.session_state.get('risk_result', {}).get('threat_risk_quantification', [])
-                                                                original_threat = next((t for t in agent_2_threats if t.get('threat') == threat_name), threat_data)
-                                                                
-                                                                agent_results = {
-                                                                    'agent_1': st.session_state.get('impact_result', {}),
-                                                                    'agent_2': st.session_state.get('risk_result', {}),
-                                                                    'agent_3': st.session_state.get('control_result', {}),
-                                                                    'selected_asset': st.session_state.get('selected_asset', {}),
-                                                                    'threat_data': original_threat
-                                                                }
-                                                                result = send_questionnaire_email(
-                                                                    recipient_email=email_terminate,
-                                                                    asset_name=selected_asset.get('asset_name'),
-                                                                    questionnaire=terminate_questionnaire,
-                                                                    questionnaire_type='TERMINATE',
-                                                                    agent_results=agent_results
-                                                                )
-                                                                if result and result.get('success'):
-                                                                    st.success(f"✅ Email sent to {email_terminate}!")
-                                                                    st.info(f"📋 Token: {result['token']}")
-                                                                    st.caption("Moving to next threat...")
-                                                                    st.session_state.current_decision_index += 1
-                                                                    time.sleep(1)
-                                                                    st.rerun()
-                                                                else:
-                                                                    st.error(f"❌ Failed to send email")
-                                                            except Exception as e:
-                                                                st.error(f"❌ Error: {str(e)}")
-                                                with col_opt2:
-                                                    st.markdown("### ✍️ Fill Manually")
-                                                    st.info("👇 Scroll down")
-                                                st.markdown("---")
-                                                
-                                                st.markdown("##### 📝 Termination Details (Please Fill)")
-                                                st.caption("Provide the following termination-specific information:")
-                                                
-                                                # Render questionnaire
-                                                terminate_answers = {}
-                                                
-                                                for section_idx, section in enumerate(terminate_questionnaire.get('sections', [])):
-                                                    section_title = section.get('title') or section.get('section_title', 'Section')
-                                                    st.markdown(f"##### {section_title}")
-                                                    
-                                                    section_desc = section.get('description', '')
-                                                    if section_desc:
-                                                        st.caption(section_desc)
-                                                    
-                                                    questions = section.get('questions', section.get('fields', []))
-                                                    
-                                                    for q_idx, question in enumerate(questions):
-                                                        q_id = question.get('id', question.get('question_id', question.get('field_id', question.get('field_name', f'Q{section_idx}_{q_idx}'))))
-                                                        # CRITICAL: field_name IS the question text for TERMINATE questionnaire (same as TRANSFER)
-                                                        q_text = question.get('field_name') or question.get('text') or question.get('question_text') or question.get('question') or question.get('label') or question.get('description', 'Question')
-                                                        q_type = question.get('type', question.get('question_type', question.get('field_type', 'text')))
-                                                        q_help = question.get('help_text', question.get('help', ''))
-                                                        q_required = question.get('required', False)
-                                                        options = question.get('options', [])
-                                                        
-                                                        widget_key = f"terminate_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
-                                                        default_value = st.session_state.get(widget_key, '')
-                                                        
-                                                        if q_required:
-                                                            q_text = f"{q_text} *"
-                                                        
-                                                        # 🆕 Display-only fields (AI pre-filled)
-                                                        if q_type == 'display':
-                                                            pre_filled_value = question.get('value', question.get('default_value', 'N/A'))
-                                                            st.info(f"**{q_text}:** {pre_filled_value}")
-                                                            terminate_answers[q_id] = pre_filled_value
-                                                        
-                                                        elif q_type in ['text_area', 'textarea']:
-                                                            val = st.text_area(q_text, value=default_value or '', key=widget_key, help=q_help, height=100)
-                                                            terminate_answers[q_id] = val
-                                                        elif q_type == 'text':
-                                                            val = st.text_input(q_text, value=default_value or '', key=widget_key, help=q_help)
-                                                            terminate_answers[q_id] = val
-                                                        elif q_type == 'number':
-                                                            min_val = question.get('min', question.get('min_value', 0))
-                                                            val = st.number_input(q_text, value=float(default_value) if default_value else 0.0, key=widget_key, help=q_help, min_value=float(min_val))
-                                                            terminate_answers[q_id] = val
-                                                        elif q_type == 'date':
-                                                            from datetime import date
-                                                            val = st.date_input(q_text, value=date.today(), key=widget_key, help=q_help)
-                                                            terminate_answers[q_id] = val
-                                                        elif q_type in ['select', 'dropdown']:
-                                                            if options:
-                                                                display_options = [opt.get('label', opt.get('value', str(opt))) if isinstance(opt, dict) else str(opt) for opt in options]
-                                                                val = st.selectbox(q_text, options=display_options, key=widget_key, help=q_help)
-                                                                terminate_answers[q_id] = val
-                                                            else:
-                                                                val = st.text_input(q_text, key=widget_key, help=q_help)
-                                                                terminate_answers[q_id] = val
-                                                        else:
-                                                            val = st.text_input(q_text, key=widget_key, help=q_help)
-                                                            terminate_answers[q_id] = val
-                                                
-                                                # Submit button
-                                                if st.button(f"✅ Submit & Generate Termination Form", key=f"submit_terminate_{threat_key}", type="primary", use_container_width=True):
-                                                    terminate_answers_final = {}
-                                                    for section_idx, section in enumerate(terminate_questionnaire.get('sections', [])):
-                                                        for q_idx, question in enumerate(section.get('questions', section.get('fields', []))):
-                                                            q_id = question.get('id', question.get('question_id', question.get('field_id', question.get('field_name', f'Q{section_idx}_{q_idx}'))))
-                                                            widget_key = f"terminate_{threat_key}_s{section_idx}_q{q_idx}_{q_id}"
-                                                            terminate_answers_final[q_id] = st.session_state.get(widget_key, '')
-                                                    
-                                                    # Convert dates to strings
-                                                    for key, value in terminate_answers_final.items():
-                                                        if hasattr(value, 'strftime'):
-                                                            terminate_answers_final[key] = value.strftime('%Y-%m-%d')
-                                                    
-                                                    # Generate termination form with retry
-                                                    with st.spinner("🤖 Generating termination form..."):
-                                                        risk_context = {
-                                                            'risk_id': actual_risk_id,
-                                                            'asset_name': selected_asset.get('asset_name', 'Unknown'),
-                                                            'threat_name': threat_name,
-                                                            'inherent_risk_rating': threat_data.get('risk_rating', 0),
-                                                            'residual_risk_rating': threat_data.get('residual_risk', 0)
-                                                        }
-                                                        
-                                                        from phase2_risk_resolver.agents.agent_4_terminate_form import generate_terminate_form
-                                                        terminate_form = execute_agent_with_retry(
-                                                            generate_terminate_form,
-                                                            "Termination Form Generator",
-                                                            api_key=api_key,
-                                                            risk_context=risk_context,
-                                                            questionnaire_responses=terminate_answers_final,
-                                                            questionnaire_structure=terminate_questionnaire
-                                                        )
-                                                        
-                                                        if 'error' not in terminate_form:
-                                                            # ✅ STORE FORM IN SESSION STATE
-                                                            st.session_state[f"terminate_form_{threat_key}"] = terminate_form
-                                                            st.success("✅ Termination Form Generated!")
-                                                            st.rerun()
-                                                            
-                                                        else:
-                                                            st.error(f"❌ Error: {terminate_form.get('error')}")
-                                                
-                                                # ✅ FIX: Display form OUTSIDE submit button block (like ACCEPT and TRANSFER workflows)
-                                                if f"terminate_form_{threat_key}" in st.session_state:
-                                                    terminate_form = st.session_state[f"terminate_form_{threat_key}"]
-                                                    
-                                                    # Extract form from wrapper
-                                                    form = terminate_form.get('risk_termination_form', terminate_form)
-                                                    
-                                                    # Clean HTML entities
-                                                    import html
-                                                    def clean_html_recursive(obj):
-                                                        if isinstance(obj, str):
-                                                            return html.unescape(obj)
-                                                        elif isinstance(obj, dict):
-                                                            return {k: clean_html_recursive(v) for k, v in obj.items()}
-                                                        elif isinstance(obj, list):
-                                                            return [clean_html_recursive(item) for item in obj]
-                                                        return obj
-                                                    
-                                                    form = clean_html_recursive(form)
-                                                    
-                                                    st.markdown("---")
-                                                    st.success("✅ Termination Form Generated!")
-                                                    
-                                                    # Display form heading
-                                                    st.markdown("### 📋 Risk Termination Form")
-                                                    st.markdown("")  # Spacing
-                                                    
-                                                    # 🆕 100% DYNAMIC - Display sections with smart emoji selection
-                                                    if 'sections' in form and isinstance(form['sections'], list):
-                                                        for section in form['sections']:
-                                                            if isinstance(section, dict):
-                                                                section_title = section.get('title', 'Section')
-                                                                # Smart emoji based on keywords
-                                                                emoji = '📌'
-                                                                title_lower = section_title.lower()
-                                                                if 'information' in title_lower or 'identification' in title_lower:
-                                                                    emoji = '📊'
-                                                                elif 'termination' in title_lower or 'details' in title_lower:
-                                                                    emoji = '🚫'
-                                                                elif 'approval' in title_lower or 'action' in title_lower:
-                                                                    emoji = '✅'
-                                                                elif 'status' in title_lower or 'closure' in title_lower:
-                                                                    emoji = '🔒'
-                                                                
-                                                                st.markdown(f"### {emoji} {section_title}")
-                                                                
-                                                                fields = section.get('fields', [])
-                                                                for field in fields:
-                                                                    if isinstance(field, dict):
-                                                                        field_name = field.get('field_name', 'Field')
-                                                                        field_value = field.get('value', 'N/A')
-                                                                        st.markdown(f"**{field_name}:** {field_value}")
-                                                                
-                                                                st.markdown("")  # Spacing
-                                                    
-                                                    # Generation Date at bottom
-                                                    st.markdown("---")
-                                                    if terminate_form.get('generation_date'):
-                                                        st.caption(f"📅 Generated: {terminate_form['generation_date']}")
-                                                    
-                                                    with st.expander("📄 View Raw JSON", expanded=False):
-                                                        st.json(terminate_form)
-                                                    
-                                                    # Save to risk register
-                                                    if st.button(f"💾 Save Termination Form to Risk Register", key=f"save_terminate_{threat_key}", type="primary", use_container_width=True):
-                                                        with st.spinner("💾 Saving..."):
-                                                            try:
-                                                                from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                                
-                                                                # Filter agent_2_results to include ONLY current threat
-                                                                all_threats = st.session_state.risk_result.get('threat_risk_quantification', [])
-                                                                current_threat_data = None
-                                                                for t in all_threats:
-                                                                    if t.get('threat') == threat_name:
-                                                                        current_threat_data = t
-                                                                        break
-                                                                
-                                                                if not current_threat_data:
-                                                                    st.error(f"❌ Could not find threat data for: {threat_name}")
-                                                                else:
-                                                                    # Create filtered agent_2_results with only current threat
-                                                                    filtered_agent_2 = {
-                                                                        **st.session_state.risk_result,
-                                                                        'threat_risk_quantification': [current_threat_data]
-                                                                    }
-                                                                    
-                                                                    risk_ids = save_assessment_to_risk_register(
-                                                                        asset_data=st.session_state.selected_asset, 
-                                                                        agent_1_results=st.session_state.impact_result, 
-                                                                        agent_2_results=filtered_agent_2,
-                                                                        agent_3_results=st.session_state.control_result, 
-                                                                        agent_4_results={'management_decision': 'TERMINATE', 'terminate_form': terminate_form}
-                                                                    )
-                                                                    
-                                                                    if risk_ids and len(risk_ids) > 0:
-                                                                        st.success(f"✅ Saved! Risk ID: {risk_ids[0]}")
-                                                                        st.session_state.current_decision_index += 1
-                                                                        st.rerun()
-                                                                    else:
-                                                                        st.error("❌ Save returned no Risk IDs")
-                                                            except Exception as e:
-                                                                st.error(f"❌ Save failed: {str(e)}")
-                                                                import traceback
-                                                                with st.expander("Debug"):
-                                                                    st.code(traceback.format_exc())
-                                        
-                                        st.markdown("---")
+                                                st.success(f"{idx}. {ctrl}")
+                                
+                                # Decision options
+                                st.markdown("#### 🎯 Decision Options")
+                                
+                                decision_options = threat_data.get('decision_options', [])
+                                for opt in decision_options:
+                                    _render_decision_option(opt, threat_key, threat_name, threat_index)
+                                
+                                # Show selected decision for this threat
+                                if 'threat_decisions' in st.session_state and threat_key in st.session_state.threat_decisions:
+                                    selected = st.session_state.threat_decisions[threat_key]
+                                    st.success(f"✅ **Selected Decision:** {selected['decision']}")
+                                
+                                st.markdown("---")
+                            
+                            # ? DECISION SUMMARY (NEW)
+                            if 'threat_decisions' in st.session_state and st.session_state.threat_decisions:
+                                st.markdown("---")
+                                st.markdown("## 📊 Decision Summary")
+                                
+                                # Count decisions by type
+                                decision_counts = {}
+                                for threat_key, decision_data in st.session_state.threat_decisions.items():
+                                    dec = decision_data['decision']
+                                    decision_counts[dec] = decision_counts.get(dec, 0) + 1
+                                
+                                # Display summary
+                                col1, col2, col3, col4 = st.columns(4)
+                                with col1:
+                                    st.metric("🔧 TREAT", decision_counts.get('TREAT', 0))
+                                with col2:
+                                    st.metric("✅ ACCEPT", decision_counts.get('ACCEPT', 0))
+                                with col3:
+                                    st.metric("🔄 TRANSFER", decision_counts.get('TRANSFER', 0))
+                                with col4:
+                                    st.metric("🚫 TERMINATE", decision_counts.get('TERMINATE', 0))
+                                
+                                # List all decisions
+                                st.markdown("### Selected Decisions:")
+                                for threat_key in sorted(st.session_state.threat_decisions.keys()):
+                                    decision_data = st.session_state.threat_decisions[threat_key]
+                                    st.markdown(f"- **Threat {decision_data['threat_index']}:** {decision_data['threat_name']} → **{decision_data['decision']}** ")
+                                
+                                # Proceed button
+                                total_threats = len(decisions)
+                                selected_threats = len(st.session_state.threat_decisions)
+                                
+                                if selected_threats > 0:
+                                    if selected_threats == total_threats:
+                                        st.success(f"✅ All {total_threats} threats have decisions selected!")
+                                    else:
+                                        st.info(f"ℹ️ {selected_threats} of {total_threats} threats have decisions selected. You can proceed with selected threats or select more.")
+                                    
+                                    if st.button("🚀 Proceed with Selected Decisions", type="primary", use_container_width=True):
+                                        st.session_state.processing_workflows = True
+                                        st.rerun()
+                                else:
+                                    st.warning(f"⚠️ Please select at least one decision to proceed ({selected_threats}/{total_threats} selected)")
+                                
+                                # Reset button
+                                if st.button("🔄 Reset All Decisions", use_container_width=True):
+                                    st.session_state.threat_decisions = {}
+                                    # ✅ FIX: Also clear workflow processing state
+                                    if 'processing_workflows' in st.session_state:
+                                        del st.session_state.processing_workflows
+                                    if 'current_decision_index' in st.session_state:
+                                        del st.session_state.current_decision_index
+                                    
+                                    # ✅ FIX: Clear all cached questionnaires and forms
+                                    keys_to_delete = []
+                                    for key in st.session_state.keys():
+                                        if any(x in key for x in ['_questionnaire_', '_form_', 'accept_q_', 'transfer_q_', 'terminate_q_', 'treat_key_']):
+                                            keys_to_delete.append(key)
+                                    
+                                    for key in keys_to_delete:
+                                        del st.session_state[key]
+                                    
+                                    st.rerun()
+
+                                
+                                # ============================================================
+                                # WORKFLOW PROCESSING - TRANSFER
+                                # ============================================================
+                                
+                                # Check if we should process workflows
+                                if st.session_state.get('processing_workflows', False):
+                                    st.markdown("---")
+                                    st.markdown("## 🔄 Processing Selected Decisions")
+                                    
+                                    # 🆕 SEQUENTIAL WORKFLOW: Track current decision index
+                                    st.session_state.setdefault('current_decision_index', 0)
+                                    
+                                    # Get sorted list of threat keys
+                                    sorted_threat_keys = sorted(st.session_state.threat_decisions.keys())
+                                    total_decisions = len(sorted_threat_keys)
+                                    current_idx = st.session_state.current_decision_index
+                                    
+                                    # Show progress
+                                    progress_value = min(1.0, (current_idx + 1) / total_decisions)
+                                    st.progress(progress_value)
+                                    st.caption(f"Processing Decision {min(current_idx + 1, total_decisions)} of {total_decisions}")
+                                    st.markdown("---")
+                                    
+                                    # Process ONLY the current decision
+                                    if current_idx < total_decisions:
+                                        threat_key = sorted_threat_keys[current_idx]
+                                    else:
+                                        # All decisions completed
+                                        st.success("✅ All decisions processed!")
+                                        st.info("📊 View Risk Register to see all saved risks")
+                                        if st.button("🔄 Start Over", type="primary"):
+                                            st.session_state.current_decision_index = 0
+                                            st.session_state.processing_workflows = False
+                                            st.rerun()
+                                        threat_key = None
+                                    
+                                    if threat_key:
+                                        # Get threat data from decisions
+                                        _render_threat_decision(threat_key, decisions.get(threat_key, {}), selected_asset, api_key)
                             
                             # Download button
                             st.download_button(
                                 label="📥 Download Management Decisions (JSON)",
-                                data=json.dumps(result, indent=2),
+                                data=_json_download(result, slot='agent_4'),
                                 file_name=f"agent4_decisions_{selected_asset['asset_name'].replace(' ', '_')}.json",
                                 mime="application/json",
                                 use_container_width=True
@@ -4233,83 +4480,10 @@ def render_risk_assessment_page(api_key):
                                     with col3:
                                         st.metric("Generated", metadata.get('generation_date', 'N/A'))
                                 
-                                # Extract threat info from first section (handle both 'questions' and 'sections' structure)
-                                questions_sections = result.get('questions', result.get('sections', []))
-                                
-                                # NEW: Extract threat info from risk_context if sections structure
-                                if 'sections' in result and 'risk_context' in result:
-                                    # New structure: threat info is in risk_context
-                                    risk_ctx = result['risk_context']
-                                    
-                                    # Extract risk_rating - try multiple field names
-                                    risk_rating_str = risk_ctx.get('risk_rating', risk_ctx.get('current_risk_rating', '0/5'))
-                                    if isinstance(risk_rating_str, str) and '/' in risk_rating_str:
-                                        risk_rating = float(risk_rating_str.split('/')[0].strip())
-                                        risk_level_display = risk_rating_str
-                                    else:
-                                        risk_rating = float(risk_rating_str) if risk_rating_str else 0
-                                        risk_level_display = f"{risk_rating}/5"
-                                    
-                                    # Extract residual_risk - try multiple field names
-                                    residual_risk_str = risk_ctx.get('residual_risk_after_existing_controls', 
-                                                                    risk_ctx.get('residual_risk_rating', 
-                                                                    risk_ctx.get('residual_risk', '0/5')))
-                                    if isinstance(residual_risk_str, str) and '/' in residual_risk_str:
-                                        residual_risk = float(residual_risk_str.split('/')[0].strip())
-                                    else:
-                                        residual_risk = float(residual_risk_str) if residual_risk_str else 0
-                                    
-                                    # Control gaps - check in risk_context first, then Agent 3
-                                    control_gaps = risk_ctx.get('control_gaps_identified', [])
-                                    if not control_gaps and st.session_state.control_result:
-                                        threat_controls = st.session_state.control_result.get('threat_control_evaluation', [])
-                                        if threat_controls:
-                                            first_threat = threat_controls[0]
-                                            control_gaps = first_threat.get('control_gaps', [])
-                                    
-                                    threat_info = {
-                                        'threat_name': risk_ctx.get('risk_description', 'Unknown'),
-                                        'risk_rating': risk_rating,
-                                        'risk_level': risk_level_display,
-                                        'residual_risk': residual_risk,
-                                        'control_gaps': control_gaps
-                                    }
-                                    
-                                    # Find decision question in sections
-                                    decision_question = None
-                                    control_selection_question = None
-                                    
-                                    for section in questions_sections:
-                                        if section.get('section_id') == 's1_treatment_decision':
-                                            questions = section.get('questions', [])
-                                            for q in questions:
-                                                if 'treatment_option' in q.get('question_id', '').lower() or 'select_treatment' in q.get('question_id', '').lower():
-                                                    decision_question = q
-                                        elif section.get('section_id') == 's2_treatment_details_treat':
-                                            questions = section.get('questions', [])
-                                            for q in questions:
-                                                if 'proposed_controls' in q.get('question_id', '').lower() or 'controls' in q.get('question_text', '').lower():
-                                                    control_selection_question = q
-                                
-                                elif questions_sections:
-                                    # Old structure: threat info in first section
-                                    first_section = questions_sections[0]
-                                    threat_info = first_section.get('threat_info', {})
-                                    questions = first_section.get('questions', [])
-                                    
-                                    # Find Q1.1 (treatment decision question) and Q1.2 (controls)
-                                    decision_question = None
-                                    control_selection_question = None
-                                    
-                                    for q in questions:
-                                        if q.get('question_id') == 'Q1.1':
-                                            decision_question = q
-                                        elif q.get('question_id') == 'Q1.2':
-                                            control_selection_question = q
-                                else:
-                                    threat_info = {}
-                                    decision_question = None
-                                    control_selection_question = None
+                                # ⚡ Threat info, decision questions and metric values derived once per result
+                                summary = _rtp_summary(result)
+                                threat_info = summary['threat_info']
+                                decision_question = summary['decision_question']
                                 
                                 # ============================================================
                                 # SHOW DECISION SUMMARY
@@ -4322,35 +4496,15 @@ def render_risk_assessment_page(api_key):
                                 # Current risk status
                                 col1, col2, col3, col4 = st.columns(4)
                                 with col1:
-                                    risk_rating = threat_info.get('risk_rating', 0)
-                                    risk_level_display = threat_info.get('risk_level', 'N/A')
-                                    
-                                    # Extract numeric value if it's a string like "4/5 (High)"
-                                    if isinstance(risk_level_display, str) and '/' in risk_level_display:
-                                        try:
-                                            risk_rating = float(risk_level_display.split('/')[0])
-                                        except:
-                                            pass
-                                    
+                                    risk_rating = summary['risk_rating']
                                     st.metric("Current Risk Rating", f"{risk_rating}/5", 
                                              delta="VERY HIGH" if risk_rating >= 4.5 else "HIGH" if risk_rating >= 3.5 else "MEDIUM")
                                 with col2:
                                     st.metric("Risk Level", threat_info.get('risk_level', 'N/A'))
                                 with col3:
-                                    residual_risk = threat_info.get('residual_risk', 0)
-                                    
-                                    # Handle string format like "1.58/5"
-                                    if isinstance(residual_risk, str) and '/' in str(residual_risk):
-                                        try:
-                                            residual_risk = float(str(residual_risk).split('/')[0])
-                                        except:
-                                            residual_risk = 0
-                                    elif not isinstance(residual_risk, (int, float)):
-                                        residual_risk = 0
-                                    
-                                    st.metric("Residual Risk", f"{residual_risk:.1f}/5")
+                                    st.metric("Residual Risk", f"{summary['residual_risk']:.1f}/5")
                                 with col4:
-                                    control_gaps = threat_info.get('control_gaps', [])
+                                    control_gaps = summary['control_gaps']
                                     st.metric("Control Gaps", len(control_gaps))
                                 
                                 # Control gaps identified
@@ -4486,16 +4640,19 @@ def render_risk_assessment_page(api_key):
                                     
                                     st.markdown("### Select Your Treatment Decision:")
                                     
+                                    # ⚡ Card bodies are built once per questionnaire; only the buttons are live widgets
+                                    cards = st.session_state.get('_decision_cards_html')
+                                    if not cards or cards[0] is not decision_options:
+                                        cards = (decision_options, {
+                                            opt.get('value', ''): _decision_card_html(opt) for opt in decision_options if isinstance(opt, dict)
+                                        })
+                                        st.session_state._decision_cards_html = cards
+                                    
                                     # Show all 4 options as expandable cards
                                     for opt in decision_options:
                                         if isinstance(opt, dict):
                                             value = opt.get('value', '')
                                             label = opt.get('label', '')
-                                            description = opt.get('description', '')
-                                            recommendation = opt.get('recommendation', '')
-                                            consequences = opt.get('consequences', '')
-                                            cost = opt.get('estimated_cost', '')
-                                            timeline = opt.get('typical_timeline', '')
                                             
                                             # Determine emoji
                                             if value == 'TREAT':
@@ -4516,43 +4673,7 @@ def render_risk_assessment_page(api_key):
                                             
                                             # Create expander with full details
                                             with st.expander(f"{emoji} **{value}** - {label}", expanded=expanded):
-                                                
-                                                # Description (FULL TEXT)
-                                                st.markdown(f"**Description:**")
-                                                st.info(description)
-                                                
-                                                # Recommendation (FULL TEXT)
-                                                if recommendation:
-                                                    st.markdown(f"**Recommendation:**")
-                                                    if "RECOMMENDED" in recommendation or "STRONGLY" in recommendation:
-                                                        st.success(recommendation)
-                                                    else:
-                                                        st.warning(recommendation)
-                                                
-                                                # Consequences (FULL TEXT)
-                                                if consequences:
-                                                    st.markdown(f"**Consequences:**")
-                                                    st.write(consequences)
-                                                
-                                                # Cost & Timeline
-                                                col1, col2 = st.columns(2)
-                                                with col1:
-                                                    if cost:
-                                                        st.markdown(f"**💰 Estimated Cost:**")
-                                                        st.code(cost)
-                                                with col2:
-                                                    if timeline:
-                                                        st.markdown(f"**⏱️ Timeline:**")
-                                                        st.code(timeline)
-                                                
-                                                # Approval/Monitoring requirements
-                                                approval = opt.get('approval_required', '')
-                                                monitoring = opt.get('monitoring_required', '')
-                                                
-                                                if approval:
-                                                    st.caption(f"✅ {approval}")
-                                                if monitoring:
-                                                    st.caption(f"📊 {monitoring}")
+                                                st.markdown(cards[1][value], unsafe_allow_html=True)
                                                 
                                                 # Selection button
                                                 st.markdown("---")
@@ -4589,8 +4710,7 @@ def render_risk_assessment_page(api_key):
                                 
                                 if decision == "ACCEPT":
                                     # Mark that we're showing the questionnaire (prevents re-rendering on widget interactions)
-                                    if 'showing_acceptance_questionnaire' not in st.session_state:
-                                        st.session_state.showing_acceptance_questionnaire = True
+                                    st.session_state.setdefault('showing_acceptance_questionnaire', True)
                                     
                                     st.markdown("### 📝 Risk Acceptance Questionnaire")
                                     st.info("📝 **Step 1:** Fill out the questionnaire to document your risk acceptance")
@@ -4599,12 +4719,7 @@ def render_risk_assessment_page(api_key):
                                     questions_sections = result.get('questions', result.get('sections', []))
                                     
                                     # Extract control gaps from Agent 3 results (NOT from RTP questionnaire)
-                                    control_gaps = []
-                                    if st.session_state.control_result:
-                                        threat_controls = st.session_state.control_result.get('threat_control_evaluation', [])
-                                        if threat_controls:
-                                            first_threat = threat_controls[0]
-                                            control_gaps = first_threat.get('control_gaps', [])
+                                    control_gaps = _agent3_first_threat().get('control_gaps', [])
                                     
                                     # Get risk ratings from Agent 2
                                     risk_rating = 0
@@ -4619,13 +4734,7 @@ def render_risk_assessment_page(api_key):
                                                 risk_rating = risk_eval
                                     
                                     # Get residual risk from Agent 3
-                                    residual_risk = 0
-                                    if st.session_state.control_result:
-                                        threat_controls = st.session_state.control_result.get('threat_control_evaluation', [])
-                                        if threat_controls:
-                                            first_threat = threat_controls[0]
-                                            residual_risk_data = first_threat.get('residual_risk', {})
-                                            residual_risk = residual_risk_data.get('residual_risk_value', 0)
+                                    residual_risk = _agent3_first_threat().get('residual_risk', {}).get('residual_risk_value', 0)
                                     
                                     # Generate acceptance questionnaire ONLY ONCE
                                     if 'acceptance_questionnaire' not in st.session_state:
@@ -4670,116 +4779,117 @@ def render_risk_assessment_page(api_key):
                                         st.json(acceptance_questionnaire)
                                         st.stop()
 
-                                    # Render acceptance questionnaire - NO FORM (Streamlit form bug workaround)
+                                    # Render acceptance questionnaire
                                     
                                     # Initialize form values storage
-                                    if 'acceptance_form_values' not in st.session_state:
-                                        st.session_state.acceptance_form_values = {}
+                                    st.session_state.setdefault('acceptance_form_values', {})
                                     
                                     acceptance_answers = {}
                                     
-                                    for section in acceptance_questionnaire['sections']:
-                                        section_title = section.get('title') or section.get('section_title', 'Section')
-                                        st.markdown(f"### {section_title}")
-                                        if section.get('description'):
-                                            st.info(section['description'])
+                                    # ⚡ Batch the questionnaire in a form: typing doesn't rerun the page until submit.
+                                    # Keyed widgets still land in st.session_state, which the submit handler reads.
+                                    with st.form("acceptance_questionnaire_form", clear_on_submit=False):
+                                        for section in acceptance_questionnaire['sections']:
+                                            section_title = section.get('title') or section.get('section_title', 'Section')
+                                            st.markdown(f"### {section_title}")
+                                            if section.get('description'):
+                                                st.info(section['description'])
                                         
-                                        for question in section['questions']:
-                                            q_id = question.get('id', question.get('question_id', 'Q'))
-                                            q_text = question.get('text', question.get('question_text', 'Question'))
-                                            q_type = question.get('type', question.get('question_type', 'text'))
-                                            q_help = question.get('help_text', '')
-                                            options = question.get('options', [])
+                                            for question in section['questions']:
+                                                q_id = question.get('id', question.get('question_id', 'Q'))
+                                                q_text = question.get('text', question.get('question_text', 'Question'))
+                                                q_type = question.get('type', question.get('question_type', 'text'))
+                                                q_help = question.get('help_text', '')
+                                                options = question.get('options', [])
                                             
-                                            # Get default value from session state (persists across reruns)
-                                            default_value = st.session_state.get(f"accept_{q_id}", '')
+                                                # Get default value from session state (persists across reruns)
+                                                default_value = st.session_state.get(f"accept_{q_id}", '')
                                             
-                                            # Render input WITHOUT form - values auto-save to session_state
-                                            if q_type in ['text_area', 'textarea']:
-                                                val = st.text_area(q_text, value=default_value or '', key=f"accept_{q_id}", help=q_help, height=100)
-                                                acceptance_answers[q_id] = val
-                                            elif q_type == 'text':
-                                                val = st.text_input(q_text, value=default_value or '', key=f"accept_{q_id}", help=q_help)
-                                                acceptance_answers[q_id] = val
-                                            elif q_type == 'email':
-                                                val = st.text_input(q_text, value=default_value or '', key=f"accept_{q_id}", help=q_help, placeholder="email@example.com")
-                                                acceptance_answers[q_id] = val
-                                            elif q_type == 'number':
-                                                val = st.number_input(q_text, key=f"accept_{q_id}", help=q_help, min_value=0)
-                                                acceptance_answers[q_id] = val
-                                            elif q_type == 'date':
-                                                from datetime import date
-                                                val = st.date_input(q_text, value=date.today(), key=f"accept_{q_id}", help=q_help)
-                                                acceptance_answers[q_id] = val
-                                            elif q_type in ['select', 'dropdown']:
-                                                if options:
-                                                    display_options = []
-                                                    for opt in options:
-                                                        if isinstance(opt, dict):
-                                                            display_options.append(opt.get('label', opt.get('value', str(opt))))
-                                                        else:
-                                                            display_options.append(str(opt))
-                                                    val = st.selectbox(q_text, options=display_options, key=f"accept_{q_id}", help=q_help)
+                                                # Keyed widgets inside the form are written to st.session_state on submit;
+                                                # the submit handler below reads them from there, not from these return values
+                                                if q_type in ['text_area', 'textarea']:
+                                                    val = st.text_area(q_text, value=default_value or '', key=f"accept_{q_id}", help=q_help, height=100)
                                                     acceptance_answers[q_id] = val
-                                                else:
-                                                    val = st.text_input(q_text, key=f"accept_{q_id}", help=q_help)
+                                                elif q_type == 'text':
+                                                    val = st.text_input(q_text, value=default_value or '', key=f"accept_{q_id}", help=q_help)
                                                     acceptance_answers[q_id] = val
-                                            elif q_type == 'radio':
-                                                if options:
-                                                    val = st.radio(q_text, options=options, key=f"accept_{q_id}", help=q_help)
+                                                elif q_type == 'email':
+                                                    val = st.text_input(q_text, value=default_value or '', key=f"accept_{q_id}", help=q_help, placeholder="email@example.com")
                                                     acceptance_answers[q_id] = val
-                                                else:
-                                                    val = st.text_input(q_text, key=f"accept_{q_id}", help=q_help)
+                                                elif q_type == 'number':
+                                                    val = st.number_input(q_text, key=f"accept_{q_id}", help=q_help, min_value=0)
                                                     acceptance_answers[q_id] = val
-                                            elif q_type in ['checkbox', 'multiselect']:
-                                                if options:
-                                                    st.markdown(f"**{q_text}**")
-                                                    if q_help:
-                                                        st.caption(q_help)
+                                                elif q_type == 'date':
+                                                    val = st.date_input(q_text, value=date.today(), key=f"accept_{q_id}", help=q_help)
+                                                    acceptance_answers[q_id] = val
+                                                elif q_type in ['select', 'dropdown']:
+                                                    if options:
+                                                        display_options = []
+                                                        for opt in options:
+                                                            if isinstance(opt, dict):
+                                                                display_options.append(opt.get('label', opt.get('value', str(opt))))
+                                                            else:
+                                                                display_options.append(str(opt))
+                                                        val = st.selectbox(q_text, options=display_options, key=f"accept_{q_id}", help=q_help)
+                                                        acceptance_answers[q_id] = val
+                                                    else:
+                                                        val = st.text_input(q_text, key=f"accept_{q_id}", help=q_help)
+                                                        acceptance_answers[q_id] = val
+                                                elif q_type == 'radio':
+                                                    if options:
+                                                        val = st.radio(q_text, options=options, key=f"accept_{q_id}", help=q_help)
+                                                        acceptance_answers[q_id] = val
+                                                    else:
+                                                        val = st.text_input(q_text, key=f"accept_{q_id}", help=q_help)
+                                                        acceptance_answers[q_id] = val
+                                                elif q_type in ['checkbox', 'multiselect']:
+                                                    if options:
+                                                        st.markdown(f"**{q_text}**")
+                                                        if q_help:
+                                                            st.caption(q_help)
                                                     
-                                                    selected = []
-                                                    for idx, opt in enumerate(options):
-                                                        if isinstance(opt, dict):
-                                                            control_name = opt.get('label', opt.get('control_name', f'Control {idx+1}'))
-                                                            control_desc = opt.get('description', '')
-                                                            priority = opt.get('priority', 'N/A')
-                                                            control_type = opt.get('control_type', 'N/A')
-                                                            cost = opt.get('cost', 'N/A')
-                                                            timeline = opt.get('timeline', 'N/A')
-                                                            complexity = opt.get('complexity', 'N/A')
-                                                            risk_reduction = opt.get('risk_reduction', 'N/A')
+                                                        selected = []
+                                                        for idx, opt in enumerate(options):
+                                                            if isinstance(opt, dict):
+                                                                control_name = opt.get('label', opt.get('control_name', f'Control {idx+1}'))
+                                                                control_desc = opt.get('description', '')
+                                                                priority = opt.get('priority', 'N/A')
+                                                                control_type = opt.get('control_type', 'N/A')
+                                                                cost = opt.get('cost', 'N/A')
+                                                                timeline = opt.get('timeline', 'N/A')
+                                                                complexity = opt.get('complexity', 'N/A')
+                                                                risk_reduction = opt.get('risk_reduction', 'N/A')
                                                             
-                                                            with st.expander(f"✅ {control_name}", expanded=False):
-                                                                col1, col2 = st.columns(2)
+                                                                with st.expander(f"✅ {control_name}", expanded=False):
+                                                                    col1, col2 = st.columns(2)
                                                                 
-                                                                with col1:
-                                                                    st.markdown(f"**Description:** {control_desc}")
-                                                                    st.markdown(f"**Priority:** {priority}")
-                                                                    st.markdown(f"**Type:** {control_type}")
+                                                                    with col1:
+                                                                        st.markdown(f"**Description:** {control_desc}")
+                                                                        st.markdown(f"**Priority:** {priority}")
+                                                                        st.markdown(f"**Type:** {control_type}")
                                                                 
-                                                                with col2:
-                                                                    st.markdown(f"**💰 Cost:** {cost}")
-                                                                    st.markdown(f"**⏱️ Timeline:** {timeline}")
-                                                                    st.markdown(f"**📉 Risk Reduction:** {risk_reduction}")
+                                                                    with col2:
+                                                                        st.markdown(f"**💰 Cost:** {cost}")
+                                                                        st.markdown(f"**⏱️ Timeline:** {timeline}")
+                                                                        st.markdown(f"**📉 Risk Reduction:** {risk_reduction}")
                                                                 
-                                                                st.markdown(f"**Complexity:** {complexity}")
+                                                                    st.markdown(f"**Complexity:** {complexity}")
                                                                 
-                                                                if st.checkbox(f"Select {control_name}", key=f"accept_{q_id}_opt_{idx}"):
-                                                                    selected.append(opt)
-                                                        else:
-                                                            if st.checkbox(str(opt), key=f"accept_{q_id}_opt_{idx}"):
-                                                                selected.append(str(opt))
+                                                                    if st.checkbox(f"Select {control_name}", key=f"accept_{q_id}_opt_{idx}"):
+                                                                        selected.append(opt)
+                                                            else:
+                                                                if st.checkbox(str(opt), key=f"accept_{q_id}_opt_{idx}"):
+                                                                    selected.append(str(opt))
                                                     
-                                                    acceptance_answers[q_id] = selected
+                                                        acceptance_answers[q_id] = selected
+                                                    else:
+                                                        st.warning(f"⚠️ No options available for {q_text}")
+                                                        acceptance_answers[q_id] = []
                                                 else:
-                                                    st.warning(f"⚠️ No options available for {q_text}")
-                                                    acceptance_answers[q_id] = []
-                                            else:
-                                                val = st.text_input(q_text, key=f"accept_{q_id}", help=q_help)
-                                                acceptance_answers[q_id] = val
+                                                    val = st.text_input(q_text, key=f"accept_{q_id}", help=q_help)
+                                                    acceptance_answers[q_id] = val
                                     
-                                    # Submit button OUTSIDE form
-                                    submitted = st.button("✅ Submit & Generate Acceptance Form", type="primary", use_container_width=True, key="submit_acceptance_form")
+                                        submitted = st.form_submit_button("✅ Submit & Generate Acceptance Form", type="primary", use_container_width=True)
                                     
                                     if submitted:
                                         # 🔧 FIX: Read values from session state AFTER form submission
@@ -4843,8 +4953,8 @@ def render_risk_assessment_page(api_key):
                                         
                                         # Convert date objects to strings for JSON serialization
                                         for key, value in acceptance_answers_final.items():
-                                            if hasattr(value, 'strftime'):
-                                                acceptance_answers_final[key] = value.strftime('%Y-%m-%d')
+                                            if isinstance(value, date):
+                                                acceptance_answers_final[key] = value.isoformat()
                                         
                                         # Store in session state for persistence
                                         st.session_state.acceptance_form_values = acceptance_answers_final.copy()
@@ -4924,13 +5034,10 @@ def render_risk_assessment_page(api_key):
                                         
                                         with st.spinner("⏳ Generating acceptance form..."):
                                             try:
-                                                from phase2_risk_resolver.agents.agent_4_acceptance_form import generate_acceptance_form
-                                                
                                                 # DEBUG: Verify API key before calling
                                                 if not api_key or api_key.strip() == '':
                                                     st.error("🔑 API key is empty! Attempting to retrieve from manager...")
                                                     try:
-                                                        from api_key_manager import get_active_api_key
                                                         api_key = get_active_api_key()
                                                         if api_key:
                                                             st.success(f"🔑 Retrieved API key from manager (length: {len(api_key)})")
@@ -5002,9 +5109,9 @@ def render_risk_assessment_page(api_key):
                                                 
                                             except Exception as e:
                                                 st.error(f"❌ Error: {str(e)}")
-                                                import traceback
-                                                with st.expander("Debug"):
-                                                    st.code(traceback.format_exc())
+                                                if st.session_state.get('debug_mode', False):  # ⚡ only walk the stack when someone will read it
+                                                    with st.expander("Debug"):
+                                                        st.code(traceback.format_exc())
                                 
                                 # ============================================================
                                 # IF TREAT: Auto-Generate Treatment Plan (FULLY AGENTIC)
@@ -5024,35 +5131,26 @@ def render_risk_assessment_page(api_key):
                                         
                                         # Extract risk_rating
                                         risk_rating_str = risk_ctx.get('risk_rating', risk_ctx.get('current_risk_rating', '0/5'))
+                                        risk_rating = _parse_rating(risk_rating_str)
                                         if isinstance(risk_rating_str, str) and '/' in risk_rating_str:
-                                            risk_rating = float(risk_rating_str.split('/')[0].strip())
                                             risk_level_display = risk_rating_str
                                         else:
-                                            risk_rating = float(risk_rating_str) if risk_rating_str else 0
                                             risk_level_display = f"{risk_rating}/5"
                                         
                                         # Extract residual_risk
                                         residual_risk_str = risk_ctx.get('residual_risk_after_existing_controls', 
                                                                         risk_ctx.get('residual_risk_rating', 
                                                                         risk_ctx.get('residual_risk', '0/5')))
-                                        if isinstance(residual_risk_str, str) and '/' in residual_risk_str:
-                                            residual_risk = float(residual_risk_str.split('/')[0].strip())
-                                        else:
-                                            residual_risk = float(residual_risk_str) if residual_risk_str else 0
+                                        residual_risk = _parse_rating(residual_risk_str)
                                         
                                         # 🔧 FIX: Get control gaps AND recommended controls from Agent 3
                                         control_gaps = risk_ctx.get('control_gaps_identified', [])
-                                        recommended_controls = []
-                                        
-                                        if st.session_state.control_result:
-                                            threat_controls = st.session_state.control_result.get('threat_control_evaluation', [])
-                                            if threat_controls:
-                                                first_threat = threat_controls[0]
-                                                # Get gaps if not in risk_ctx
-                                                if not control_gaps:
-                                                    control_gaps = first_threat.get('control_gaps', [])
-                                                # ? CRITICAL: Get recommended controls from Agent 3
-                                                recommended_controls = first_threat.get('recommended_controls', [])
+                                        first_threat = _agent3_first_threat()
+                                        # Get gaps if not in risk_ctx
+                                        if not control_gaps:
+                                            control_gaps = first_threat.get('control_gaps', [])
+                                        # ? CRITICAL: Get recommended controls from Agent 3
+                                        recommended_controls = first_threat.get('recommended_controls', [])
                                         
                                         threat_info = {
                                             'threat_name': risk_ctx.get('risk_description', 'Unknown'),
@@ -5103,8 +5201,7 @@ def render_risk_assessment_page(api_key):
                                             st.info("📋 **Select which controls you want to implement:**")
                                             
                                             # Initialize session state for selected controls
-                                            if 'selected_controls_for_treatment' not in st.session_state:
-                                                st.session_state.selected_controls_for_treatment = list(range(len(recommended_controls)))
+                                            st.session_state.setdefault('selected_controls_for_treatment', list(range(len(recommended_controls))))
                                             
                                             for idx, control in enumerate(recommended_controls):
                                                 if isinstance(control, dict):
@@ -5172,8 +5269,7 @@ def render_risk_assessment_page(api_key):
                                             
                                             if control_gaps:
                                                 # Initialize session state for selected gaps
-                                                if 'selected_gaps_for_treatment' not in st.session_state:
-                                                    st.session_state.selected_gaps_for_treatment = list(range(len(control_gaps)))
+                                                st.session_state.setdefault('selected_gaps_for_treatment', list(range(len(control_gaps))))
                                                 
                                                 for idx, gap in enumerate(control_gaps):
                                                     if isinstance(gap, dict):
@@ -5228,8 +5324,6 @@ def render_risk_assessment_page(api_key):
                                                 else:
                                                     with st.spinner("🤖 AI is generating treatment plan for selected controls..."):
                                                         try:
-                                                            from phase2_risk_resolver.agents.agent_4_treatment_plan import generate_treatment_plan
-                                                            
                                                             # 🔧 FIX: Get SELECTED CONTROLS (not gaps)
                                                             selected_indices = st.session_state.selected_controls_for_treatment
                                                             selected_controls = [recommended_controls[i] for i in selected_indices if i < len(recommended_controls)]
@@ -5284,9 +5378,9 @@ def render_risk_assessment_page(api_key):
                                                                 st.rerun()
                                                         except Exception as e:
                                                             st.error(f"❌ Error: {str(e)}")
-                                                            import traceback
-                                                            with st.expander("Debug"):
-                                                                st.code(traceback.format_exc())
+                                                            if st.session_state.get('debug_mode', False):  # ⚡ only walk the stack when someone will read it
+                                                                with st.expander("Debug"):
+                                                                    st.code(traceback.format_exc())
                                             else:
                                                 # Fallback: User is selecting from gaps (old behavior)
                                                 if not st.session_state.get('selected_gaps_for_treatment', []):
@@ -5294,8 +5388,6 @@ def render_risk_assessment_page(api_key):
                                                 else:
                                                     with st.spinner("🤖 AI is discovering template structure and generating treatment plan..."):
                                                         try:
-                                                            from phase2_risk_resolver.agents.agent_4_treatment_plan import generate_treatment_plan
-                                                            
                                                             # Filter selected gaps only
                                                             selected_indices = st.session_state.selected_gaps_for_treatment
                                                             selected_gaps = [control_gaps[i] for i in selected_indices if i < len(control_gaps)]
@@ -5349,9 +5441,9 @@ def render_risk_assessment_page(api_key):
                                                                 st.rerun()
                                                         except Exception as e:
                                                             st.error(f"❌ Error: {str(e)}")
-                                                            import traceback
-                                                            with st.expander("Debug"):
-                                                                st.code(traceback.format_exc())
+                                                            if st.session_state.get('debug_mode', False):  # ⚡ only walk the stack when someone will read it
+                                                                with st.expander("Debug"):
+                                                                    st.code(traceback.format_exc())
                                     else:
                                         st.warning("⚠️ No questionnaire data available")
                             
@@ -5591,7 +5683,7 @@ def render_risk_assessment_page(api_key):
                                     else:
                                         st.download_button(
                                             label="📥 Download Acceptance Form (JSON)",
-                                            data=json.dumps(acceptance_form, indent=2),
+                                            data=_json_download(acceptance_form),
                                             file_name=f"Risk_Acceptance_Form_{datetime.now().strftime('%Y%m%d')}.json",
                                             mime="application/json",
                                             use_container_width=True
@@ -5601,8 +5693,6 @@ def render_risk_assessment_page(api_key):
                                     if st.button("💾 Save Acceptance Form to Risk Register", type="primary", use_container_width=True):
                                         with st.spinner("💾 Saving to database..."):
                                             try:
-                                                from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                
                                                 # Enhance decision result with acceptance form
                                                 enhanced_decision = {
                                                     **result,
@@ -5619,6 +5709,7 @@ def render_risk_assessment_page(api_key):
                                                     agent_3_results=st.session_state.control_result,
                                                     agent_4_results=enhanced_decision
                                                 )
+                                                _next_risk_id.clear()  # New row invalidates the cached next Risk ID
                                                 
                                                 st.session_state.risk_ids = risk_ids
                                                 st.session_state.output_result = {'status': 'saved', 'risk_ids': risk_ids}
@@ -5715,7 +5806,7 @@ def render_risk_assessment_page(api_key):
                                         reduction = expected.get('risk_reduction_percentage', '0%')
                                         if current > 0 and after:
                                             try:
-                                                after_num = float(str(after).split('/')[0]) if '/' in str(after) else float(after)  # pyright: ignore
+                                                after_num = _parse_rating(after)
                                                 reduction = f"{((current - after_num) / current) * 100:.0f}%" if after_num else '0%'
                                             except:
                                                 pass
@@ -5756,8 +5847,6 @@ def render_risk_assessment_page(api_key):
                                     if st.button("💾 Save Treatment Plan to Risk Register", type="primary", use_container_width=True):
                                         with st.spinner("💾 Saving to database..."):
                                             try:
-                                                from phase2_risk_resolver.database.save_to_register import save_assessment_to_risk_register
-                                                
                                                 # Enhance decision result with treatment plan
                                                 enhanced_decision = {
                                                     **result,
@@ -5773,6 +5862,7 @@ def render_risk_assessment_page(api_key):
                                                     agent_3_results=st.session_state.control_result,
                                                     agent_4_results=enhanced_decision
                                                 )
+                                                _next_risk_id.clear()  # New row invalidates the cached next Risk ID
                                                 
                                                 st.session_state.risk_ids = risk_ids
                                                 st.session_state.output_result = {'status': 'saved', 'risk_ids': risk_ids}
@@ -5786,7 +5876,7 @@ def render_risk_assessment_page(api_key):
                                     # Download treatment plan
                                     st.download_button(
                                         label="📥 Download Treatment Plan (JSON)",
-                                        data=json.dumps(treatment_plan, indent=2),
+                                        data=_json_download(treatment_plan),
                                         file_name=f"treatment_plan_{selected_asset['asset_name'].replace(' ', '_')}.json",
                                         mime="application/json",
                                         use_container_width=True
@@ -5894,6 +5984,9 @@ def render_sidebar():
         else:
             st.info("⚪ Agent 4: Not run")
         
+        st.markdown("---")
+        st.toggle("🐛 Debug mode", key="debug_mode", help="Show the data sent to the risk register on save, and tracebacks when a generate/save step fails")
+        
         return api_key
 
 # ===================================================================
@@ -104,6 +104,7 @@ def create_risk_register_database():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_status ON risks(status)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_priority ON risks(priority)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_risk_owner ON risks(risk_owner)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_risks_num ON risks(CAST(SUBSTR(risk_id, 5) AS INTEGER)) WHERE risk_id LIKE 'RSK-%'")
     
     print("✅ Indexes created successfully!\n")
     
@@ -250,6 +250,37 @@ def generate_mitigation_plan(treatment_decision: str, treatment_plan: Dict = Non
         return "Mitigation plan pending - awaiting management decision"
 
 
+# Single-row counter holding the last allocated RSK-### number
+RISK_COUNTER_DDL = "CREATE TABLE IF NOT EXISTS risk_counter (id INTEGER PRIMARY KEY CHECK (id = 1), last INTEGER NOT NULL)"
+
+# Highest existing RSK-### number - one entry read from the idx_risks_num expression index
+LAST_RISK_NUM_SQL = (
+    "(SELECT CAST(SUBSTR(risk_id, 5) AS INTEGER) FROM risks WHERE risk_id LIKE 'RSK-%' "
+    "ORDER BY CAST(SUBSTR(risk_id, 5) AS INTEGER) DESC LIMIT 1)"
+)
+
+
+def allocate_risk_id(cursor) -> str:
+    """
+    Atomically reserve the next sequential risk ID
+    
+    Bumps the risk_counter row with UPDATE ... RETURNING inside the caller's
+    transaction, so concurrent saves serialize on SQLite's write lock instead
+    of racing on MAX()+1. The counter is floored at the highest existing ID,
+    so rows inserted by other tools can never be handed out again.
+    
+    Returns:
+        Risk ID in RSK-### format
+    """
+    cursor.execute(RISK_COUNTER_DDL)
+    cursor.execute("INSERT OR IGNORE INTO risk_counter (id, last) VALUES (1, 0)")
+    cursor.execute(
+        f"UPDATE risk_counter SET last = MAX(last, COALESCE({LAST_RISK_NUM_SQL}, 0)) + 1 "
+        "WHERE id = 1 RETURNING last"
+    )
+    return f"RSK-{cursor.fetchone()[0]:03d}"
+
+
 def save_assessment_to_risk_register(
     asset_data: Dict[str, Any],
     agent_1_results: Dict[str, Any],
@@ -682,11 +713,8 @@ def save_assessment_to_risk_register(
                             priority = rtp_answers.get('Q1.5', 'Medium')
                             target_date = rtp_answers.get('Q1.4')
                 
-                # Get next sequential risk ID from database
-                cursor.execute("SELECT MAX(CAST(SUBSTR(risk_id, 6) AS INTEGER)) FROM risks WHERE risk_id LIKE 'RSK-%'")
-                result = cursor.fetchone()
-                next_num = (result[0] or 0) + 1
-                risk_id = f"RSK-{next_num:03d}"
+                # Reserve next sequential risk ID (atomic counter, safe across concurrent sessions)
+                risk_id = allocate_risk_id(cursor)
                 
                 # ✅ NEW: Generate mitigation plan text with all decision types
                 mitigation_plan = generate_mitigation_plan(treatment_decision, treatment_plan, acceptance_form, transfer_form, terminate_form)
@@ -112,6 +112,14 @@ CREATE INDEX idx_risk_rating ON risks(risk_rating);
 CREATE INDEX idx_status ON risks(status);
 CREATE INDEX idx_risk_owner ON risks(risk_owner);
 CREATE INDEX idx_date_identified ON risks(date_identified);
+CREATE INDEX idx_risks_num ON risks(CAST(SUBSTR(risk_id, 5) AS INTEGER)) WHERE risk_id LIKE 'RSK-%';
+
+-- RISK ID COUNTER (single row, last allocated RSK-### number)
+CREATE TABLE risk_counter (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last INTEGER NOT NULL
+);
+INSERT INTO risk_counter (id, last) VALUES (1, 0);
 
 -- TRIGGER FOR AUTO-UPDATE
 CREATE TRIGGER update_timestamp 
@@ -113,7 +113,8 @@ def show_questionnaire_form(token):
             import html
             def clean_html_recursive(obj):
                 if isinstance(obj, str):
-                    return html.unescape(obj)
+                    # ⚡ Most strings carry no entity - skip the call entirely
+                    return html.unescape(obj) if '&' in obj else obj
                 elif isinstance(obj, dict):
                     return {k: clean_html_recursive(v) for k, v in obj.items()}
                 elif isinstance(obj, list):
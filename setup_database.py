@@ -137,6 +137,7 @@ cursor.execute("CREATE INDEX IF NOT EXISTS idx_risk_rating ON risks(risk_rating)
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_status ON risks(status)")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_risk_owner ON risks(risk_owner)")
 cursor.execute("CREATE INDEX IF NOT EXISTS idx_date_identified ON risks(date_identified)")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_risks_num ON risks(CAST(SUBSTR(risk_id, 5) AS INTEGER)) WHERE risk_id LIKE 'RSK-%'")
 print("Indexes created!\n")
 
 # Create trigger for auto-update